@@ -1,5 +1,7 @@
 import os
-from typing import Any, Generator
+import stat
+from pathlib import Path
+from typing import Any, Callable, Generator, List
 
 import pytest
 from _pytest.nodes import Item
@@ -8,6 +10,7 @@ from environs import Env
 from kolga.hooks.plugins import PluginBase
 from kolga.libs.helm import Helm
 from kolga.libs.kubernetes import Kubernetes
+from kolga.utils.environment import invalidate_environment
 
 
 @pytest.fixture()
@@ -29,7 +32,41 @@ def helm() -> Generator[Helm, None, None]:
 def test_namespace(kubernetes: Kubernetes) -> Generator[str, None, None]:
     namespace = kubernetes.create_namespace()
     yield namespace
-    kubernetes.delete_namespace()
+    kubernetes.delete_namespace(wait=True)
+
+
+FakeBinaries = Callable[..., Path]
+
+
+@pytest.fixture()
+def fake_binaries(tmp_path: Path, monkeypatch: Any) -> FakeBinaries:
+    """
+    Put fake versions of command line tools first on PATH
+
+    The returned function takes the names of the tools to fake and returns a
+    log file. Every call of a fake tool appends a ``start`` and an ``end``
+    line with a timestamp and the arguments of the call to it. The tools
+    sleep for ``duration`` seconds and print ``output``.
+    """
+
+    def create(names: List[str], duration: float = 0.5, output: str = "") -> Path:
+        bin_path = tmp_path / "bin"
+        bin_path.mkdir(exist_ok=True)
+        log_file = tmp_path / "calls.log"
+        for name in names:
+            script = bin_path / name
+            script.write_text(
+                "#!/bin/sh\n"
+                f'echo "start $(date +%s.%N) {name} $*" >> {log_file}\n'
+                f"sleep {duration}\n"
+                f'echo "end $(date +%s.%N) {name} $*" >> {log_file}\n'
+                f"echo '{output}'\n"
+            )
+            script.chmod(script.stat().st_mode | stat.S_IEXEC)
+        monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+        return log_file
+
+    return create
 
 
 @pytest.fixture()
@@ -53,6 +90,9 @@ def test_plugin() -> type:
 
 
 def pytest_runtest_setup(item: Item) -> None:
+    # Tests patch os.environ, start each of them with a fresh snapshot
+    invalidate_environment()
+
     if item.get_closest_marker("k8s") and os.environ.get(
         "TEST_CLUSTER_ACTIVE", False
     ) not in [1, "1", True, "True"]:
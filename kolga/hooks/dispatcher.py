@@ -0,0 +1,156 @@
+import atexit
+import functools
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, Callable, List, Mapping, NamedTuple, Optional
+
+import pluggy
+
+from kolga.utils.logger import logger
+
+
+class _HookCall(NamedTuple):
+    name: str
+    function: Callable[[], Any]
+    deadline: float
+    future: "Future[Any]"
+
+
+class HookDispatcher:
+    """
+    Run hooks in background threads
+
+    Each dispatched hook is called through the plugin manager in a pool of
+    worker threads, so that a slow plugin does not hold up the caller. The
+    hook call runs the implementations like a direct call would, including
+    hook wrappers and their ``tryfirst``/``trylast`` order. The calls are
+    waited for in :meth:`flush`, which is also called when the process exits.
+    The workers are daemon threads, hooks that do not finish in time do not
+    keep the process alive.
+
+    Args:
+        plugin_manager: Plugin manager with the hook implementations
+        max_workers: Maximum number of hooks run at once
+        timeout: Default number of seconds a hook is waited for
+        flush_timeout: Default number of seconds :meth:`flush` waits for
+    """
+
+    def __init__(
+        self,
+        plugin_manager: pluggy.PluginManager,
+        max_workers: int = 4,
+        timeout: float = 30,
+        flush_timeout: float = 60,
+    ) -> None:
+        self.plugin_manager = plugin_manager
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.flush_timeout = flush_timeout
+        self._calls: List[_HookCall] = []
+        self._queue: "Queue[_HookCall]" = Queue()
+        self._workers: List[Thread] = []
+        self._lock = Lock()
+
+    @property
+    def pending(self) -> bool:
+        """
+        True if there are dispatched hooks that have not been flushed
+        """
+        with self._lock:
+            return bool(self._calls)
+
+    def dispatch(
+        self,
+        hook_name: str,
+        hook_kwargs: Mapping[str, Any],
+        timeout: Optional[float] = None,
+    ) -> "Future[List[Any]]":
+        """
+        Start running a hook
+
+        Args:
+            hook_name: Name of the hook
+            hook_kwargs: Arguments of the hook
+            timeout: Seconds the hook is waited for, counted from now.
+                Defaults to the timeout of the dispatcher.
+
+        Returns:
+            A future of the results of the hook implementations
+        """
+        hook = getattr(self.plugin_manager.hook, hook_name)
+        call = _HookCall(
+            name=hook_name,
+            function=functools.partial(hook, **hook_kwargs),
+            deadline=time.monotonic() + (self.timeout if timeout is None else timeout),
+            future=Future(),
+        )
+
+        with self._lock:
+            self._calls.append(call)
+            self._queue.put(call)
+            self._start_workers(len(self._calls))
+
+        return call.future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the dispatched hooks to finish
+
+        Each hook is waited for until its own timeout or the timeout of the
+        flush is reached, whichever comes first. Hooks that are still running
+        after that are abandoned and the ones that have not started are
+        cancelled.
+
+        Args:
+            timeout: Maximum number of seconds to wait for. Defaults to the
+                flush timeout of the dispatcher.
+
+        Returns:
+            True if all of the hooks finished in time
+        """
+        flush_deadline = time.monotonic() + (
+            self.flush_timeout if timeout is None else timeout
+        )
+        with self._lock:
+            calls, self._calls = self._calls, []
+
+        finished = True
+        for call in calls:
+            remaining = min(call.deadline, flush_deadline) - time.monotonic()
+            try:
+                call.future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                call.future.cancel()
+                logger.warning(message=f"Hook {call.name} did not finish in time")
+                finished = False
+            except Exception as e:
+                logger.error(
+                    message=f"Hook {call.name} failed: ",
+                    error=e,
+                    raise_exception=False,
+                )
+        return finished
+
+    def _start_workers(self, count: int) -> None:
+        if not self._workers:
+            atexit.register(self.flush)
+
+        while len(self._workers) < min(count, self.max_workers):
+            worker = Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self) -> None:
+        while True:
+            call = self._queue.get()
+            if not call.future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = call.function()
+            except Exception as e:
+                call.future.set_exception(e)
+            else:
+                call.future.set_result(result)
@@ -1,4 +1,4 @@
-from typing import TYPE_CHECKING, Any, Callable, Optional, TypeVar, cast
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, TypeVar, cast
 
 import pluggy  # type: ignore
 
@@ -32,3 +32,25 @@ class KolgaHookSpec:
 
             The return value is not acted upon by Kólga.
         """
+
+    @hookspec
+    def deployment_complete(
+        self, projects: List["Project"], track: str, namespace: str
+    ) -> Optional[bool]:
+        """
+        Fired once all projects of a deployment have been deployed successfully.
+
+        Use this hook instead of `project_deployment_complete` to send a single
+        notification for the whole deployment.
+
+        Args:
+            namespace: Namespace of the deployment
+            track: Track of the deployment
+            projects: The deployed projects, the main project last
+
+        Returns:
+            Optionally returns a boolean value denoting if the plugin
+            finished successfully.
+
+            The return value is not acted upon by Kólga.
+        """
@@ -1,10 +1,17 @@
 import os
-from typing import Any, List, Tuple
+import sys
+from importlib import import_module
+from importlib.metadata import EntryPoint, entry_points
+from typing import Any, Iterable, List, NamedTuple, Tuple, Type
 
 from environs import Env, ParserMethod
 
+from kolga.utils.logger import logger
+
 from .exceptions import PluginMissingConfiguration
 
+PLUGIN_ENTRY_POINT_GROUP = "kolga.plugins"
+
 
 class EmptyVariables:
     pass
@@ -34,3 +41,71 @@ class PluginBase:
             if os.getenv(variable):
                 setattr(self, variable, cast_func(variable))
         self.configured = True
+
+
+class PluginSpec(NamedTuple):
+    """
+    Where to find a plugin and the variables it requires
+
+    The module of the plugin is only imported when all of the required
+    variables are set, so that plugins that are not configured add nothing
+    to the startup time.
+
+    Attributes:
+        name: Name of the plugin
+        plugin: The plugin class as ``module:attribute``
+        required_variables: Variables that have to be set for the plugin to load
+    """
+
+    name: str
+    plugin: str
+    required_variables: Tuple[str, ...] = ()
+
+    def is_configured(self) -> bool:
+        return all(os.environ.get(variable) for variable in self.required_variables)
+
+    def load(self) -> Type[PluginBase]:
+        module_name, _, attribute = self.plugin.partition(":")
+        plugin: Type[PluginBase] = getattr(import_module(module_name), attribute)
+        return plugin
+
+
+def _get_entry_points(group: str) -> Iterable[EntryPoint]:
+    if sys.version_info >= (3, 10):
+        return entry_points(group=group)
+    return entry_points().get(group, [])
+
+
+def discover_plugins(core_plugins: Iterable[PluginSpec]) -> List[PluginSpec]:
+    """
+    Find the core plugins and the plugins of installed packages
+
+    Packages add plugins with entry points in the ``kolga.plugins`` group.
+    An entry point refers to a :class:`PluginSpec`, which should be defined
+    in a module that is cheap to import. Core plugins take precedence over
+    installed plugins of the same name.
+
+    Args:
+        core_plugins: Plugins that ship with Kólga
+
+    Returns:
+        Specifications of all of the plugins
+    """
+    plugins = {plugin.name: plugin for plugin in core_plugins}
+
+    for entry_point in _get_entry_points(PLUGIN_ENTRY_POINT_GROUP):
+        if entry_point.name in plugins:
+            continue
+        try:
+            plugin = entry_point.load()
+        except Exception as e:
+            logger.warning(message=f"Could not load plugin {entry_point.name}: {e}")
+            continue
+        if not isinstance(plugin, PluginSpec):
+            logger.warning(
+                message=f"Plugin {entry_point.name} does not refer to a PluginSpec"
+            )
+            continue
+        plugins[entry_point.name] = plugin
+
+    return list(plugins.values())
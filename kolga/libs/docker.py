@@ -1,12 +1,21 @@
-import re
+import json
 from pathlib import Path
-from typing import List
+from tempfile import NamedTemporaryFile
+from typing import Any, Dict, List, Optional, Set
 
+from kolga.libs.registry import Registry
+from kolga.utils.dockerfile import Dockerfile, load_dockerfile
 from kolga.utils.logger import logger
-from kolga.utils.models import DockerImage, ImageStage
+from kolga.utils.models import DockerImage, ImageStage, SubprocessResult
 
 from ..settings import settings
-from ..utils.general import get_environment_vars_by_prefix, run_os_command
+from ..utils.general import (
+    get_environment_vars_by_prefix,
+    kubernetes_safe_name,
+    run_os_command,
+    run_os_command_async,
+    stream_os_command,
+)
 
 
 class Docker:
@@ -14,9 +23,6 @@ class Docker:
     A wrapper class around various Docker tools
     """
 
-    STAGE_REGEX = re.compile(
-        r"^FROM .*?(?: +AS +(?P<stage>.*))?$", re.IGNORECASE | re.MULTILINE
-    )
     ICON = "🐳"
 
     def __init__(self, dockerfile: str = settings.DOCKER_BUILD_SOURCE) -> None:
@@ -125,40 +131,64 @@ class Docker:
             build_args.append(f"--build-arg={key}={value}")
         return build_args
 
+    def get_parsed_dockerfile(self) -> Dockerfile:
+        """
+        Get the parsed Dockerfile
+
+        The Dockerfile is only parsed again when it has changed on disk.
+
+        Returns:
+            The parsed Dockerfile
+        """
+        return load_dockerfile(self.dockerfile)
+
     def get_stage_names(self) -> List[str]:
-        stage_names = []
-
-        with open(self.dockerfile) as f:
-            while True:
-                line = f.readline()
-                if not line:
-                    break
-                matched_stage = self.STAGE_REGEX.match(line)
-                if not matched_stage:
-                    continue
-                stage_name = (
-                    matched_stage.group("stage") if matched_stage.group("stage") else ""
-                )
-                stage_names.append(stage_name)
-        return stage_names
+        return self.get_parsed_dockerfile().stage_names
+
+    def get_stage_dependencies(self) -> Dict[str, Set[str]]:
+        """
+        Get the stages each stage of the Dockerfile depends on
+
+        A stage depends on another stage if it is built ``FROM`` it or if it
+        copies files from it with ``COPY --from``. References to images that
+        are not stages of the Dockerfile are left out.
+
+        Returns:
+            A dict of stage names and the names of the stages they depend on
+        """
+        return {
+            stage.name: set(stage.depends_on)
+            for stage in self.get_parsed_dockerfile().stages
+        }
 
     def get_stages(self) -> List[ImageStage]:
         stages: List[ImageStage] = []
-        stage_names = self.get_stage_names()
-        if not stage_names:
+        dockerfile_stages = self.get_parsed_dockerfile().stages
+        if not dockerfile_stages:
             return stages
 
-        for stage in stage_names[:-1]:
-            image_stage = ImageStage(name=stage)
+        for stage in dockerfile_stages[:-1]:
+            image_stage = ImageStage(
+                name=stage.name,
+                base_image=stage.base_image,
+                depends_on=set(stage.depends_on),
+            )
             if (
                 settings.DOCKER_TEST_IMAGE_STAGE
-                and stage == settings.DOCKER_TEST_IMAGE_STAGE
+                and stage.name == settings.DOCKER_TEST_IMAGE_STAGE
             ):
                 image_stage.development = True
                 image_stage.build = True
             stages.append(image_stage)
 
-        final_image = ImageStage(name=stage_names[-1], final=True, build=True)
+        final_stage = dockerfile_stages[-1]
+        final_image = ImageStage(
+            name=final_stage.name,
+            final=True,
+            build=True,
+            base_image=final_stage.base_image,
+            depends_on=set(final_stage.depends_on),
+        )
         stages.append(final_image)
 
         return stages
@@ -172,17 +202,40 @@ class Docker:
             tags |= {f"{settings.GIT_COMMIT_SHA}", f"{git_ref_tag}"}
         return sorted(tags)
 
+    @staticmethod
+    def log_output(line: str) -> None:
+        logger.info(message=f"\t{line}")
+
+    def _build_failed(self, result: SubprocessResult, action: str) -> None:
+        # The output has already been logged line by line
+        reason = (
+            "timed out"
+            if result.timed_out
+            else f"failed with exit status {result.return_code}"
+        )
+        logger.error(icon=f"{self.ICON} ❌", message=f"{action} {reason}")
+
     def pull_image(self, image: str) -> bool:
         logger.info(icon=f"{self.ICON} ⏬", title=f"Pulling {image}:", end=" ")
         pull_command = ["docker", "pull", image]
         result = run_os_command(pull_command, shell=False)
+        return self._log_pull_result(result)
 
+    async def pull_image_async(self, image: str) -> bool:
+        """
+        Asynchronous version of :func:`~Docker.pull_image`
+        """
+        result = await run_os_command_async(["docker", "pull", image])
+        logger.info(icon=f"{self.ICON} ⏬", title=f"Pulling {image}:", end=" ")
+        return self._log_pull_result(result)
+
+    @staticmethod
+    def _log_pull_result(result: SubprocessResult) -> bool:
         if result.return_code:
             logger.std(result, raise_exception=False)
-        else:
-            logger.success()
-            return True
-        return False
+            return False
+        logger.success()
+        return True
 
     def create_cache_tag(self, postfix: str = "") -> str:
         git_ref_tag = self.get_docker_git_ref_tag()
@@ -208,17 +261,25 @@ class Docker:
         """
         Build all stages of a Dockerfile and tag them
         """
-        built_images = []
-        stages = self.get_stages()
+        stages = [stage for stage in self.get_stages() if stage.build]
 
         for stage in stages:
-            if not stage.build:
-                continue
             if stage.development:
                 logger.info(
                     icon="ℹ️",
                     title=f"Found test/development stage '{stage.name}', building that as well",
                 )
+
+        if push_images and settings.DOCKER_SKIP_EXISTING_IMAGES:
+            existing_images = self.get_existing_images(stages)
+            if existing_images is not None:
+                return existing_images
+
+        if settings.DOCKER_BUILD_BAKE and len(stages) > 1:
+            return self.bake_stages(stages, push_images=push_images)
+
+        built_images = []
+        for stage in stages:
             built_images.append(
                 self.build_stage(
                     stage.name, final_image=stage.final, push_images=push_images
@@ -227,6 +288,179 @@ class Docker:
 
         return built_images
 
+    def get_existing_images(
+        self, stages: List[ImageStage], registry: Optional[Registry] = None
+    ) -> Optional[List[DockerImage]]:
+        """
+        Get the images of the stages if they have already been pushed
+
+        An image of a stage exists if one of its tags that contain the commit
+        SHA is found in the registry. Tags of the stage that are missing or
+        point at another image, for instance the tag of a branch, are moved
+        to the existing image by copying its manifest.
+
+        Args:
+            stages: Stages to look up
+            registry: Registry client, by default one for the image repository
+
+        Returns:
+            A list of the images, in the same order as ``stages``, or None if
+            any of the stages has to be built
+        """
+        if not settings.GIT_COMMIT_SHA:
+            # Every tag would match an empty commit SHA
+            return None
+
+        registry_host, repository = Registry.split_image_repo(self.image_repo)
+        if registry is None:
+            registry = Registry(registry=registry_host)
+
+        try:
+            stage_digests = []
+            for stage in stages:
+                tags = self.get_image_tags(stage.name, final_image=stage.final)
+                digests = {
+                    tag: registry.get_manifest_digest(repository, tag) for tag in tags
+                }
+                commit_digest = next(
+                    (
+                        digests[tag]
+                        for tag in tags
+                        if tag.startswith(settings.GIT_COMMIT_SHA) and digests[tag]
+                    ),
+                    None,
+                )
+                if not commit_digest:
+                    logger.info(
+                        icon=f"{self.ICON} 🔎",
+                        title=f"No image of stage '{stage.name}' found for this commit",
+                    )
+                    return None
+                stage_digests.append((tags, digests, commit_digest))
+
+            images = []
+            for tags, digests, commit_digest in stage_digests:
+                for tag in tags:
+                    if digests[tag] != commit_digest:
+                        registry.copy_manifest(repository, commit_digest, tag)
+                    logger.info(title=f"\t 🏷 Found: {self.image_repo}:{tag}")
+                images.append(DockerImage(repository=self.image_repo, tags=tags))
+        except (OSError, ValueError) as e:
+            # Network and HTTP errors of urllib are OSErrors
+            logger.warning(
+                icon=f"{self.ICON} ⚠️",
+                message=f"Could not look up existing images, building them: {e}",
+            )
+            return None
+
+        logger.success(
+            icon=f"{self.ICON} ⏭",
+            message="All images of this commit are already pushed, skipping build",
+        )
+        return images
+
+    def get_bake_definition(
+        self,
+        stages: List[ImageStage],
+        disable_cache: bool = settings.BUILDKIT_CACHE_DISABLE,
+    ) -> Dict[str, Any]:
+        """
+        Create a ``docker buildx bake`` definition for building stages
+
+        Each stage becomes a bake target with the same tags and cache
+        settings that :func:`~Docker.build_stage` would use for it.
+
+        Args:
+            stages: Stages to build
+            disable_cache: Don't use a registry cache for the build
+
+        Returns:
+            A dict that can be written to a bake JSON file
+        """
+        cache_tags = self.get_cache_tags()
+        build_args = get_environment_vars_by_prefix(settings.DOCKER_BUILD_ARG_PREFIX)
+
+        targets: Dict[str, Dict[str, Any]] = {}
+        for stage in stages:
+            target: Dict[str, Any] = {
+                "context": str(self.docker_context.absolute()),
+                "dockerfile": str(self.dockerfile.absolute()),
+                "target": stage.name,
+                "args": build_args,
+                "tags": [
+                    f"{self.image_repo}:{tag}"
+                    for tag in self.get_image_tags(stage.name, final_image=stage.final)
+                ],
+            }
+            if not disable_cache:
+                postfix = stage.name if not stage.final else ""
+                cache_to = self.create_cache_tag(postfix=postfix)
+                target["cache-to"] = [f"type=registry,ref={cache_to},mode=max"]
+                target["cache-from"] = [
+                    f"type=registry,ref={cache_tag}" for cache_tag in cache_tags
+                ]
+            target_name = kubernetes_safe_name(stage.name) if stage.name else "final"
+            targets[target_name] = target
+
+        return {
+            "group": {"default": {"targets": list(targets)}},
+            "target": targets,
+        }
+
+    def bake_stages(
+        self, stages: List[ImageStage], push_images: bool = True
+    ) -> List[DockerImage]:
+        """
+        Build stages with a single ``docker buildx bake`` invocation
+
+        As all of the targets are built in the same BuildKit session, stages
+        that are shared between them are only built once.
+
+        Args:
+            stages: Stages to build
+            push_images: Push the built images to the registry
+
+        Returns:
+            A list of the built images, in the same order as ``stages``
+        """
+        for stage in stages:
+            logger.info(
+                icon=f"{self.ICON} 🔨",
+                title=f"Baking stage '{stage.name}'",
+                message=f" (depends on: {', '.join(sorted(stage.depends_on)) or '-'})",
+            )
+
+        definition = self.get_bake_definition(stages)
+        with NamedTemporaryFile(mode="w", suffix=".json") as bake_file:
+            json.dump(definition, bake_file)
+            bake_file.flush()
+
+            bake_command = [
+                "docker",
+                "buildx",
+                "bake",
+                f"--file={bake_file.name}",
+                "--progress=plain",
+            ]
+            if push_images:
+                bake_command.append("--push")
+
+            result = stream_os_command(
+                bake_command, on_stdout=self.log_output, on_stderr=self.log_output
+            )
+
+        if result.return_code:
+            self._build_failed(result, "Baking the stages")
+
+        built_images = []
+        for target in definition["target"].values():
+            for tag in target["tags"]:
+                logger.info(title=f"\t 🏷 Tagged: {tag}")
+            tags = [tag.rsplit(":", 1)[1] for tag in target["tags"]]
+            built_images.append(DockerImage(repository=self.image_repo, tags=tags))
+
+        return built_images
+
     def build_stage(
         self,
         stage: str = "",
@@ -269,10 +503,12 @@ class Docker:
 
         build_command.append(f"{self.docker_context.absolute()}")
 
-        result = run_os_command(build_command, shell=False)
+        result = stream_os_command(
+            build_command, on_stdout=self.log_output, on_stderr=self.log_output
+        )
 
         if result.return_code:
-            logger.std(result, raise_exception=True)
+            self._build_failed(result, f"Building stage '{stage}'")
         else:
             for tag in tags:
                 logger.info(title=f"\t 🏷 Tagged: {self.image_repo}:{tag}")
@@ -280,6 +516,61 @@ class Docker:
         image = DockerImage(repository=self.image_repo, tags=tags)
         return image
 
+    def promote_image(
+        self,
+        tags: List[str],
+        source_tag: str = settings.GIT_COMMIT_SHA,
+        target_repo: Optional[str] = None,
+        registry: Optional[Registry] = None,
+    ) -> DockerImage:
+        """
+        Tag an already pushed image without pulling or building it
+
+        The tags are added in the registry. When the image is promoted to
+        another repository of the same registry, its layers are mounted
+        from the source repository instead of being transferred.
+
+        Args:
+            tags: Tags to give the image
+            source_tag: Tag of the image in ``image_repo`` to promote
+            target_repo: Repository to promote the image to, ``image_repo``
+                         by default
+            registry: Registry client, by default one for the image repository
+
+        Returns:
+            The promoted image
+        """
+        target_repo = target_repo or self.image_repo
+        source_host, source_repository = Registry.split_image_repo(self.image_repo)
+        target_host, target_repository = Registry.split_image_repo(target_repo)
+        if source_host != target_host:
+            logger.error(
+                message=f"Can not promote images from {source_host} to {target_host}",
+                error=ValueError(),
+                raise_exception=True,
+            )
+
+        if registry is None:
+            registry = Registry(registry=source_host)
+
+        logger.info(
+            icon=f"{self.ICON} 🎖",
+            title=f"Promoting {self.image_repo}:{source_tag}: ",
+            end="",
+        )
+        try:
+            digest = registry.copy_image(
+                source_repository, source_tag, target_repository, tags
+            )
+        except (OSError, ValueError) as e:
+            logger.error(error=e, raise_exception=True)
+        logger.success()
+
+        for tag in tags:
+            logger.info(title=f"\t 🏷 Tagged: {target_repo}:{tag} ({digest})")
+
+        return DockerImage(repository=target_repo, tags=tags)
+
     def delete_image(self, image: DockerImage) -> None:
         logger.warning(icon=f"{self.ICON}", message="Removing Docker image")
         for tag in image.tags:
@@ -1,16 +1,282 @@
+import asyncio
 import functools
+import hashlib
+import json
 import operator
+import os
+import shutil
+import time
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import Any, List, Optional
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from threading import Event, Lock
+from typing import Any, Dict, List, Mapping, Optional
 
 import yaml
 
 from kolga.settings import settings
-from kolga.utils.general import kubernetes_safe_name, run_os_command
+from kolga.utils.general import (
+    kubernetes_safe_name,
+    loads_json,
+    run_os_command,
+    run_os_command_async,
+)
 from kolga.utils.logger import logger
 from kolga.utils.models import HelmValues, SubprocessResult
 
+DEFAULT_REPOS = {
+    "stable": "https://charts.helm.sh/stable",
+    "bitnami": "https://charts.bitnami.com/bitnami",
+}
+
+ChartVersions = Mapping[str, Optional[str]]
+
+
+class HelmRepositoryState:
+    """
+    The repositories configured for Helm and their downloaded indexes
+
+    The files are looked up the same way Helm does it, from the
+    ``HELM_REPOSITORY_CONFIG`` and ``HELM_REPOSITORY_CACHE`` environment
+    variables or from the XDG base directories.
+    """
+
+    def __init__(self, config_path: Path, cache_path: Path) -> None:
+        self.config_path = config_path
+        self.cache_path = cache_path
+
+    @classmethod
+    def from_environment(cls) -> "HelmRepositoryState":
+        config_home = Path(os.environ.get("XDG_CONFIG_HOME", Path.home() / ".config"))
+        cache_home = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+        return cls(
+            config_path=Path(
+                os.environ.get(
+                    "HELM_REPOSITORY_CONFIG", config_home / "helm" / "repositories.yaml"
+                )
+            ),
+            cache_path=Path(
+                os.environ.get(
+                    "HELM_REPOSITORY_CACHE", cache_home / "helm" / "repository"
+                )
+            ),
+        )
+
+    def get_url(self, repo_name: str) -> Optional[str]:
+        """
+        Get the URL of a configured repository
+
+        Returns:
+            The URL or None if there is no repository with the name
+        """
+        try:
+            with self.config_path.open() as f:
+                config = yaml.safe_load(f) or {}
+        except (OSError, yaml.YAMLError):
+            return None
+
+        for repo in config.get("repositories") or []:
+            if repo.get("name") == repo_name:
+                return str(repo.get("url", ""))
+        return None
+
+    def index_path(self, repo_name: str) -> Path:
+        return self.cache_path / f"{repo_name}-index.yaml"
+
+    def index_age(self, repo_name: str) -> Optional[float]:
+        """
+        Get the time since the index of a repository was downloaded
+
+        Returns:
+            The age of the index in seconds or None if there is no index
+        """
+        try:
+            return time.time() - self.index_path(repo_name).stat().st_mtime
+        except OSError:
+            return None
+
+    def has_chart_version(self, chart: str, version: str) -> bool:
+        """
+        Check if a chart version is in the downloaded index of its repository
+
+        Args:
+            chart: Chart name prefixed with the repository, e.g. ``bitnami/postgresql``
+            version: Version of the chart
+
+        Returns:
+            True if the index lists the version, otherwise False
+        """
+        repo_name, _, chart_name = chart.partition("/")
+        entries = _load_index(str(self.index_path(repo_name))).get(chart_name) or []
+        return any(str(entry.get("version")) == version for entry in entries)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_index_cached(path: str, mtime_ns: int) -> Dict[str, List[Dict[str, Any]]]:
+    with open(path) as f:
+        # Indexes of big repositories are tens of megabytes, use libyaml if we can
+        index = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    return (index or {}).get("entries") or {}
+
+
+def _load_index(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    return _load_index_cached(path, mtime_ns)
+
+
+class ChartCache:
+    """
+    A local cache of chart archives
+
+    The archives are stored by the SHA-256 digest of their content and looked
+    up through an index that maps a repository URL, chart name and version to
+    the digest. The least recently used archives are evicted once the cache
+    grows beyond its maximum size.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, path: Path, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+        self._lock = Lock()
+
+    @staticmethod
+    def get_key(repo_url: str, chart_name: str, version: str) -> str:
+        return f"{repo_url.rstrip('/')}/{chart_name}@{version}"
+
+    @staticmethod
+    def get_digest(archive: Path) -> str:
+        digest = hashlib.sha256()
+        with archive.open("rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def archive_path(self, digest: str) -> Path:
+        return self.path / "blobs" / f"{digest}.tgz"
+
+    def get(self, repo_url: str, chart_name: str, version: str) -> Optional[Path]:
+        """
+        Get the cached archive of a chart version
+
+        An archive that does not match its digest anymore is removed.
+
+        Args:
+            repo_url: URL of the repository of the chart
+            chart_name: Name of the chart without the repository
+            version: Version of the chart
+
+        Returns:
+            Path to the archive or None if it is not cached
+        """
+        digest = self._read_index().get(self.get_key(repo_url, chart_name, version))
+        if not digest:
+            return None
+
+        archive = self.archive_path(digest)
+        try:
+            if self.get_digest(archive) != digest:
+                archive.unlink()
+                return None
+            # The modification time tells which archives were used last
+            os.utime(archive)
+        except OSError:
+            return None
+        return archive
+
+    def put(self, repo_url: str, chart_name: str, version: str, archive: Path) -> Path:
+        """
+        Store the archive of a chart version
+
+        Args:
+            repo_url: URL of the repository of the chart
+            chart_name: Name of the chart without the repository
+            version: Version of the chart
+            archive: The archive to store
+
+        Returns:
+            Path to the cached archive
+        """
+        digest = self.get_digest(archive)
+        cached_archive = self.archive_path(digest)
+        cached_archive.parent.mkdir(parents=True, exist_ok=True)
+
+        if cached_archive.exists():
+            os.utime(cached_archive)
+        else:
+            with NamedTemporaryFile(
+                dir=cached_archive.parent, suffix=".tmp", delete=False
+            ) as temp_archive, archive.open("rb") as f:
+                shutil.copyfileobj(f, temp_archive)
+            os.replace(temp_archive.name, cached_archive)
+
+        with self._lock:
+            index = self._read_index()
+            index[self.get_key(repo_url, chart_name, version)] = digest
+            self._write_index(index)
+            self.evict(keep=digest)
+        return cached_archive
+
+    def evict(self, keep: str = "") -> List[Path]:
+        """
+        Remove the least recently used archives until the cache fits its size
+
+        Args:
+            keep: Digest of an archive that must not be removed
+
+        Returns:
+            The removed archives
+        """
+        archives = []
+        for archive in (self.path / "blobs").glob("*.tgz"):
+            try:
+                archives.append((archive, archive.stat()))
+            except OSError:
+                continue
+
+        total_size = sum(stat.st_size for _, stat in archives)
+        removed = []
+        for archive, stat in sorted(archives, key=lambda item: item[1].st_mtime):
+            if total_size <= self.max_size:
+                break
+            if archive.stem == keep:
+                continue
+            archive.unlink(missing_ok=True)
+            total_size -= stat.st_size
+            removed.append(archive)
+
+        if removed:
+            removed_digests = {archive.stem for archive in removed}
+            index = self._read_index()
+            self._write_index(
+                {
+                    key: digest
+                    for key, digest in index.items()
+                    if digest not in removed_digests
+                }
+            )
+        return removed
+
+    def _read_index(self) -> Dict[str, str]:
+        try:
+            with (self.path / self.INDEX_FILE).open() as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def _write_index(self, index: Dict[str, str]) -> None:
+        # Replace the index atomically, other jobs may be reading it
+        self.path.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(
+            "w", dir=self.path, suffix=".tmp", delete=False
+        ) as temp_index:
+            json.dump(index, temp_index, indent=2, sort_keys=True)
+        os.replace(temp_index.name, self.path / self.INDEX_FILE)
+
 
 class Helm:
     """
@@ -19,35 +285,173 @@ class Helm:
 
     ICON = "⎈"
 
-    def setup_helm(self) -> None:
+    def __init__(self) -> None:
+        self.repositories = HelmRepositoryState.from_environment()
+        self.chart_cache: Optional[ChartCache] = None
+        if settings.HELM_CHART_CACHE_DIR:
+            self.chart_cache = ChartCache(
+                path=Path(settings.HELM_CHART_CACHE_DIR),
+                max_size=settings.HELM_CHART_CACHE_MAX_SIZE * 1024 * 1024,
+            )
+
+    def setup_helm(self, charts: Optional[ChartVersions] = None) -> None:
         """
         Makes sure that Helm is ready to use
 
+        The default repositories are added unless they already are. Their
+        indexes are only updated when they are missing or need an update,
+        see :func:`~Helm.repos_need_update`.
+
+        Args:
+            charts: Charts and versions that will be installed from the repositories
+
         Returns:
             None
         """
         logger.info(icon=f"{self.ICON}  🚀", title="Initializing Helm")
 
-        self.add_repo("stable", "https://charts.helm.sh/stable", update=False)
-        self.add_repo("bitnami", "https://charts.bitnami.com/bitnami", update=False)
+        for repo_name, repo_url in DEFAULT_REPOS.items():
+            self.add_repo(repo_name, repo_url, update=False)
+
+        if self.repos_need_update(charts):
+            self.update_repos()
+
+    async def setup_helm_async(self, charts: Optional[ChartVersions] = None) -> None:
+        """
+        Asynchronous version of :func:`~Helm.setup_helm`
+
+        The repositories are added concurrently.
+        """
+        logger.info(icon=f"{self.ICON}  🚀", title="Initializing Helm")
+
+        await asyncio.gather(
+            *(
+                self.add_repo_async(repo_name, repo_url, update=False)
+                for repo_name, repo_url in DEFAULT_REPOS.items()
+            )
+        )
+
+        if self.repos_need_update(charts):
+            await self.update_repos_async()
+
+    def repos_need_update(self, charts: Optional[ChartVersions] = None) -> bool:
+        """
+        Check if the indexes of the default repositories should be updated
+
+        No update is needed when every pinned version of ``charts`` is already
+        in the indexes, or when all of the indexes are younger than
+        ``HELM_REPO_CACHE_TTL``. In offline mode the indexes are never updated,
+        and a pinned version missing from them is an error.
+
+        Args:
+            charts: Charts and versions that will be installed from the repositories
+
+        Returns:
+            True if ``helm repo update`` should be run
+        """
+        pinned_charts = {
+            chart: version
+            for chart, version in (charts or {}).items()
+            if version and chart.partition("/")[0] in DEFAULT_REPOS
+        }
+        missing_charts = [
+            f"{chart} {version}"
+            for chart, version in pinned_charts.items()
+            if not self.repositories.has_chart_version(chart, version)
+        ]
+
+        if settings.HELM_OFFLINE:
+            if missing_charts:
+                logger.error(
+                    message=f"Charts not found in the offline Helm repositories: {', '.join(missing_charts)}",
+                    error=ValueError(),
+                    raise_exception=True,
+                )
+            logger.info(
+                icon=f"{self.ICON}  📴", title="Offline mode, not updating Helm repos"
+            )
+            return False
+
+        index_ages = [
+            self.repositories.index_age(repo_name) for repo_name in DEFAULT_REPOS
+        ]
+        if any(age is None for age in index_ages):
+            return True
+
+        if pinned_charts and not missing_charts:
+            logger.info(
+                icon=f"{self.ICON}  ✅",
+                title="Pinned charts found in the Helm repo indexes, not updating them",
+            )
+            return False
+
+        if not missing_charts and all(
+            age is not None and age < settings.HELM_REPO_CACHE_TTL for age in index_ages
+        ):
+            logger.info(
+                icon=f"{self.ICON}  ✅",
+                title="Helm repo indexes are up to date, not updating them",
+            )
+            return False
 
-        self.update_repos()
+        return True
+
+    def _repo_configured(self, repo_name: str, repo_url: str) -> bool:
+        configured_url = self.repositories.get_url(repo_name)
+        if configured_url is not None and configured_url.rstrip("/") == repo_url.rstrip(
+            "/"
+        ):
+            logger.info(
+                icon=f"{self.ICON}  ➕",
+                title=f"Helm repo {repo_url} with name {repo_name} already added",
+            )
+            return True
+
+        if settings.HELM_OFFLINE:
+            logger.error(
+                message=f"Helm repo {repo_name} is not configured and can not be added offline",
+                error=ValueError(),
+                raise_exception=True,
+            )
+        return False
 
     def add_repo(self, repo_name: str, repo_url: str, update: bool = True) -> None:
+        if self._repo_configured(repo_name, repo_url):
+            return
+
         logger.info(
             icon=f"{self.ICON}  ➕",
             title=f"Adding Helm repo {repo_url} with name {repo_name}: ",
             end="",
         )
         result = run_os_command(["helm", "repo", "add", repo_name, repo_url])
-        if not result.return_code:
-            logger.success()
-        else:
-            logger.std(result, raise_exception=True)
+        self._log_result(result)
 
         if update:
             self.update_repos()
 
+    async def add_repo_async(
+        self, repo_name: str, repo_url: str, update: bool = True
+    ) -> None:
+        """
+        Asynchronous version of :func:`~Helm.add_repo`
+        """
+        if self._repo_configured(repo_name, repo_url):
+            return
+
+        result = await run_os_command_async(
+            ["helm", "repo", "add", repo_name, repo_url]
+        )
+        logger.info(
+            icon=f"{self.ICON}  ➕",
+            title=f"Adding Helm repo {repo_url} with name {repo_name}: ",
+            end="",
+        )
+        self._log_result(result)
+
+        if update:
+            await self.update_repos_async()
+
     def remove_repo(self, repo_name: str) -> None:
         logger.info(
             icon=f"{self.ICON}  ➖",
@@ -63,6 +467,18 @@ class Helm:
     def update_repos(self) -> None:
         logger.info(icon=f"{self.ICON}  🔄", title="Updating Helm repos: ", end="")
         result = run_os_command(["helm", "repo", "update"])
+        self._log_result(result)
+
+    async def update_repos_async(self) -> None:
+        """
+        Asynchronous version of :func:`~Helm.update_repos`
+        """
+        result = await run_os_command_async(["helm", "repo", "update"])
+        logger.info(icon=f"{self.ICON}  🔄", title="Updating Helm repos: ", end="")
+        self._log_result(result)
+
+    @staticmethod
+    def _log_result(result: SubprocessResult) -> None:
         if not result.return_code:
             logger.success()
         else:
@@ -90,6 +506,189 @@ class Helm:
 
         return flattened_value_params
 
+    @staticmethod
+    def resolve_chart_path(chart_path: Path) -> Path:
+        if not chart_path.is_absolute():
+            chart_path = settings.devops_root_path / chart_path
+        if not chart_path.exists():
+            logger.error(
+                message=f"Path '{str(chart_path)}' does not exist",
+                error=OSError(),
+                raise_exception=True,
+            )
+        return chart_path
+
+    def pull_chart(self, chart: str, version: str, destination: Path) -> Optional[Path]:
+        """
+        Download the archive of a chart version
+
+        Args:
+            chart: Chart name prefixed with the repository, e.g. ``bitnami/postgresql``
+            version: Version of the chart
+            destination: Directory to download the archive to
+
+        Returns:
+            Path to the archive or None if the download failed
+        """
+        logger.info(
+            icon=f"{self.ICON}  📥",
+            title=f"Downloading chart {chart} {version}: ",
+            end="",
+        )
+        result = run_os_command(
+            ["helm", "pull", chart, "--version", version]
+            + ["--destination", str(destination)]
+        )
+        archive = destination / f"{self.get_chart_name(chart)}-{version}.tgz"
+        if result.return_code or not archive.exists():
+            logger.std(result, raise_exception=False)
+            return None
+
+        logger.success()
+        return archive
+
+    def get_cached_chart(self, chart: str, version: Optional[str]) -> Optional[Path]:
+        """
+        Get a local archive of a chart version from the chart cache
+
+        The archive is downloaded to the cache if it is not there yet.
+
+        Args:
+            chart: Chart name prefixed with the repository, e.g. ``bitnami/postgresql``
+            version: Version of the chart
+
+        Returns:
+            Path to the archive or None if the cache is disabled, the chart is
+            not from a configured repository or it could not be downloaded
+        """
+        repo_name, _, chart_name = chart.partition("/")
+        if not self.chart_cache or not version or not chart_name:
+            return None
+
+        repo_url = self.repositories.get_url(repo_name)
+        if not repo_url:
+            return None
+
+        archive = self.chart_cache.get(repo_url, chart_name, version)
+        if archive:
+            logger.info(
+                icon=f"{self.ICON}  📦", title=f"Using cached chart {chart} {version}"
+            )
+            return archive
+
+        with TemporaryDirectory() as temp_dir:
+            pulled_archive = self.pull_chart(chart, version, Path(temp_dir))
+            if not pulled_archive:
+                return None
+            return self.chart_cache.put(repo_url, chart_name, version, pulled_archive)
+
+    def warm_chart_cache(self, charts: ChartVersions) -> None:
+        """
+        Download the archives of chart versions to the chart cache
+
+        Args:
+            charts: Charts and versions to cache
+        """
+        if not self.chart_cache:
+            logger.error(
+                message="HELM_CHART_CACHE_DIR is not set",
+                error=ValueError(),
+                raise_exception=True,
+            )
+
+        for chart, version in charts.items():
+            if not self.get_cached_chart(chart, version):
+                logger.warning(
+                    message=f"Chart {chart} {version} could not be cached",
+                )
+
+    def get_release(self, name: str, namespace: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the status of a release
+
+        Args:
+            name: Name of the release
+            namespace: Namespace of the release
+
+        Returns:
+            The release as listed by ``helm list`` or None if there is no release
+        """
+        safe_name = kubernetes_safe_name(name=name)
+        result = run_os_command(
+            [
+                "helm",
+                "list",
+                "--all",
+                "--namespace",
+                namespace,
+                "--filter",
+                f"^{safe_name}$",
+                "--output",
+                "json",
+            ]
+        )
+        if result.return_code:
+            return None
+
+        try:
+            releases = json.loads(result.out or "[]")
+        except ValueError:
+            return None
+        return releases[0] if releases else None
+
+    def get_release_values(self, name: str, namespace: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the values that the current revision of a release was deployed with
+
+        Args:
+            name: Name of the release
+            namespace: Namespace of the release
+
+        Returns:
+            The user supplied values of the release or None if there is no release
+        """
+        safe_name = kubernetes_safe_name(name=name)
+        result = run_os_command(
+            ["helm", "get", "values", safe_name, "--namespace", namespace]
+            + ["--output", "json"]
+        )
+        if result.return_code:
+            return None
+        # Helm prints null for a release without user supplied values
+        if result.out.strip() == "null":
+            return {}
+        return loads_json(result.out)
+
+    def is_release_up_to_date(
+        self, name: str, namespace: str, values: HelmValues, chart_path: Path
+    ) -> bool:
+        """
+        Check if a release is already deployed with the given chart and values
+
+        Args:
+            name: Name of the release
+            namespace: Namespace of the release
+            values: Values that the release would be upgraded with
+            chart_path: Path to the chart the release would be upgraded with
+
+        Returns:
+            True if the release is deployed from the same chart version and
+            with identical values, otherwise False
+        """
+        release = self.get_release(name=name, namespace=namespace)
+        if not release or release.get("status") != "deployed":
+            return False
+
+        with (self.resolve_chart_path(chart_path) / "Chart.yaml").open() as f:
+            chart = yaml.safe_load(f)
+        if release.get("chart") != f"{chart['name']}-{chart['version']}":
+            return False
+
+        release_values = self.get_release_values(name=name, namespace=namespace)
+        # Compare the values the same way Helm stores them, as JSON
+        stored_values: Dict[str, Any] = json.loads(json.dumps(values))
+        return release_values == stored_values
+
     def upgrade_chart(
         self,
         name: str,
@@ -101,17 +700,10 @@ class Helm:
         install: bool = True,
         version: Optional[str] = None,
         raise_exception: bool = True,
+        abort: Optional[Event] = None,
     ) -> SubprocessResult:
         if chart_path:
-            if not chart_path.is_absolute():
-                chart_path = settings.devops_root_path / chart_path
-            if not chart_path.exists():
-                logger.error(
-                    message=f"Path '{str(chart_path)}' does not exist",
-                    error=OSError(),
-                    raise_exception=True,
-                )
-            chart = str(chart_path)
+            chart = str(self.resolve_chart_path(chart_path))
 
         logger.info(
             icon=f"{self.ICON}  📄",
@@ -153,10 +745,17 @@ class Helm:
 
         with NamedTemporaryFile(buffering=0) as fobj:
             fobj.write(values_yaml.encode())
+            # Helm writes a short summary once it is done, it is logged below
+            # on failure instead of being streamed
             result = run_os_command(
                 [*helm_command, "--values", fobj.name, f"{safe_name}", f"{chart}"],
+                abort=abort,
             )
 
+        if abort and abort.is_set():
+            # Helm does not get to clean up after itself when it is stopped
+            self.recover_pending_release(name=safe_name, namespace=namespace)
+
         if result.return_code:
             logger.std(result, raise_exception=raise_exception)
             return result
@@ -166,3 +765,41 @@ class Helm:
         logger.info(f"\tNamespace: {namespace}")
 
         return result
+
+    def recover_pending_release(self, name: str, namespace: str) -> None:
+        """
+        Recover a release left in a pending state by an interrupted operation
+
+        A pending install is uninstalled and a pending upgrade or rollback
+        is rolled back to the previous revision. Otherwise the next operation
+        on the release would fail as another operation would seem to be in
+        progress.
+
+        Args:
+            name: Name of the release
+            namespace: Namespace of the release
+        """
+        result = run_os_command(
+            ["helm", "status", name, "--namespace", namespace, "--output", "json"]
+        )
+        if result.return_code:
+            return None
+
+        status = loads_json(result.out).get("info", {}).get("status", "")
+        if status == "pending-install":
+            recover_command = ["helm", "uninstall", name]
+        elif status in ("pending-upgrade", "pending-rollback"):
+            recover_command = ["helm", "rollback", name]
+        else:
+            return None
+
+        logger.info(
+            icon=f"{self.ICON}  ⏪",
+            title=f"Recovering release {name} from status {status}: ",
+            end="",
+        )
+        result = run_os_command([*recover_command, "--namespace", namespace])
+        if not result.return_code:
+            logger.success()
+        else:
+            logger.std(result, raise_exception=False)
@@ -1,17 +1,26 @@
+import fnmatch
+import functools
+import json
 import shutil
 import tempfile
+import time
 from base64 import b64encode
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, TypedDict
+from threading import Lock
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, TypedDict
 
 import colorful as cf
 import yaml
 from kubernetes import client as k8s_client
 from kubernetes import config as k8s_config
+from kubernetes import watch
 from kubernetes.client.rest import ApiException
 
-from kolga.libs.helm import Helm
+from kolga.libs.helm import ChartVersions, Helm
 from kolga.libs.project import Project
+from kolga.libs.registry import Registry
 from kolga.libs.service import Service
 from kolga.settings import settings
 from kolga.utils.exceptions import (
@@ -26,17 +35,22 @@ from kolga.utils.general import (
     get_environment_vars_by_prefix,
     kubernetes_safe_name,
     loads_json,
+    run_concurrently,
+    run_in_thread,
     run_os_command,
+    run_os_command_async,
     validate_file_secret_path,
 )
 from kolga.utils.kube_logger import KubeLoggerThread
 from kolga.utils.logger import logger
 from kolga.utils.models import (
     BasicAuthUser,
+    EnvironmentActivity,
     HelmValues,
     ReleaseStatus,
     SubprocessResult,
 )
+from kolga.utils.rollout_watcher import RolloutWatcher
 
 
 class _Pvc(TypedDict, total=False):
@@ -121,6 +135,69 @@ class ApplicationDeploymentValues(HelmValues, total=False):
     service: _Service
 
 
+SECRET_DIGEST_ANNOTATION = "kolga.io/data-digest"
+PROJECT_ID_LABEL = "kolga.io/project_id"
+HIBERNATED_REPLICAS_ANNOTATION = "kolga.io/hibernated-replicas"
+CERT_MANAGER_API_VERSIONS = ("v1", "v1beta1", "v1alpha3", "v1alpha2")
+
+# ClusterIssuers found by cluster and issuer name, for the lifetime of the process
+_cluster_issuers: Dict[Tuple[str, str], bool] = {}
+_cluster_issuers_locks: Dict[Tuple[str, str], Lock] = {}
+_cluster_issuers_lock = Lock()
+DEPLOYMENT_FINGERPRINT_LENGTH = 40
+
+
+class CleanupResource(NamedTuple):
+    """
+    A type of resource removed by :func:`~Kubernetes.delete_all`
+
+    The first of the API versions that the cluster serves is used.
+    """
+
+    plural: str
+    api_versions: Tuple[str, ...]
+    namespaced: bool = True
+
+    def get_paths(self, namespace: str) -> List[str]:
+        paths = []
+        for api_version in self.api_versions:
+            path = (
+                f"/api/{api_version}"
+                if "/" not in api_version
+                else f"/apis/{api_version}"
+            )
+            if self.namespaced:
+                path += f"/namespaces/{namespace}"
+            paths.append(f"{path}/{self.plural}")
+        return paths
+
+
+CLEANUP_RESOURCES = (
+    CleanupResource("deployments", ("apps/v1",)),
+    CleanupResource("statefulsets", ("apps/v1",)),
+    CleanupResource("daemonsets", ("apps/v1",)),
+    CleanupResource("replicasets", ("apps/v1",)),
+    CleanupResource("replicationcontrollers", ("v1",)),
+    CleanupResource("pods", ("v1",)),
+    CleanupResource("services", ("v1",)),
+    CleanupResource("jobs", ("batch/v1",)),
+    CleanupResource("cronjobs", ("batch/v1", "batch/v1beta1")),
+    CleanupResource("horizontalpodautoscalers", ("autoscaling/v1",)),
+    CleanupResource(
+        "ingresses",
+        ("networking.k8s.io/v1", "networking.k8s.io/v1beta1", "extensions/v1beta1"),
+    ),
+    CleanupResource("persistentvolumeclaims", ("v1",)),
+    CleanupResource("configmaps", ("v1",)),
+    CleanupResource("rolebindings", ("rbac.authorization.k8s.io/v1",)),
+    CleanupResource("roles", ("rbac.authorization.k8s.io/v1",)),
+    CleanupResource("secrets", ("v1",)),
+    CleanupResource("storageclasses", ("storage.k8s.io/v1",), namespaced=False),
+    CleanupResource("volumeattachments", ("storage.k8s.io/v1",), namespaced=False),
+    CleanupResource("persistentvolumes", ("v1",), namespaced=False),
+)
+
+
 class Kubernetes:
     """
     A wrapper class around various Kubernetes tools and functions
@@ -132,10 +209,17 @@ class Kubernetes:
     """
 
     ICON = "☸️"
+    NAMESPACE_DELETE_TIMEOUT = 600
+    WAKE_TIMEOUT = 600
+    WAKE_POLL_INTERVAL = 5
 
     def __init__(self, track: str = settings.DEFAULT_TRACK) -> None:
         self.client = self.create_client(track=track)
         self.helm = Helm()
+        # Digests of the secrets created by this instance, by secret name
+        self.secret_digests: Dict[str, str] = {}
+        # Certification issuers looked up in advance, by track
+        self.certification_issuers: Dict[str, Optional[str]] = {}
 
     def create_client(self, track: str) -> k8s_client.ApiClient:
         try:
@@ -236,6 +320,20 @@ class Kubernetes:
             encoded_dict[k] = b64encode(v.encode("UTF-8")).decode("UTF-8")
         return encoded_dict
 
+    @staticmethod
+    def _secret_digest(data: Dict[str, str]) -> str:
+        """
+        Create a digest of encoded secret data
+
+        Args:
+            data: Base64 encoded secret data
+
+        Returns:
+            Hex digest of the data that does not depend on the order of keys
+        """
+        serialized_data = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        return sha256(serialized_data.encode("UTF-8")).hexdigest()
+
     @staticmethod
     def _b64_encode_file(path: Path) -> str:
         with open(str(path), "rb") as file:
@@ -263,7 +361,7 @@ class Kubernetes:
         labels = {"app": "kubed"}
 
         if settings.PROJECT_ID:
-            labels["kolga.io/project_id"] = settings.PROJECT_ID
+            labels[PROJECT_ID_LABEL] = settings.PROJECT_ID
 
         return labels
 
@@ -322,34 +420,78 @@ class Kubernetes:
         secret_name: str,
         encode: bool = True,
     ) -> None:
+        """
+        Create or update a secret
+
+        The digest of the encoded data is stored as an annotation of the
+        secret. If the secret already exists with the same digest, nothing
+        is written. Otherwise the secret is patched in place, removing keys
+        that no longer are part of the data.
+
+        Args:
+            data: Secret data
+            namespace: Namespace of the secret
+            track: Current deployment track
+            project: Project that the secret belongs to
+            secret_name: Name of the secret
+            encode: Should the values of ``data`` be base64 encoded
+        """
         deploy_name = get_deploy_name(track=track, postfix=project.name)
         v1 = k8s_client.CoreV1Api(self.client)
-        v1_metadata = k8s_client.V1ObjectMeta(
-            name=secret_name, namespace=namespace, labels={"release": deploy_name}
-        )
 
         if encode:
             encoded_data = self._encode_secret(data)
         else:
             encoded_data = data
 
-        body = k8s_client.V1Secret(
-            data=encoded_data, metadata=v1_metadata, type="generic"
-        )
+        digest = self._secret_digest(encoded_data)
+        self.secret_digests[secret_name] = digest
+        labels = {"release": deploy_name}
+        annotations = {SECRET_DIGEST_ANNOTATION: digest}
+
         logger.info(
             icon=f"{self.ICON}  🔨",
             title=f"Creating secret '{secret_name}' for namespace '{namespace}': ",
             end="",
         )
         try:
-            v1.create_namespaced_secret(namespace=namespace, body=body)
-        except ApiException:
-            try:
-                v1.replace_namespaced_secret(
-                    name=secret_name, namespace=namespace, body=body
-                )
-            except ApiException as e:
+            current_secret = v1.read_namespaced_secret(
+                name=secret_name, namespace=namespace
+            )
+        except ApiException as e:
+            if e.status != 404:
                 self._handle_api_error(e, raise_client_exception=True)
+            current_secret = None
+
+        try:
+            if current_secret is None:
+                v1_metadata = k8s_client.V1ObjectMeta(
+                    name=secret_name,
+                    namespace=namespace,
+                    labels=labels,
+                    annotations=annotations,
+                )
+                body = k8s_client.V1Secret(
+                    data=encoded_data, metadata=v1_metadata, type="generic"
+                )
+                v1.create_namespaced_secret(namespace=namespace, body=body)
+            elif (current_secret.metadata.annotations or {}).get(
+                SECRET_DIGEST_ANNOTATION
+            ) == digest:
+                logger.success(message="Unchanged")
+                return
+            else:
+                # Keys set to null are removed by the (strategic merge) patch
+                removed_keys = (current_secret.data or {}).keys() - encoded_data.keys()
+                patch = {
+                    "metadata": {"labels": labels, "annotations": annotations},
+                    "data": {**encoded_data, **dict.fromkeys(removed_keys)},
+                }
+                v1.patch_namespaced_secret(
+                    name=secret_name, namespace=namespace, body=patch
+                )
+        except ApiException as e:
+            self._handle_api_error(e, raise_client_exception=True)
         logger.success()
 
     def create_file_secrets_from_environment(
@@ -407,8 +549,11 @@ class Kubernetes:
 
         return filecontents, mapping
 
-    def setup_helm(self) -> None:
-        self.helm.setup_helm()
+    def setup_helm(self, charts: Optional[ChartVersions] = None) -> None:
+        self.helm.setup_helm(charts=charts)
+
+    async def setup_helm_async(self, charts: Optional[ChartVersions] = None) -> None:
+        await self.helm.setup_helm_async(charts=charts)
 
     def _create_basic_auth_data(
         self, basic_auth_users: List[BasicAuthUser] = settings.K8S_INGRESS_BASIC_AUTH
@@ -475,14 +620,22 @@ class Kubernetes:
     def deploy_service(self, service: "Service", namespace: str, track: str) -> None:
         deploy_name = get_deploy_name(track=track, postfix=service.name)
 
+        chart_path = service.chart_path
+        version = service.chart_version
+        if not chart_path:
+            cached_chart = self.helm.get_cached_chart(service.chart, version)
+            if cached_chart:
+                # The archive is the pinned version, Helm does not need to resolve it
+                chart_path, version = cached_chart, None
+
         self.helm.upgrade_chart(
             chart=service.chart,
-            chart_path=service.chart_path,
+            chart_path=chart_path,
             name=deploy_name,
             namespace=namespace,
             values=service.values,
             values_files=service.values_files,
-            version=service.chart_version,
+            version=version,
         )
 
     def get_application_deployment_values(
@@ -559,7 +712,10 @@ class Kubernetes:
         if project.temp_storage_path:
             values["application"]["temporaryStoragePath"] = project.temp_storage_path
 
-        cert_issuer = self.get_certification_issuer(track=track)
+        if track in self.certification_issuers:
+            cert_issuer = self.certification_issuers[track]
+        else:
+            cert_issuer = self.get_certification_issuer(track=track)
         if cert_issuer:
             values["ingress"]["clusterIssuer"] = cert_issuer
 
@@ -596,14 +752,99 @@ class Kubernetes:
             if settings.K8S_HPA_MAX_RAM_AVG:
                 values["hpa"]["avgRamUtilization"] = settings.K8S_HPA_MAX_RAM_AVG
 
+        if settings.K8S_DEPLOYMENT_FINGERPRINT:
+            # Without the digest a re-pushed tag would look like the same
+            # image, the deployment keeps its timestamp and is never skipped
+            image_digest = self.get_image_digest(project.image)
+            if image_digest:
+                values["deployment"]["timestamp"] = self.get_deployment_fingerprint(
+                    values=values, project=project, image_digest=image_digest
+                )
+
         return values
 
+    def get_image_digest(self, image: str) -> Optional[str]:
+        """
+        Get the digest of the manifest an image reference points at
+
+        Args:
+            image: Image reference with a tag or a digest
+
+        Returns:
+            The manifest digest, None if it could not be resolved
+        """
+        _, at, digest = image.partition("@")
+        if at:
+            return digest
+
+        name, _, tag = image.rpartition(":")
+        if not name or "/" in tag:
+            name, tag = image, "latest"
+        registry_host, repository = Registry.split_image_repo(name)
+        try:
+            return Registry(registry=registry_host).get_manifest_digest(repository, tag)
+        except (OSError, ValueError) as e:
+            # Network and HTTP errors of urllib are OSErrors
+            logger.warning(
+                icon=f"{self.ICON}  ⚠️ ",
+                message=f"Could not resolve the digest of {image}: {e}",
+            )
+            return None
+
+    def get_deployment_fingerprint(
+        self, values: ApplicationDeploymentValues, project: Project, image_digest: str
+    ) -> str:
+        """
+        Create a fingerprint of everything that makes up a deployment
+
+        The fingerprint is used in place of the deployment timestamp in the
+        labels of the pods. Deploying the same image with the same values and
+        secrets again will then not change the pods at all, while a change
+        in any of them will roll out new pods as usual.
+
+        Args:
+            values: Deployment values, the ``deployment`` values are ignored
+            project: Project that is deployed
+            image_digest: Manifest digest of the image of the project
+
+        Returns:
+            A hex digest that can be used as a label value
+        """
+        secret_names = [
+            project.secret_name,
+            project.file_secret_name,
+            project.basic_auth_secret_name,
+        ]
+        fingerprint_data = {
+            "image": project.image,
+            "image_digest": image_digest,
+            "secrets": {
+                name: self.secret_digests.get(name, "") for name in secret_names if name
+            },
+            "values": {k: v for k, v in values.items() if k != "deployment"},
+        }
+        serialized_data = json.dumps(fingerprint_data, sort_keys=True, default=str)
+        digest = sha256(serialized_data.encode("UTF-8")).hexdigest()
+        return digest[:DEPLOYMENT_FINGERPRINT_LENGTH]
+
     def create_application_deployment(
         self,
         namespace: str,
         project: Project,
         track: str,
-    ) -> None:
+    ) -> bool:
+        """
+        Deploy a project with Helm
+
+        Args:
+            namespace: Namespace to deploy to
+            project: Project to deploy
+            track: Track of the deployment
+
+        Returns:
+            True if the project was deployed, False if the release was already
+            up to date and the deployment was skipped
+        """
         helm_path = self.get_helm_path()
         values = self.get_application_deployment_values(
             namespace=namespace,
@@ -611,27 +852,73 @@ class Kubernetes:
             track=track,
         )
 
+        # Only a fingerprinted deployment can be identical to the previous one
+        if settings.K8S_DEPLOYMENT_FINGERPRINT:
+            release_labels = {"release": project.deploy_name}
+            workloads = [
+                workload
+                for _, workload in self._get_workloads(namespace, release_labels)
+            ]
+            if any(
+                HIBERNATED_REPLICAS_ANNOTATION in (workload.metadata.annotations or {})
+                for workload in workloads
+            ):
+                # Helm restores the replicas but would leave the annotation behind
+                self.wake(namespace, labels=release_labels, wait=False)
+            elif self._are_workloads_ready(
+                workloads, values
+            ) and self.helm.is_release_up_to_date(
+                name=project.deploy_name,
+                namespace=namespace,
+                values=values,
+                chart_path=helm_path,
+            ):
+                logger.success(
+                    icon=f"{self.ICON}  ⏭️ ",
+                    message=f"Release {project.deploy_name} is up to date, skipping deployment",
+                )
+                return False
+
         application_labels = {
             "deploymentTime": values["deployment"]["timestamp"],
             "release": project.deploy_name,
             "track": track,
         }
         log_collector = KubeLoggerThread(
+            client=self.client,
+            labels=application_labels,
+            namespace=namespace,
+            max_lines=settings.K8S_LOG_MAX_LINES,
+        )
+
+        rollout_watcher = RolloutWatcher(
+            client=self.client,
             labels=application_labels,
             namespace=namespace,
         )
 
         log_collector.start()
+        if not settings.K8S_ROLLOUT_WATCHER_DISABLED:
+            rollout_watcher.start()
         result = self.helm.upgrade_chart(
             chart_path=helm_path,
             name=project.deploy_name,
             namespace=namespace,
             values=values,
             raise_exception=False,
+            abort=rollout_watcher.abort,
         )
+        rollout_watcher.stop()
         log_collector.stop()
 
         if result.return_code:
+            if rollout_watcher.failure:
+                logger.error(
+                    icon=f"{self.ICON}  ❌",
+                    message=f"Deployment aborted: {rollout_watcher.failure}",
+                    raise_exception=False,
+                )
+
             logger.info(
                 icon=f"{self.ICON} 🏷️",
                 title="Deployment values (without environment vars):",
@@ -646,14 +933,16 @@ class Kubernetes:
                 icon=f"{self.ICON}  📋️️ ",
                 title="Getting logs for resource: ",
             )
-            with log_collector.log_path.open() as f:
-                for line in f:
-                    logger.info(line, end="")
+            for line in log_collector.lines():
+                logger.info(line, end="")
 
             raise DeploymentFailed()
 
-        settings.plugin_manager.hook.project_deployment_complete(
-            project=project, track=track, namespace=namespace
+        # Plugins are run in the background, see Devops.run_command for the flush
+        settings.hook_dispatcher.dispatch(
+            "project_deployment_complete",
+            {"project": project, "track": track, "namespace": namespace},
+            timeout=settings.KOLGA_HOOK_TIMEOUT,
         )
 
         if not settings.K8S_INGRESS_DISABLED:
@@ -661,6 +950,7 @@ class Kubernetes:
                 icon=f"{self.ICON}  📄",
                 title=f"Deployment can be accessed via {project.url}",
             )
+        return True
 
     def create_default_network_policy(
         self,
@@ -738,51 +1028,555 @@ class Kubernetes:
         labels: Optional[Dict[str, str]] = None,
         namespace: str = settings.K8S_NAMESPACE,
     ) -> None:
+        os_command, title = self._delete_command(
+            resource=resource, name=name, labels=labels, namespace=namespace
+        )
+        logger.info(icon=f"{self.ICON}  🗑️ ", title=title, end="")
+        result = run_os_command(os_command, shell=True)  # nosec
+        self._log_result(result, raise_exception=True)
+
+    async def delete_async(
+        self,
+        resource: str,
+        name: Optional[str] = None,
+        labels: Optional[Dict[str, str]] = None,
+        namespace: str = settings.K8S_NAMESPACE,
+    ) -> None:
+        """
+        Asynchronous version of :func:`~Kubernetes.delete`
+        """
+        os_command, title = self._delete_command(
+            resource=resource, name=name, labels=labels, namespace=namespace
+        )
+        result = await run_os_command_async(os_command, shell=True)  # nosec
+        logger.info(icon=f"{self.ICON}  🗑️ ", title=title, end="")
+        self._log_result(result, raise_exception=True)
+
+    def _delete_command(
+        self,
+        resource: str,
+        name: Optional[str] = None,
+        labels: Optional[Dict[str, str]] = None,
+        namespace: str = settings.K8S_NAMESPACE,
+    ) -> Tuple[List[str], str]:
+        resource_args, description = self._resource_command(
+            resource=resource, name=name, labels=labels, namespace=namespace
+        )
         os_command = [
             "kubectl",
             "delete",
-            resource,
             "--ignore-not-found",
             "--wait=true",
-            f"--namespace={namespace}",
+            *resource_args,
         ]
+        return os_command, f"Removing {resource}{description}: "
 
-        logger.info(icon=f"{self.ICON}  🗑️ ", title=f"Removing {resource}", end="")
-        if labels:
-            labels_str = self.labels_to_string(labels)
-            os_command += ["-l", labels_str]
-            logger.info(title=f" with labels {labels_str}", end="")
-        if name:
-            os_command += [name]
-            logger.info(title=f" with name '{name}'", end="")
-        logger.info(": ", end="")
-        result = run_os_command(os_command, shell=True)  # nosec
+    @staticmethod
+    def _log_result(result: SubprocessResult, raise_exception: bool) -> None:
         if not result.return_code:
             logger.success()
         else:
-            logger.std(result, raise_exception=True)
+            logger.std(result, raise_exception=raise_exception)
 
     def delete_all(
         self,
         labels: Optional[Dict[str, str]] = None,
         namespace: str = settings.K8S_NAMESPACE,
+        all_resources: bool = False,
+    ) -> Dict[str, int]:
+        """
+        Delete the resources of a namespace
+
+        Every type of resource is deleted with a request of its own and the
+        requests are made concurrently. The garbage collector removes the
+        dependents of the resources in the background, so the method does
+        not wait for the resources to be gone. Resources that are not in a
+        namespace are only deleted when labels are given.
+
+        Args:
+            labels: Labels of the resources to delete
+            namespace: Namespace to delete the resources from
+            all_resources: Delete every resource of the namespace, required
+                when no labels are given
+
+        Returns:
+            The number of deleted resources by type
+
+        Raises:
+            ValueError: Neither labels nor ``all_resources`` were given
+        """
+        if not labels and not all_resources:
+            raise ValueError(
+                "Labels are required to delete resources, "
+                "use all_resources to delete everything in the namespace"
+            )
+        label_selector = self.labels_to_string(labels) if labels else None
+        resources = [
+            resource
+            for resource in CLEANUP_RESOURCES
+            if resource.namespaced or label_selector
+        ]
+        description = f" with labels {label_selector}" if label_selector else ""
+        logger.info(
+            icon=f"{self.ICON}  🗑️ ",
+            title=f"Removing resources{description} from namespace {namespace}",
+        )
+
+        deleted = run_concurrently(
+            {
+                resource.plural: functools.partial(
+                    self._delete_collection, resource, namespace, label_selector
+                )
+                for resource in resources
+            },
+            max_workers=len(resources),
+        )
+
+        for plural, count in deleted.items():
+            if count:
+                logger.info(message=f"\t{plural}: {count}")
+        logger.success(message=f"{sum(deleted.values())} resources removed")
+        return deleted
+
+    def _delete_collection(
+        self,
+        resource: CleanupResource,
+        namespace: str,
+        label_selector: Optional[str] = None,
+    ) -> int:
+        """
+        Delete the resources of a type
+
+        Returns:
+            The number of deleted resources
+        """
+        query_params = [("propagationPolicy", "Background")]
+        if label_selector:
+            query_params.append(("labelSelector", label_selector))
+
+        for path in resource.get_paths(namespace):
+            try:
+                response = self._call_api(path, "DELETE", query_params)
+            except ApiException as e:
+                if e.status == 404:
+                    # The API version is not served by the cluster
+                    continue
+                if e.status != 405:
+                    self._handle_api_error(e, raise_client_exception=True)
+                # Old clusters can not delete some resources, such as services,
+                # as a collection, delete them one by one instead
+                return self._delete_each(path, query_params)
+            return len(response.get("items") or [])
+        return 0
+
+    def _delete_each(self, path: str, query_params: List[Tuple[str, str]]) -> int:
+        list_params = [param for param in query_params if param[0] == "labelSelector"]
+        items = self._call_api(path, "GET", list_params).get("items") or []
+        for item in items:
+            try:
+                self._call_api(
+                    f"{path}/{item['metadata']['name']}", "DELETE", query_params
+                )
+            except ApiException as e:
+                if e.status != 404:
+                    self._handle_api_error(e, raise_client_exception=True)
+        return len(items)
+
+    def _call_api(
+        self, path: str, method: str, query_params: List[Tuple[str, str]]
+    ) -> Dict[str, Any]:
+        response = self.client.call_api(
+            path,
+            method,
+            query_params=query_params,
+            header_params={"Accept": "application/json"},
+            auth_settings=["BearerToken"],
+            response_type="object",
+            _return_http_data_only=True,
+        )
+        return response if isinstance(response, dict) else {}
+
+    def delete_namespace(
+        self, namespace: str = settings.K8S_NAMESPACE, wait: bool = False
+    ) -> None:
+        """
+        Delete a namespace and everything in it
+
+        The deletion only starts when the method returns, Kubernetes removes
+        the resources of the namespace in the background.
+
+        Args:
+            namespace: Name of the namespace to delete
+            wait: Wait until the namespace is gone
+        """
+        v1 = k8s_client.CoreV1Api(self.client)
+        logger.info(
+            icon=f"{self.ICON}  🗑️ ", title=f"Removing namespace {namespace}: ", end=""
+        )
+        try:
+            v1.delete_namespace(name=namespace, propagation_policy="Background")
+        except ApiException as e:
+            if e.status != 404:
+                self._handle_api_error(e, raise_client_exception=True)
+            logger.success(message="not found")
+            return
+        logger.success()
+
+        if wait:
+            self.wait_for_namespace_deletion(namespace=namespace)
+
+    def wait_for_namespace_deletion(
+        self, namespace: str, timeout: int = NAMESPACE_DELETE_TIMEOUT
+    ) -> None:
+        """
+        Wait until the finalizers of a namespace are done and it is gone
+
+        Args:
+            namespace: Name of the namespace
+            timeout: Seconds to wait for
+
+        Raises:
+            TimeoutError: The namespace still exists after the timeout
+        """
+        v1 = k8s_client.CoreV1Api(self.client)
+        field_selector = f"metadata.name={namespace}"
+        logger.info(
+            icon=f"{self.ICON}  ⏳",
+            title=f"Waiting for namespace {namespace} to be removed: ",
+            end="",
+        )
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            namespaces = v1.list_namespace(field_selector=field_selector)
+            if not namespaces.items:
+                logger.success()
+                return
+
+            w = watch.Watch()
+            try:
+                for event in w.stream(
+                    v1.list_namespace,
+                    field_selector=field_selector,
+                    resource_version=namespaces.metadata.resource_version,
+                    timeout_seconds=max(1, int(deadline - time.monotonic())),
+                ):
+                    if event["type"] == "DELETED":
+                        w.stop()
+                        logger.success()
+                        return
+                    if (
+                        event["type"] == "ERROR"
+                        and event["raw_object"].get("code") == 410
+                    ):
+                        # The resource version is too old to watch from, list
+                        # again to get a fresh one
+                        w.stop()
+                        break
+            except ApiException as e:
+                # Newer clients raise the 410 Gone instead
+                if e.status != 410:
+                    raise e
+
+        logger.error(
+            message=f"Namespace {namespace} was not removed in {timeout} seconds",
+            error=TimeoutError(),
+            raise_exception=True,
+        )
+
+    def get_environments(
+        self, project_id: Optional[str] = None, max_workers: int = 1
+    ) -> List[EnvironmentActivity]:
+        """
+        Get the namespaces created for projects and when they were last used
+
+        The last activity of a namespace is the time of the latest Helm
+        release revision in it, or the creation of the namespace if nothing
+        has been released to it.
+
+        Args:
+            project_id: Only get the namespaces of this project
+            max_workers: Number of namespaces to look into at the same time
+
+        Returns:
+            The namespaces and their last activity
+        """
+        v1 = k8s_client.CoreV1Api(self.client)
+        namespaces = self._list_project_namespaces(project_id)
+
+        def get_activity(namespace: Any) -> EnvironmentActivity:
+            # Helm stores every revision of a release as a secret of its own
+            releases = v1.list_namespaced_secret(
+                namespace.metadata.name, label_selector="owner=helm"
+            ).items
+            timestamps = [namespace.metadata.creation_timestamp] + [
+                release.metadata.creation_timestamp for release in releases
+            ]
+            return EnvironmentActivity(
+                namespace=namespace.metadata.name,
+                project_id=(namespace.metadata.labels or {}).get(PROJECT_ID_LABEL, ""),
+                last_activity=max(timestamps),
+                terminating=getattr(namespace.status, "phase", "") == "Terminating",
+            )
+
+        activities = run_concurrently(
+            {
+                namespace.metadata.name: functools.partial(get_activity, namespace)
+                for namespace in namespaces
+            },
+            max_workers=max_workers,
+        )
+        return list(activities.values())
+
+    def gc_environments(
+        self,
+        ttl: timedelta,
+        project_id: Optional[str] = None,
+        protected: Optional[List[str]] = None,
+        max_workers: int = 1,
+        dry_run: bool = False,
+    ) -> List[str]:
+        """
+        Delete the namespaces of projects that have been idle for too long
+
+        Args:
+            ttl: How long a namespace can be idle before it is deleted
+            project_id: Only delete the namespaces of this project
+            protected: Names or patterns of namespaces that are never deleted
+            max_workers: Number of namespaces to handle at the same time
+            dry_run: Only report the namespaces that would be deleted
+
+        Returns:
+            Names of the deleted namespaces
+        """
+        logger.info(
+            icon=f"{self.ICON}  🧹",
+            title=f"Looking for environments idle for longer than {ttl}",
+        )
+        now = datetime.now(timezone.utc)
+        expired = []
+        for environment in sorted(
+            self.get_environments(project_id=project_id, max_workers=max_workers),
+            key=lambda environment: environment.last_activity,
+        ):
+            idle = now - environment.last_activity
+            if environment.terminating:
+                action = "being removed"
+            elif any(
+                fnmatch.fnmatchcase(environment.namespace, pattern)
+                for pattern in protected or []
+            ):
+                action = "protected"
+            elif idle > ttl:
+                action = "would be removed" if dry_run else "removing"
+                expired.append(environment.namespace)
+            else:
+                action = "active"
+            logger.info(
+                message=f"\t{environment.namespace} (project {environment.project_id}): "
+                f"idle for {timedelta(seconds=int(idle.total_seconds()))}, {action}"
+            )
+
+        if dry_run or not expired:
+            return []
+
+        run_concurrently(
+            {
+                namespace: functools.partial(self.delete_namespace, namespace)
+                for namespace in expired
+            },
+            max_workers=max_workers,
+        )
+        return expired
+
+    def _get_workloads(
+        self, namespace: str, labels: Optional[Dict[str, str]] = None
+    ) -> List[Tuple[Callable[..., Any], Any]]:
+        """
+        Get the Deployments and StatefulSets of a namespace
+
+        Returns:
+            The workloads with the functions for patching them
+        """
+        apps_v1 = k8s_client.AppsV1Api(self.client)
+        label_selector = self.labels_to_string(labels) if labels else None
+        workloads: List[Tuple[Callable[..., Any], Any]] = []
+        for list_func, patch_func in (
+            (
+                apps_v1.list_namespaced_deployment,
+                apps_v1.patch_namespaced_deployment,
+            ),
+            (
+                apps_v1.list_namespaced_stateful_set,
+                apps_v1.patch_namespaced_stateful_set,
+            ),
+        ):
+            items = list_func(namespace, label_selector=label_selector).items
+            workloads += [(patch_func, item) for item in items]
+        return workloads
+
+    @staticmethod
+    def _are_workloads_ready(
+        workloads: List[Any], values: ApplicationDeploymentValues
+    ) -> bool:
+        """
+        Check that the workloads of a release run as they were deployed
+
+        Manually scaled workloads and rollouts that never became ready are
+        not ready, so that they are deployed again.
+
+        Args:
+            workloads: Deployments and StatefulSets of the release
+            values: Values of the release
+
+        Returns:
+            True if every workload has all of its replicas ready
+        """
+        if not workloads:
+            # Only a release of jobs has no workloads
+            return bool(values.get("jobsOnly"))
+        return all(
+            (workload.spec.replicas or 0) > 0
+            and (workload.status.ready_replicas or 0) == workload.spec.replicas
+            for workload in workloads
+        )
+
+    def hibernate(
+        self, namespace: str, labels: Optional[Dict[str, str]] = None
+    ) -> List[str]:
+        """
+        Scale the Deployments and StatefulSets of a namespace to zero
+
+        The replica counts are stored in an annotation of each workload so
+        that :func:`~Kubernetes.wake` can restore them.
+
+        Args:
+            namespace: Namespace of the workloads
+            labels: Labels of the workloads, such as the release
+
+        Returns:
+            Names of the workloads that were scaled down
+        """
+        logger.info(
+            icon=f"{self.ICON}  💤", title=f"Hibernating namespace {namespace}: ", end=""
+        )
+        hibernated = []
+        for patch_func, workload in self._get_workloads(namespace, labels):
+            replicas = workload.spec.replicas or 0
+            if not replicas:
+                continue
+            patch_func(
+                workload.metadata.name,
+                namespace,
+                {
+                    "metadata": {
+                        "annotations": {HIBERNATED_REPLICAS_ANNOTATION: str(replicas)}
+                    },
+                    "spec": {"replicas": 0},
+                },
+            )
+            hibernated.append(workload.metadata.name)
+
+        logger.success(message=f"{len(hibernated)} workloads scaled down")
+        return hibernated
+
+    def wake(
+        self,
+        namespace: str,
+        labels: Optional[Dict[str, str]] = None,
+        wait: bool = True,
+        timeout: int = WAKE_TIMEOUT,
+    ) -> List[str]:
+        """
+        Restore the replica counts of workloads scaled down by :func:`~Kubernetes.hibernate`
+
+        Args:
+            namespace: Namespace of the workloads
+            labels: Labels of the workloads, such as the release
+            wait: Wait until the workloads are ready
+            timeout: Seconds to wait for
+
+        Returns:
+            Names of the workloads that were scaled up
+
+        Raises:
+            TimeoutError: The workloads are not ready after the timeout
+        """
+        logger.info(
+            icon=f"{self.ICON}  ⏰", title=f"Waking namespace {namespace}: ", end=""
+        )
+        woken = {}
+        for patch_func, workload in self._get_workloads(namespace, labels):
+            annotations = workload.metadata.annotations or {}
+            if HIBERNATED_REPLICAS_ANNOTATION not in annotations:
+                continue
+            replicas = int(annotations[HIBERNATED_REPLICAS_ANNOTATION])
+            patch_func(
+                workload.metadata.name,
+                namespace,
+                {
+                    "metadata": {"annotations": {HIBERNATED_REPLICAS_ANNOTATION: None}},
+                    "spec": {"replicas": replicas},
+                },
+            )
+            woken[workload.metadata.name] = replicas
+        logger.success(message=f"{len(woken)} workloads scaled up")
+
+        if wait and woken:
+            self._wait_for_workloads(namespace, labels, woken, timeout)
+        return list(woken)
+
+    def _wait_for_workloads(
+        self,
+        namespace: str,
+        labels: Optional[Dict[str, str]],
+        replicas: Dict[str, int],
+        timeout: int,
     ) -> None:
-        resource = (
-            "all,"
-            "ingress,"
-            "storageClasses,"
-            "volumeattachments,"
-            "persistentvolumeclaims,"
-            "persistentvolumes,"
-            "configmaps,"
-            "rolebinding,"
-            "role,"
-            "secrets"
-        )
-        self.delete(resource=resource, labels=labels, namespace=namespace)
-
-    def delete_namespace(self, namespace: str = settings.K8S_NAMESPACE) -> None:
-        self.delete(resource="namespace", name=namespace)
+        logger.info(
+            icon=f"{self.ICON}  ⏳",
+            title=f"Waiting for workloads of {namespace} to be ready: ",
+            end="",
+        )
+        deadline = time.monotonic() + timeout
+        while True:
+            not_ready = [
+                workload.metadata.name
+                for _, workload in self._get_workloads(namespace, labels)
+                if workload.metadata.name in replicas
+                and (workload.status.ready_replicas or 0)
+                < replicas[workload.metadata.name]
+            ]
+            if not not_ready:
+                logger.success()
+                return
+            if time.monotonic() >= deadline:
+                logger.error(
+                    message=f"Not ready in {timeout} seconds: {', '.join(not_ready)}",
+                    error=TimeoutError(),
+                    raise_exception=True,
+                )
+            time.sleep(self.WAKE_POLL_INTERVAL)
+
+    def get_project_namespaces(self, project_id: Optional[str] = None) -> List[str]:
+        """
+        Get the namespaces of projects that are not being removed
+
+        Args:
+            project_id: Only get the namespaces of this project
+        """
+        return [
+            namespace.metadata.name
+            for namespace in self._list_project_namespaces(project_id)
+            if getattr(namespace.status, "phase", "") != "Terminating"
+        ]
+
+    def _list_project_namespaces(self, project_id: Optional[str] = None) -> List[Any]:
+        v1 = k8s_client.CoreV1Api(self.client)
+        label_selector = (
+            f"{PROJECT_ID_LABEL}={project_id}" if project_id else PROJECT_ID_LABEL
+        )
+        return list(v1.list_namespace(label_selector=label_selector).items)
 
     def _resource_command(
         self,
@@ -790,43 +1584,146 @@ class Kubernetes:
         name: Optional[str] = None,
         labels: Optional[Dict[str, str]] = None,
         namespace: str = settings.K8S_NAMESPACE,
-    ) -> List[str]:
+    ) -> Tuple[List[str], str]:
+        """
+        Create the arguments for selecting resources with ``kubectl``
+
+        Returns:
+            The arguments and a description of the selection for logging
+        """
         command_args = [resource, f"--namespace={namespace}"]
+        description = ""
         if labels:
             labels_str = self.labels_to_string(labels)
             command_args += ["-l", labels_str]
-            logger.info(title=f" with labels {labels_str}", end="")
+            description += f" with labels {labels_str}"
         if name:
             command_args += [name]
-            logger.info(title=f" with name '{name}'", end="")
-        return command_args
+            description += f" with name '{name}'"
+        return command_args, description
 
     def get_certification_issuer(self, track: str) -> Optional[str]:
+        cert_issuer, source, raise_exception = self._certification_issuer(track)
         logger.info(
-            icon=f"{self.ICON} 🏵️️", title="Checking certification issuer", end=""
+            icon=f"{self.ICON} 🏵️️",
+            title="Checking certification issuer",
+            message=f" ({source}): ",
+            end="",
         )
+        found = self.cluster_issuer_exists(cert_issuer)
+        return self._log_certification_issuer(cert_issuer, found, raise_exception)
 
-        raise_exception = False
-        if settings.K8S_CLUSTER_ISSUER:
-            cert_issuer: str = settings.K8S_CLUSTER_ISSUER
-            logger.info(message=" (settings): ", end="")
-            raise_exception = True
+    async def get_certification_issuer_async(self, track: str) -> Optional[str]:
+        """
+        Asynchronous version of :func:`~Kubernetes.get_certification_issuer`
+
+        The issuer found is remembered in ``certification_issuers`` and used
+        for the deployments of the track.
+        """
+        cert_issuer, source, raise_exception = self._certification_issuer(track)
+        found = await run_in_thread(self.cluster_issuer_exists, cert_issuer)
+        logger.info(
+            icon=f"{self.ICON} 🏵️️",
+            title="Checking certification issuer",
+            message=f" ({source}): ",
+            end="",
+        )
+        issuer = self._log_certification_issuer(cert_issuer, found, raise_exception)
+        self.certification_issuers[track] = issuer
+        return issuer
+
+    def cluster_issuer_exists(self, cert_issuer: str) -> bool:
+        """
+        Check if the cluster has a cert-manager ClusterIssuer
+
+        The answer is remembered for the rest of the process for every
+        cluster and issuer, as the issuers of a cluster do not come and go
+        during a deployment.
+
+        Args:
+            cert_issuer: Name of the ClusterIssuer
+
+        Returns:
+            True if the issuer exists, otherwise False
+        """
+        key = (self.client.configuration.host, cert_issuer)
+        with _cluster_issuers_lock:
+            key_lock = _cluster_issuers_locks.setdefault(key, Lock())
+
+        # Only one thread looks an issuer up at a time, the rest wait for it
+        with key_lock:
+            with _cluster_issuers_lock:
+                if key in _cluster_issuers:
+                    return _cluster_issuers[key]
+
+            found = self._get_cluster_issuer(cert_issuer)
+            if found is None:
+                return False
+
+            with _cluster_issuers_lock:
+                _cluster_issuers[key] = found
+        return found
+
+    def _get_cluster_issuer(self, cert_issuer: str) -> Optional[bool]:
+        """
+        Look up a ClusterIssuer from the API
+
+        The versions of the cert-manager API are tried from the newest one
+        until the cluster serves one of them.
+
+        Returns:
+            True if the issuer exists, False if it does not and None if
+            the issuers could not be read
+        """
+        custom_objects = k8s_client.CustomObjectsApi(self.client)
+        versions: Tuple[str, ...]
+        if settings.K8S_CERTMANAGER_USE_OLD_API:
+            group, versions = "certmanager.k8s.io", ("v1alpha1",)
         else:
-            cert_issuer = f"certificate-letsencrypt-{track}"
-            logger.info(message=" (track): ", end="")
+            group, versions = "cert-manager.io", CERT_MANAGER_API_VERSIONS
 
-        os_command = ["kubectl", "get", "clusterissuer", cert_issuer]
-        result = run_os_command(os_command, shell=True)  # nosec
-        if not result.return_code:
+        for version in versions:
+            try:
+                custom_objects.get_cluster_custom_object(
+                    group, version, "clusterissuers", cert_issuer
+                )
+            except ApiException as e:
+                if e.status != 404:
+                    return None
+                # A missing issuer comes with a status, a missing API does not
+                if loads_json(e.body).get("details"):
+                    return False
+                continue
+            return True
+        return False
+
+    @staticmethod
+    def _certification_issuer(track: str) -> Tuple[str, str, bool]:
+        """
+        Get the name of the certification issuer to look for
+
+        Returns:
+            The name of the issuer, where the name comes from and whether a
+            missing issuer is an error
+        """
+        if settings.K8S_CLUSTER_ISSUER:
+            return settings.K8S_CLUSTER_ISSUER, "settings", True
+        return f"certificate-letsencrypt-{track}", "track", False
+
+    @staticmethod
+    def _log_certification_issuer(
+        cert_issuer: str, found: bool, raise_exception: bool
+    ) -> Optional[str]:
+        if found:
             logger.success(message=cert_issuer)
             return cert_issuer
+
+        error_message = f'No issuer "{cert_issuer}" found, using cluster defaults'
+        if raise_exception:
+            logger.error(message=error_message, raise_exception=True)
         else:
-            error_message = f'No issuer "{cert_issuer}" found, using cluster defaults'
-            if raise_exception:
-                logger.error(message=error_message, raise_exception=True)
-            else:
-                logger.info(message=error_message)
-            return None
+            logger.info(message=error_message)
+        return None
 
     def get(
         self,
@@ -836,18 +1733,37 @@ class Kubernetes:
         namespace: str = settings.K8S_NAMESPACE,
         raise_exception: bool = True,
     ) -> SubprocessResult:
-        os_command = ["kubectl", "get"]
+        resource_args, description = self._resource_command(
+            resource=resource, name=name, labels=labels, namespace=namespace
+        )
+        logger.info(
+            icon=f"{self.ICON}  ℹ️ ", title=f"Getting {resource}{description}: ", end=""
+        )
+        result = run_os_command(["kubectl", "get", *resource_args], shell=True)  # nosec
+        self._log_result(result, raise_exception=raise_exception)
+        return result
 
-        logger.info(icon=f"{self.ICON}  ℹ️ ", title=f"Getting {resource}", end="")
-        os_command += self._resource_command(
+    async def get_async(
+        self,
+        resource: str,
+        name: Optional[str] = None,
+        labels: Optional[Dict[str, str]] = None,
+        namespace: str = settings.K8S_NAMESPACE,
+        raise_exception: bool = True,
+    ) -> SubprocessResult:
+        """
+        Asynchronous version of :func:`~Kubernetes.get`
+        """
+        resource_args, description = self._resource_command(
             resource=resource, name=name, labels=labels, namespace=namespace
         )
-        logger.info(": ", end="")
-        result = run_os_command(os_command, shell=True)  # nosec
-        if not result.return_code:
-            logger.success()
-        else:
-            logger.std(result, raise_exception=raise_exception)
+        result = await run_os_command_async(
+            ["kubectl", "get", *resource_args], shell=True
+        )  # nosec
+        logger.info(
+            icon=f"{self.ICON}  ℹ️ ", title=f"Getting {resource}{description}: ", end=""
+        )
+        self._log_result(result, raise_exception=raise_exception)
         return result
 
     def status(
@@ -0,0 +1,337 @@
+import base64
+import json
+import re
+import ssl
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from ..settings import settings
+
+MANIFEST_LIST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+
+MANIFEST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.oci.image.manifest.v1+json",
+]
+
+DEFAULT_REGISTRY = "registry-1.docker.io"
+DOCKER_CERTS_PATH = Path("/etc/docker/certs.d")
+
+CHALLENGE_REGEX = re.compile(r'(\w+)="([^"]*)"')
+
+
+class Registry:
+    """
+    A client for the Docker Registry HTTP API V2
+
+    Both basic authentication and the bearer token flow used by, for
+    instance, GitLab and Docker Hub are supported. A CA certificate placed
+    in ``/etc/docker/certs.d/<registry>/ca.crt``, as the Docker daemon
+    expects it, is used for verifying the registry.
+    """
+
+    TIMEOUT = 30
+
+    def __init__(
+        self,
+        registry: str = settings.CONTAINER_REGISTRY,
+        username: str = settings.CONTAINER_REGISTRY_USER,
+        password: str = settings.CONTAINER_REGISTRY_PASSWORD,
+    ) -> None:
+        self.registry = registry or DEFAULT_REGISTRY
+        self.username = username
+        self.password = password
+        self._tokens: Dict[str, str] = {}
+
+        ca_file = DOCKER_CERTS_PATH / self.registry / "ca.crt"
+        self._ssl_context = ssl.create_default_context()
+        if ca_file.exists():
+            # Trust the registry CA in addition to the system certificates
+            self._ssl_context.load_verify_locations(cafile=str(ca_file))
+
+    @staticmethod
+    def split_image_repo(image_repo: str) -> Tuple[str, str]:
+        """
+        Split an image repository into a registry and a repository path
+
+        Args:
+            image_repo: Image repository, for instance ``registry:5000/group/app``
+
+        Returns:
+            The registry host and the path of the repository in the registry
+        """
+        host, _, path = image_repo.partition("/")
+        if path and ("." in host or ":" in host or host == "localhost"):
+            return host, path
+
+        path = image_repo
+        if "/" not in path:
+            path = f"library/{path}"
+        return DEFAULT_REGISTRY, path
+
+    def get_manifest_digest(self, repository: str, reference: str) -> Optional[str]:
+        """
+        Get the digest of a manifest without downloading it
+
+        Args:
+            repository: Path of the repository in the registry
+            reference: Tag or digest of the manifest
+
+        Returns:
+            The digest of the manifest or None if it does not exist
+        """
+        try:
+            _, headers = self._request(
+                "HEAD",
+                f"/v2/{repository}/manifests/{reference}",
+                scopes=[self._scope(repository)],
+                headers={"Accept": ", ".join(MANIFEST_MEDIA_TYPES)},
+            )
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+        return headers.get("Docker-Content-Digest")
+
+    def get_manifest(self, repository: str, reference: str) -> Tuple[bytes, str]:
+        """
+        Download a manifest
+
+        Args:
+            repository: Path of the repository in the registry
+            reference: Tag or digest of the manifest
+
+        Returns:
+            The manifest as it is stored in the registry and its media type
+        """
+        body, headers = self._request(
+            "GET",
+            f"/v2/{repository}/manifests/{reference}",
+            scopes=[self._scope(repository)],
+            headers={"Accept": ", ".join(MANIFEST_MEDIA_TYPES)},
+        )
+        return body, headers.get("Content-Type", MANIFEST_MEDIA_TYPES[1])
+
+    def put_manifest(
+        self, repository: str, reference: str, manifest: bytes, media_type: str
+    ) -> Optional[str]:
+        """
+        Upload a manifest
+
+        Args:
+            repository: Path of the repository in the registry
+            reference: Tag to upload the manifest as
+            manifest: The manifest, exactly as it should be stored
+            media_type: Media type of the manifest
+
+        Returns:
+            The digest of the uploaded manifest
+        """
+        _, headers = self._request(
+            "PUT",
+            f"/v2/{repository}/manifests/{reference}",
+            scopes=[self._scope(repository, push=True)],
+            headers={"Content-Type": media_type},
+            data=manifest,
+        )
+        return headers.get("Docker-Content-Digest")
+
+    def copy_manifest(self, repository: str, source: str, tag: str) -> Optional[str]:
+        """
+        Tag an existing manifest of a repository with another tag
+
+        The manifest is uploaded byte by byte as it was downloaded, so that
+        the tag points at the same digest as the source.
+
+        Args:
+            repository: Path of the repository in the registry
+            source: Tag or digest of the existing manifest
+            tag: New tag for the manifest
+
+        Returns:
+            The digest of the manifest
+        """
+        manifest, media_type = self.get_manifest(repository, source)
+        return self.put_manifest(repository, tag, manifest, media_type)
+
+    def mount_blob(self, repository: str, digest: str, source_repository: str) -> bool:
+        """
+        Make a blob of another repository of the registry available in a repository
+
+        Args:
+            repository: Path of the repository to mount the blob to
+            digest: Digest of the blob
+            source_repository: Path of the repository that has the blob
+
+        Returns:
+            True if the blob was mounted, False if the registry refused to
+            mount it and started a regular upload instead
+        """
+        query = urlencode({"mount": digest, "from": source_repository})
+        _, headers = self._request(
+            "POST",
+            f"/v2/{repository}/blobs/uploads/?{query}",
+            scopes=[
+                self._scope(repository, push=True),
+                self._scope(source_repository),
+            ],
+            data=b"",
+        )
+        if not headers.get("Docker-Content-Digest"):
+            # Cancel the upload the registry started instead of mounting
+            location = headers.get("Location", "")
+            if location.startswith("/"):
+                location = f"https://{self.registry}{location}"
+            if location:
+                self._request(
+                    "DELETE",
+                    location,
+                    scopes=[self._scope(repository, push=True)],
+                )
+            return False
+        return True
+
+    def copy_image(
+        self,
+        source_repository: str,
+        reference: str,
+        repository: str,
+        tags: Sequence[str],
+    ) -> Optional[str]:
+        """
+        Tag an image of a repository in another repository of the same registry
+
+        Layers are not transferred, the blobs of the image are mounted from
+        the source repository and the manifest is uploaded as is. Images
+        with manifests for several platforms are copied with all of their
+        platforms.
+
+        Args:
+            source_repository: Path of the repository that has the image
+            reference: Tag or digest of the image in the source repository
+            repository: Path of the repository to tag the image in
+            tags: Tags to give the image
+
+        Returns:
+            The digest of the image
+        """
+        manifest, media_type = self.get_manifest(source_repository, reference)
+        if repository != source_repository:
+            self._copy_referenced(source_repository, repository, manifest, media_type)
+
+        digest = None
+        for tag in tags:
+            digest = self.put_manifest(repository, tag, manifest, media_type)
+        return digest
+
+    def _copy_referenced(
+        self,
+        source_repository: str,
+        repository: str,
+        manifest: bytes,
+        media_type: str,
+    ) -> None:
+        manifest_data: Dict[str, Any] = json.loads(manifest)
+
+        if media_type in MANIFEST_LIST_MEDIA_TYPES:
+            for child in manifest_data.get("manifests", []):
+                child_manifest, child_media_type = self.get_manifest(
+                    source_repository, child["digest"]
+                )
+                self._copy_referenced(
+                    source_repository, repository, child_manifest, child_media_type
+                )
+                self.put_manifest(
+                    repository, child["digest"], child_manifest, child_media_type
+                )
+            return
+
+        blobs: List[Dict[str, Any]] = manifest_data.get("layers", [])
+        if "config" in manifest_data:
+            blobs = [manifest_data["config"], *blobs]
+        for blob in blobs:
+            if not self.mount_blob(repository, blob["digest"], source_repository):
+                raise ValueError(
+                    f"Blob {blob['digest']} could not be mounted from {source_repository}"
+                )
+
+    @staticmethod
+    def _scope(repository: str, push: bool = False) -> str:
+        return f"repository:{repository}:{'pull,push' if push else 'pull'}"
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        scopes: Sequence[str],
+        headers: Optional[Mapping[str, str]] = None,
+        data: Optional[bytes] = None,
+    ) -> Tuple[bytes, Mapping[str, str]]:
+        scope = " ".join(scopes)
+        url = path if path.startswith("https://") else f"https://{self.registry}{path}"
+        request = Request(
+            url,
+            data=data,
+            method=method,
+            headers=dict(headers or {}),
+        )
+
+        if scope in self._tokens:
+            request.add_header("Authorization", self._tokens[scope])
+        try:
+            return self._open(request)
+        except HTTPError as e:
+            if e.code != 401:
+                raise
+            self._tokens[scope] = self._authenticate(
+                e.headers.get("WWW-Authenticate", ""), scope
+            )
+
+        request.add_header("Authorization", self._tokens[scope])
+        return self._open(request)
+
+    def _open(self, request: Request) -> Tuple[bytes, Mapping[str, str]]:
+        with urlopen(  # nosec: requests are only made to the registry
+            request, timeout=self.TIMEOUT, context=self._ssl_context
+        ) as response:
+            return response.read(), response.headers
+
+    def _authenticate(self, challenge: str, scope: str) -> str:
+        """
+        Get the value of the Authorization header for a challenge
+
+        Args:
+            challenge: The ``WWW-Authenticate`` header of a 401 response
+            scope: Space separated scopes to request a bearer token for
+
+        Returns:
+            The value for the ``Authorization`` header
+        """
+        credentials = base64.b64encode(
+            f"{self.username}:{self.password}".encode()
+        ).decode()
+        scheme, _, params = challenge.partition(" ")
+        if scheme.lower() != "bearer":
+            return f"Basic {credentials}"
+
+        challenge_params = dict(CHALLENGE_REGEX.findall(params))
+        query = [("scope", scope_item) for scope_item in scope.split()]
+        if "service" in challenge_params:
+            query.append(("service", challenge_params["service"]))
+
+        request = Request(f"{challenge_params.get('realm', '')}?{urlencode(query)}")
+        if self.username:
+            request.add_header("Authorization", f"Basic {credentials}")
+        body, _ = self._open(request)
+        token_data = json.loads(body)
+
+        token = token_data.get("token") or token_data.get("access_token", "")
+        return f"Bearer {token}"
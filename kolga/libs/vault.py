@@ -1,13 +1,25 @@
+import functools
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
 
 import hvac  # type: ignore
 from jwt import encode
 
+from kolga.utils.general import run_concurrently
 from kolga.utils.logger import logger
 
 from ..settings import settings
 
+_SecretsCacheKey = Tuple[str, str, int]
+
+
+class SecretsCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+
 
 class Vault:
     """
@@ -16,16 +28,26 @@ class Vault:
 
     ICON = "🗄️"
 
+    # The secrets cache is shared between all instances in the process so
+    # that every project of a deployment can use the same read of a path.
+    _secrets_cache: Dict[_SecretsCacheKey, Tuple[float, Dict[str, str]]] = {}
+    _secrets_cache_locks: Dict[_SecretsCacheKey, threading.Lock] = {}
+    _secrets_cache_lock = threading.Lock()
+    _cache_hits = 0
+    _cache_misses = 0
+
     def __init__(
         self,
         track: str,
         vault_addr: str = settings.VAULT_ADDR,
         skip_tls: bool = settings.VAULT_TLS_ENABLED,
+        cache_ttl: int = settings.VAULT_SECRETS_CACHE_TTL,
     ) -> None:
         self.client = hvac.Client(url=vault_addr, verify=settings.VAULT_TLS_ENABLED)
         self.vault_addr = vault_addr
         self.skip_tls = skip_tls
         self.track = track
+        self.cache_ttl = cache_ttl
         self.initialized = False
 
         if self.vault_addr:
@@ -72,35 +94,118 @@ class Vault:
                     raise_exception=True,
                 )
 
-    def get_secrets(self) -> Dict[str, str]:
-        if self.initialized:
-            secrets_list = {}
-            secret_path = f"{settings.PROJECT_NAME}-{self.track}"
-            try:
-                logger.info(
-                    icon=f"{self.ICON} 🔑",
-                    message=f"Checking for secrets in {settings.VAULT_KV_SECRET_MOUNT_POINT}/{secret_path}",
+    @classmethod
+    def cache_info(cls) -> SecretsCacheInfo:
+        """
+        Get statistics of the secrets cache
+
+        Returns:
+            The amount of cache hits and misses and the amount of cached paths
+        """
+        with cls._secrets_cache_lock:
+            return SecretsCacheInfo(
+                hits=cls._cache_hits,
+                misses=cls._cache_misses,
+                size=len(cls._secrets_cache),
+            )
+
+    @classmethod
+    def clear_cache(cls) -> None:
+        with cls._secrets_cache_lock:
+            cls._secrets_cache.clear()
+            cls._secrets_cache_locks.clear()
+            cls._cache_hits = 0
+            cls._cache_misses = 0
+
+    def get_secrets(self, path: Optional[str] = None) -> Dict[str, str]:
+        """
+        Get secrets stored in a path of the KV secrets engine
+
+        Each (mount point, path, KV version) combination is read from Vault
+        only once during ``cache_ttl`` seconds. Subsequent calls, also from
+        other instances and threads, get a copy of the cached secrets.
+
+        Args:
+            path: Path to read, defaults to ``{PROJECT_NAME}-{track}``
+
+        Returns:
+            A dict of secret names and values
+        """
+        if not self.initialized:
+            return {}
+
+        secret_path = path or f"{settings.PROJECT_NAME}-{self.track}"
+        key = (
+            settings.VAULT_KV_SECRET_MOUNT_POINT,
+            secret_path,
+            settings.VAULT_KV_VERSION,
+        )
+
+        with self._secrets_cache_lock:
+            key_lock = self._secrets_cache_locks.setdefault(key, threading.Lock())
+
+        # Only one thread reads a path at a time, the rest wait for the result
+        with key_lock:
+            with self._secrets_cache_lock:
+                cached = self._secrets_cache.get(key)
+                if cached and cached[0] > time.monotonic():
+                    Vault._cache_hits += 1
+                    return dict(cached[1])
+                Vault._cache_misses += 1
+
+            secrets_list = self._read_secrets(*key)
+
+            with self._secrets_cache_lock:
+                self._secrets_cache[key] = (
+                    time.monotonic() + self.cache_ttl,
+                    secrets_list,
                 )
-                secrets = {}
-                if settings.VAULT_KV_VERSION == 2:
-                    secrets = self.client.secrets.kv.read_secret_version(
-                        path=secret_path,
-                        mount_point=settings.VAULT_KV_SECRET_MOUNT_POINT,
-                    )
-                    secrets_list = secrets["data"]["data"]
+        return dict(secrets_list)
 
-                else:
-                    secrets = self.client.secrets.kv.v1.read_secret(
-                        path=secret_path,
-                        mount_point=settings.VAULT_KV_SECRET_MOUNT_POINT,
-                    )
-                    secrets_list = secrets["data"]
-            except hvac.exceptions.InvalidPath as e:
-                logger.error(
-                    icon=f"{self.ICON} 🔑",
-                    message="Secrets not found ",
-                    error=e,
-                    raise_exception=False,
+    def get_secrets_for_paths(self, paths: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """
+        Get secrets from multiple paths concurrently
+
+        Args:
+            paths: Paths to read
+
+        Returns:
+            A dict with the path as key and the secrets of that path as value
+        """
+        unique_paths = set(paths)
+        return run_concurrently(
+            {path: functools.partial(self.get_secrets, path) for path in unique_paths},
+            max_workers=len(unique_paths),
+        )
+
+    def _read_secrets(
+        self, mount_point: str, secret_path: str, kv_version: int
+    ) -> Dict[str, str]:
+        secrets_list = {}
+        try:
+            logger.info(
+                icon=f"{self.ICON} 🔑",
+                message=f"Checking for secrets in {mount_point}/{secret_path}",
+            )
+            secrets = {}
+            if kv_version == 2:
+                secrets = self.client.secrets.kv.read_secret_version(
+                    path=secret_path,
+                    mount_point=mount_point,
+                )
+                secrets_list = secrets["data"]["data"]
+
+            else:
+                secrets = self.client.secrets.kv.v1.read_secret(
+                    path=secret_path,
+                    mount_point=mount_point,
                 )
-            return secrets_list
-        return {}
+                secrets_list = secrets["data"]
+        except hvac.exceptions.InvalidPath as e:
+            logger.error(
+                icon=f"{self.ICON} 🔑",
+                message="Secrets not found ",
+                error=e,
+                raise_exception=False,
+            )
+        return secrets_list
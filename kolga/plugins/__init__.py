@@ -1,9 +1,10 @@
-from typing import Any, List
+from typing import List
 
-from kolga.plugins.sentry.sentry import KolgaSentryPlugin
-from kolga.plugins.slack.slack import KolgaSlackPlugin
+from kolga.hooks.plugins import PluginSpec
+from kolga.plugins.sentry import PLUGIN as SENTRY_PLUGIN
+from kolga.plugins.slack import PLUGIN as SLACK_PLUGIN
 
-KOLGA_CORE_PLUGINS: List[Any] = [
-    KolgaSentryPlugin,
-    KolgaSlackPlugin,
+KOLGA_CORE_PLUGINS: List[PluginSpec] = [
+    SENTRY_PLUGIN,
+    SLACK_PLUGIN,
 ]
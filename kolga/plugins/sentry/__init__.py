@@ -0,0 +1,7 @@
+from kolga.hooks.plugins import PluginSpec
+
+PLUGIN = PluginSpec(
+    name="sentry",
+    plugin="kolga.plugins.sentry.sentry:KolgaSentryPlugin",
+    required_variables=("SENTRY_DSN",),
+)
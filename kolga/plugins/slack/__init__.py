@@ -0,0 +1,7 @@
+from kolga.hooks.plugins import PluginSpec
+
+PLUGIN = PluginSpec(
+    name="slack",
+    plugin="kolga.plugins.slack.slack:KolgaSlackPlugin",
+    required_variables=("SLACK_TOKEN", "SLACK_CHANNEL"),
+)
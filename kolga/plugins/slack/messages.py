@@ -14,23 +14,29 @@ class _SlackMessageBody(TypedDict, total=False):
     fields: List[_SlackMessageField]
 
 
-def new_environment_message(environment_track: str, project: "Project") -> List[Any]:
+def new_environment_message(
+    environment_track: str, projects: List["Project"]
+) -> List[Any]:
     # Import settings in function to not have circular imports
     from kolga.settings import settings
 
     message: List[Any] = []
+    project_names = ", ".join(project.verbose_name for project in projects)
     title_section = {
         "type": "section",
         "text": {
             "type": "mrkdwn",
-            "text": f"*New {environment_track} deployment for {project.verbose_name}*",
+            "text": f"*New {environment_track} deployment for {project_names}*",
         },
     }
     body_section: _SlackMessageBody = {"type": "section", "fields": []}
 
-    if project.url:
+    for project in projects:
+        if not project.url:
+            continue
+        url_title = "URL" if len(projects) == 1 else project.verbose_name
         body_section["fields"].append(
-            {"type": "mrkdwn", "text": f"*:link: URL:*\n <{project.url}|Link>"}
+            {"type": "mrkdwn", "text": f"*:link: {url_title}:*\n <{project.url}|Link>"}
         )
 
     if settings.PR_URL and settings.PR_TITLE:
@@ -58,6 +64,9 @@ def new_environment_message(environment_track: str, project: "Project") -> List[
         )
 
     message.append(title_section)
-    message.append(body_section)
+    # Slack allows at most ten fields per section
+    fields = body_section["fields"]
+    for i in range(0, len(fields) or 1, 10):
+        message.append({"type": "section", "fields": fields[i : i + 10]})
 
     return message
@@ -1,4 +1,4 @@
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, List, Optional
 
 from environs import Env
 from slack_sdk import WebClient
@@ -30,13 +30,14 @@ class KolgaSlackPlugin(PluginBase):
         self.client = WebClient(self.SLACK_TOKEN)
 
     @hookimpl
-    def project_deployment_complete(
-        self, project: "Project", track: str, namespace: str
+    def deployment_complete(
+        self, projects: List["Project"], track: str, namespace: str
     ) -> Optional[bool]:
         if not self.configured:
             return None
 
-        deployment_message = new_environment_message(track, project)
+        # One message covers all of the projects of the deployment
+        deployment_message = new_environment_message(track, projects)
 
         try:
             self.client.chat_postMessage(
@@ -1,6 +1,11 @@
-from typing import Any
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+from typing import Any, Dict, Generator, List, Tuple
 from unittest import mock
 
+import pytest
 import slack_sdk
 
 from kolga.libs.project import Project
@@ -9,21 +14,112 @@ from tests.testcase import load_plugin
 
 from ..slack import KolgaSlackPlugin
 
+SLACK_ENVIRONMENT = {"SLACK_TOKEN": "test_token", "SLACK_CHANNEL": "kolga-test"}
 
-@mock.patch.dict(
-    "os.environ",
-    {
-        "SLACK_TOKEN": "test_token",
-        "SLACK_CHANNEL": "kolga-test",
-    },
-)
+FakeSlack = Tuple[str, List[Dict[str, Any]], Event]
+
+
+def _projects() -> List[Project]:
+    return [
+        Project(track="review", name="odin", url="odin.example.com"),
+        Project(track="review", name="thor", url="thor.example.com"),
+    ]
+
+
+def _use_fake_slack(url: str) -> None:
+    plugin = settings.plugin_manager.get_plugin("slack")
+    assert plugin
+    plugin.client.base_url = url
+
+
+@pytest.fixture()
+def fake_slack() -> Generator[FakeSlack, None, None]:
+    """
+    Run a local Slack Web API that records the messages posted to it
+
+    Requests are answered once the returned event is set, or after a second.
+    """
+    requests: List[Dict[str, Any]] = []
+    respond = Event()
+
+    class FakeSlackHandler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            requests.append({"path": self.path, "body": json.loads(body)})
+            respond.wait(timeout=1)
+
+            response = json.dumps({"ok": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSlackHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f"http://127.0.0.1:{server.server_port}/api/", requests, respond
+
+    respond.set()
+    server.shutdown()
+    server.server_close()
+
+
+@mock.patch.dict("os.environ", SLACK_ENVIRONMENT)
 @load_plugin(KolgaSlackPlugin)
 @mock.patch.object(slack_sdk.WebClient, "chat_postMessage", return_value=True)
-def test_project_deployment_complete(mock_post_message: Any) -> None:
-    results = settings.plugin_manager.hook.project_deployment_complete(
-        project=Project(track="review", url="test.example.com"),
-        track="review",
-        namespace="review",
+def test_deployment_complete(mock_post_message: Any) -> None:
+    results = settings.plugin_manager.hook.deployment_complete(
+        projects=_projects(), track="review", namespace="review"
     )
     assert len(results) == 1 and results[0] is True
     mock_post_message.assert_called_once()
+    title = mock_post_message.call_args[1]["blocks"][0]["text"]["text"]
+    assert title == "*New review deployment for Odin, Thor*"
+
+
+@mock.patch.dict("os.environ", SLACK_ENVIRONMENT)
+@load_plugin(KolgaSlackPlugin)
+def test_deployment_complete_dispatched(fake_slack: FakeSlack) -> None:
+    url, requests, respond = fake_slack
+    _use_fake_slack(url)
+
+    start = time.monotonic()
+    future = settings.hook_dispatcher.dispatch(
+        "deployment_complete",
+        {"projects": _projects(), "track": "review", "namespace": "review"},
+    )
+    # The slow Slack API does not hold up the deployment
+    assert time.monotonic() - start < 0.5
+    respond.set()
+
+    assert settings.hook_dispatcher.flush(timeout=5)
+    assert future.result() == [True]
+    assert len(requests) == 1
+    assert requests[0]["path"] == "/api/chat.postMessage"
+    fields = requests[0]["body"]["blocks"][1]["fields"]
+    assert [field["text"] for field in fields[:2]] == [
+        "*:link: Odin:*\n <odin.example.com|Link>",
+        "*:link: Thor:*\n <thor.example.com|Link>",
+    ]
+
+
+@mock.patch.dict("os.environ", SLACK_ENVIRONMENT)
+@load_plugin(KolgaSlackPlugin)
+def test_deployment_complete_timeout(fake_slack: FakeSlack) -> None:
+    url, _, _ = fake_slack
+    _use_fake_slack(url)
+
+    settings.hook_dispatcher.dispatch(
+        "deployment_complete",
+        {"projects": _projects(), "track": "review", "namespace": "review"},
+        timeout=0.2,
+    )
+
+    start = time.monotonic()
+    assert not settings.hook_dispatcher.flush(timeout=5)
+    assert time.monotonic() - start < 0.5
@@ -4,7 +4,9 @@ import sys
 import tempfile
 import uuid
 from glob import glob
+from hashlib import sha256
 from pathlib import Path
+from threading import Lock
 from typing import Any, Dict, List, Optional, Tuple
 
 import pluggy  # type: ignore
@@ -13,28 +15,63 @@ from environs import Env
 from kolga.utils.logger import logger
 from kolga.utils.models import BasicAuthUser
 
+from .hooks.dispatcher import HookDispatcher
 from .hooks.exceptions import PluginMissingConfiguration
 from .hooks.hookspec import KolgaHookSpec
+from .hooks.plugins import discover_plugins
 from .plugins import KOLGA_CORE_PLUGINS
 from .utils.environ_parsers import basicauth_parser, list_none_parser
+from .utils.environment import get_environment, invalidate_environment
 from .utils.exceptions import NoClusterConfigError
 from .utils.general import deep_get, kubernetes_safe_name
 
-service_artifacts_folder = os.environ.get("SERVICE_ARTIFACT_FOLDER", None)
-build_artifacts_folder = os.environ.get("BUILD_ARTIFACT_FOLDER", None)
-env_files = []
-if service_artifacts_folder:
-    env_files.extend(glob(f"./{service_artifacts_folder}/*.env"))
-if build_artifacts_folder:
-    env_files.extend(glob(f"./{build_artifacts_folder}/*.env"))
-
 env = Env()
 
 env.add_parser("basicauth", basicauth_parser)
 env.add_parser("list_none", list_none_parser)
-env.read_env()
-for env_file in env_files:
-    env.read_env(env_file)
+
+
+def read_env_files() -> None:
+    """
+    Read the .env files of the project and the artifact folders
+
+    The variables of the files are added to the environment of the process.
+    Variables already set in the environment are not overridden.
+    """
+    env.read_env()
+    for env_file in _get_artifact_env_files():
+        env.read_env(env_file)
+    invalidate_environment()
+
+
+def _get_artifact_env_files() -> List[str]:
+    service_artifacts_folder = os.environ.get("SERVICE_ARTIFACT_FOLDER", None)
+    build_artifacts_folder = os.environ.get("BUILD_ARTIFACT_FOLDER", None)
+    env_files = []
+    if service_artifacts_folder:
+        env_files.extend(glob(f"./{service_artifacts_folder}/*.env"))
+    if build_artifacts_folder:
+        env_files.extend(glob(f"./{build_artifacts_folder}/*.env"))
+    return env_files
+
+
+def get_env_files() -> List[str]:
+    """
+    Get the .env files read by :func:`read_env_files`
+
+    Returns:
+        Paths of the .env file of the project, if one is found, and of the
+        .env files in the artifact folders
+    """
+    env_files = []
+    # Like environs, look for the .env file from the directory of this module up
+    directory = Path(os.path.abspath(os.path.dirname(__file__)))
+    for parent in (directory, *directory.parents):
+        if (parent / ".env").exists():
+            env_files.append(str(parent / ".env"))
+            break
+    return [*env_files, *_get_artifact_env_files()]
+
 
 PROJECT_NAME_VAR = "PROJECT_NAME"
 
@@ -60,10 +97,12 @@ _VARIABLE_DEFINITIONS: Dict[str, List[Any]] = {
     "CONTAINER_REGISTRY_USER": [env.str, ""],
     "BUILT_DOCKER_TEST_IMAGE": [env.str, ""],
     "DOCKER_BUILD_ARG_PREFIX": [env.str, "DOCKER_BUILD_ARG_"],
+    "DOCKER_BUILD_BAKE": [env.bool, False],
     "DOCKER_BUILD_CONTEXT": [env.str, "."],
     "DOCKER_BUILD_SOURCE": [env.str, "Dockerfile"],
     "DOCKER_HOST": [env.str, ""],
     "DOCKER_IMAGE_NAME": [env.str, ""],
+    "DOCKER_SKIP_EXISTING_IMAGES": [env.bool, False],
     "DOCKER_TEST_IMAGE_STAGE": [env.str, "development"],
     # ================================================
     # ENVIRONMENT
@@ -93,10 +132,18 @@ _VARIABLE_DEFINITIONS: Dict[str, List[Any]] = {
     "RABBITMQ_VERSION_TAG": [env.str, "3.8.5"],
     "SERVICE_ARTIFACT_FOLDER": [env.str, ""],
     # ================================================
+    # HELM
+    # ================================================
+    "HELM_CHART_CACHE_DIR": [env.str, ""],
+    "HELM_CHART_CACHE_MAX_SIZE": [env.int, 500],
+    "HELM_OFFLINE": [env.bool, False],
+    "HELM_REPO_CACHE_TTL": [env.int, 0],
+    # ================================================
     # KUBERNETES
     # ================================================
     "K8S_ADDITIONAL_HOSTNAMES": [env.list_none, []],
     "K8S_CLUSTER_ISSUER": [env.str, ""],
+    "K8S_DEPLOYMENT_FINGERPRINT": [env.bool, False],
     "K8S_HPA_ENABLED": [env.bool, False],
     "K8S_HPA_MAX_REPLICAS": [env.int, 3],
     "K8S_HPA_MIN_REPLICAS": [env.int, 1],
@@ -116,6 +163,9 @@ _VARIABLE_DEFINITIONS: Dict[str, List[Any]] = {
     "K8S_PROBE_FAILURE_THRESHOLD": [env.int, 3],
     "K8S_PROBE_INITIAL_DELAY": [env.int, 60],
     "K8S_PROBE_PERIOD": [env.int, 10],
+    "K8S_GC_CONCURRENCY": [env.int, 4],
+    "K8S_GC_PROTECTED_NAMESPACES": [env.list_none, []],
+    "K8S_GC_TTL": [env.int, 168],
     "K8S_FILE_SECRET_MOUNTPATH": [env.str, "/tmp/secrets"],  # nosec
     "K8S_FILE_SECRET_PREFIX": [env.str, "K8S_FILE_SECRET_"],
     "K8S_READINESS_PATH": [env.str, "/readiness"],
@@ -125,6 +175,7 @@ _VARIABLE_DEFINITIONS: Dict[str, List[Any]] = {
     "K8S_LIMIT_RAM": [env.str, ""],
     "K8S_SECRET_PREFIX": [env.str, "K8S_SECRET_"],
     "K8S_LIVENESS_FILE": [env.str, ""],
+    "K8S_LOG_MAX_LINES": [env.int, 1000],
     "K8S_PERSISTENT_STORAGE": [env.bool, False],
     "K8S_PERSISTENT_STORAGE_ACCESS_MODE": [env.str, "ReadWriteOnce"],
     "K8S_PERSISTENT_STORAGE_PATH": [env.str, ""],
@@ -132,12 +183,16 @@ _VARIABLE_DEFINITIONS: Dict[str, List[Any]] = {
     "K8S_PERSISTENT_STORAGE_STORAGE_TYPE": [env.str, "standard"],
     "K8S_READINESS_FILE": [env.str, ""],
     "K8S_REPLICACOUNT": [env.int, 1],
+    "K8S_ROLLOUT_WATCHER_DISABLED": [env.bool, False],
     "K8S_TEMP_STORAGE_PATH": [env.str, ""],
     "KUBECONFIG": [env.str, ""],
     "DEPENDS_ON_PROJECTS": [env.str, ""],
     # ================================================
     # PIPELINE
     # ================================================
+    "KOLGA_DEPLOY_CONCURRENCY": [env.int, 1],
+    "KOLGA_HOOK_FLUSH_TIMEOUT": [env.int, 60],
+    "KOLGA_HOOK_TIMEOUT": [env.int, 30],
     "KOLGA_JOBS_ONLY": [env.bool, False],
     # ================================================
     # VAULT
@@ -146,6 +201,7 @@ _VARIABLE_DEFINITIONS: Dict[str, List[Any]] = {
     "VAULT_JWT_AUTH_PATH": [env.str, "jwt"],
     "VAULT_KV_SECRET_MOUNT_POINT": [env.str, "secrets"],
     "VAULT_KV_VERSION": [env.int, 1],
+    "VAULT_SECRETS_CACHE_TTL": [env.int, 300],
     "VAULT_JWT": [env.str, ""],
     "VAULT_JWT_PRIVATE_KEY": [env.str, ""],
     "VAULT_TLS_ENABLED": [env.bool, True],
@@ -162,6 +218,20 @@ _VARIABLE_DEFINITIONS: Dict[str, List[Any]] = {
     "PR_URL": [env.str, ""],
 }
 
+SETTINGS_SNAPSHOT_FILE = "settings.json"
+SETTINGS_SNAPSHOT_VERSION = 2
+
+# Settings that are never written to the settings snapshot
+SECRET_VARIABLES = frozenset(
+    {
+        "CONTAINER_REGISTRY_PASSWORD",
+        "DATABASE_PASSWORD",
+        "K8S_INGRESS_BASIC_AUTH",
+        "VAULT_JWT",
+        "VAULT_JWT_PRIVATE_KEY",
+    }
+)
+
 
 class Settings:
     PROJECT_NAME: str
@@ -177,10 +247,12 @@ class Settings:
     CONTAINER_REGISTRY_USER: str
     BUILT_DOCKER_TEST_IMAGE: str
     DOCKER_BUILD_ARG_PREFIX: str
+    DOCKER_BUILD_BAKE: bool
     DOCKER_BUILD_CONTEXT: str
     DOCKER_BUILD_SOURCE: str
     DOCKER_HOST: str
     DOCKER_IMAGE_NAME: str
+    DOCKER_SKIP_EXISTING_IMAGES: bool
     DOCKER_TEST_IMAGE_STAGE: str
     DEFAULT_TRACK: str
     ENVIRONMENT_SLUG: str
@@ -200,8 +272,13 @@ class Settings:
     POSTGRES_IMAGE: str
     RABBITMQ_VERSION_TAG: str
     SERVICE_ARTIFACT_FOLDER: str
+    HELM_CHART_CACHE_DIR: str
+    HELM_CHART_CACHE_MAX_SIZE: int
+    HELM_OFFLINE: bool
+    HELM_REPO_CACHE_TTL: int
     K8S_ADDITIONAL_HOSTNAMES: List[str]
     K8S_CLUSTER_ISSUER: str
+    K8S_DEPLOYMENT_FINGERPRINT: bool
     K8S_HPA_ENABLED: bool
     K8S_HPA_MAX_REPLICAS: int
     K8S_HPA_MIN_REPLICAS: int
@@ -226,6 +303,9 @@ class Settings:
     K8S_PROBE_FAILURE_THRESHOLD: int
     K8S_PROBE_INITIAL_DELAY: int
     K8S_PROBE_PERIOD: int
+    K8S_GC_CONCURRENCY: int
+    K8S_GC_PROTECTED_NAMESPACES: List[str]
+    K8S_GC_TTL: int
     K8S_FILE_SECRET_MOUNTPATH: str
     K8S_FILE_SECRET_PREFIX: str
     K8S_READINESS_PATH: str
@@ -235,16 +315,22 @@ class Settings:
     K8S_LIMIT_RAM: str
     K8S_SECRET_PREFIX: str
     K8S_LIVENESS_FILE: str
+    K8S_LOG_MAX_LINES: int
     K8S_READINESS_FILE: str
     K8S_REPLICACOUNT: int
+    K8S_ROLLOUT_WATCHER_DISABLED: bool
     K8S_TEMP_STORAGE_PATH: str
     KUBECONFIG: str
     DEPENDS_ON_PROJECTS: str
+    KOLGA_DEPLOY_CONCURRENCY: int
+    KOLGA_HOOK_FLUSH_TIMEOUT: int
+    KOLGA_HOOK_TIMEOUT: int
     KOLGA_JOBS_ONLY: bool
     VAULT_ADDR: str
     VAULT_JWT_AUTH_PATH: str
     VAULT_KV_SECRET_MOUNT_POINT: str
     VAULT_KV_VERSION: int
+    VAULT_SECRETS_CACHE_TTL: int
     VAULT_TLS_ENABLED: bool
     VAULT_JWT: str
     VAULT_JWT_PRIVATE_KEY: str
@@ -263,21 +349,39 @@ class Settings:
 
         self.devops_root_path = Path(sys.argv[0]).resolve().parent
 
-        self.active_ci: Optional[Any] = None
         self.supported_cis: List[Any] = [
             GitLabMapper(),
             AzurePipelinesMapper(),
             GitHubActionsMapper(),
         ]
-        self._set_ci_environment()
-        setattr(self, PROJECT_NAME_VAR, self._get_project_name())
+        self._active_ci: Optional[Any] = None
+        self._environment_loaded = False
+        self._environment_lock = Lock()
+
+        self.plugin_manager = self._setup_pluggy()
+        self.hook_dispatcher = HookDispatcher(self.plugin_manager)
 
-        if self.active_ci:
-            self._map_ci_variables()
+    @property
+    def active_ci(self) -> Optional[Any]:
+        self._load_environment()
+        return self._active_ci
 
-        self._set_attributes()
+    def _load_environment(self) -> None:
+        """
+        Read the .env files and activate the CI mapper once
 
-        self.plugin_manager = self._setup_pluggy()
+        Nothing is read when the settings are created, only when the first
+        setting is resolved.
+        """
+        if self._environment_loaded:
+            return
+
+        with self._environment_lock:
+            if self._environment_loaded:
+                return
+            read_env_files()
+            self._set_ci_environment()
+            self._environment_loaded = True
 
     def _setup_pluggy(self) -> pluggy.PluginManager:
         pm: pluggy.PluginManager = pluggy.PluginManager("kolga")
@@ -287,8 +391,14 @@ class Settings:
 
     def load_plugins(self) -> None:
         loading_plugins = False
+        # The required variables may be set in the .env files
+        self._load_environment()
 
-        for plugin in KOLGA_CORE_PLUGINS:
+        for plugin_spec in discover_plugins(KOLGA_CORE_PLUGINS):
+            # Plugins that are not configured are not even imported
+            if not plugin_spec.is_configured():
+                continue
+            plugin = plugin_spec.load()
             plugin_loaded, message = self._load_plugin(plugin)
             if not loading_plugins and plugin_loaded:
                 logger.info(
@@ -317,41 +427,59 @@ class Settings:
 
         return self.plugin_manager.unregister(_to_be_unregistered_plugin)
 
-    def _set_attributes(self) -> None:
+    def resolve(self, name: str) -> Any:
         """
-        Read and set settings from environment variables
+        Read a setting from environment variables
+
+        Settings are resolved on first access and the value is kept on the
+        instance, so that each setting is parsed at most once.
 
         Strategy:
         1. If a value is set in the environment, use it
         2. If a value is set in a project prefixed environment variable use it
-        3. If the attribute is already set, use the pre-existing value
+        3. If the CI maps a value to the setting, use it
         4. Should all else fail, use the default value
+
+        Args:
+            name: Name of the setting
+
+        Returns:
+            Value of the setting
         """
         from .utils.general import env_var_safe_key
 
-        safe_name = env_var_safe_key(self.PROJECT_NAME)
-        for variable, (parser, default_value) in _VARIABLE_DEFINITIONS.items():
-            value = parser(variable, None)
-            if value is None:
-                project_prefixed_variable_name = f"{safe_name}_{variable}"
-                value = parser(project_prefixed_variable_name, None)
-
-            if value is None:
-                if hasattr(self, variable):
-                    # Don't override an already-set value with default
-                    continue
-                else:
-                    value = default_value
+        self._load_environment()
+        if name == PROJECT_NAME_VAR:
+            return self._get_project_name()
+
+        parser, default_value = _VARIABLE_DEFINITIONS[name]
+        value = parser(name, None)
+        if value is None:
+            safe_name = env_var_safe_key(self.PROJECT_NAME)
+            project_prefixed_variable_name = f"{safe_name}_{name}"
+            value = parser(project_prefixed_variable_name, None)
 
-            setattr(self, variable, value)
+        if value is None:
+            value = self._get_ci_value(name)
+
+        if value is None:
+            value = default_value
+        return value
 
     def _set_ci_environment(self) -> None:
         for ci in self.supported_cis:
             if ci.is_active:
-                self.active_ci = ci
+                self._active_ci = ci
                 ci.initialize()
                 break
 
+        if self._active_ci:
+            for name_to in self._active_ci.MAPPING:
+                if name_to not in _VARIABLE_DEFINITIONS:
+                    logger.warning(
+                        message=f"CI variable mapping failed, no setting called {name_to}"
+                    )
+
     def _get_project_name(self) -> str:
         parser, default_value = _VARIABLE_DEFINITIONS[PROJECT_NAME_VAR]
         project_name: str = parser(PROJECT_NAME_VAR, default_value)
@@ -366,38 +494,179 @@ class Settings:
             raise AssertionError("No project name could be found!")
         return project_name
 
-    def _map_ci_variables(self) -> None:
+    def _get_ci_value(self, name: str) -> Any:
         """
-        Map CI variables to settings
+        Get the value the CI maps to a setting
 
         If the source name starts with '=', get the value from mapper's
         attribute. Otwerwise read the value from environment.
+
+        Args:
+            name: Name of the setting
+
+        Returns:
+            The value, None if the CI does not map one to the setting
         """
         mapper = self.active_ci
         if not mapper:
             return None
 
-        ci_value = None
-        for name_to, name_from in mapper.MAPPING.items():
-            if name_to not in _VARIABLE_DEFINITIONS:
-                logger.warning(
-                    message=f"CI variable mapping failed, no setting called {name_to}"
+        name_from = mapper.MAPPING.get(name)
+        if not name_from:
+            return None
+
+        if name_from.startswith("="):
+            name_from = name_from[1:]
+            try:
+                return getattr(mapper, name_from)
+            except AttributeError:
+                logger.error(
+                    message=f"CI variable mapping failed, no mapper attribute called {name_from}"
                 )
+                return None
 
-            if name_from.startswith("="):
-                name_from = name_from[1:]
-                try:
-                    ci_value = getattr(mapper, name_from)
-                except AttributeError:
-                    logger.error(
-                        message=f"CI variable mapping failed, no mapper attribute called {name_from}"
-                    )
-            else:
-                parser, _ = _VARIABLE_DEFINITIONS[name_to]
-                ci_value = parser(name_from, None)
+        parser, _ = _VARIABLE_DEFINITIONS[name]
+        return parser(name_from, None)
+
+    def get_snapshot_path(self) -> Optional[Path]:
+        if not self.BUILD_ARTIFACT_FOLDER:
+            return None
+        return Path.cwd() / self.BUILD_ARTIFACT_FOLDER / SETTINGS_SNAPSHOT_FILE
+
+    def _get_snapshot_key(self) -> str:
+        """
+        Create a key of the inputs the snapshotted settings are resolved from
 
-            if ci_value is not None:
-                setattr(self, name_to, ci_value)
+        The inputs are the modification times and sizes of the .env files,
+        the values of the environment variables each setting can be read
+        from, the sources of the computed CI values and the default values.
+        Nothing is resolved for the key, so checking it costs a fraction of
+        resolving the settings.
+
+        Returns:
+            SHA-256 digest of the inputs
+        """
+        from .utils.general import env_var_safe_key
+
+        mapper = self.active_ci
+        safe_name = env_var_safe_key(self.PROJECT_NAME)
+        environment = get_environment()
+        variables: Dict[str, Optional[str]] = {}
+        defaults: Dict[str, Any] = {}
+        for name, (_, default_value) in _VARIABLE_DEFINITIONS.items():
+            if name in SECRET_VARIABLES:
+                continue
+            names = [name, f"{safe_name}_{name}"]
+            name_from = mapper.MAPPING.get(name) if mapper else None
+            if name_from and not name_from.startswith("="):
+                names.append(name_from)
+            for variable_name in names:
+                variables[variable_name] = environment.get(variable_name)
+            defaults[name] = default_value
+
+        env_files = {}
+        for env_file in get_env_files():
+            try:
+                stat = os.stat(env_file)
+            except OSError:
+                continue
+            env_files[env_file] = [stat.st_mtime_ns, stat.st_size]
+
+        key_data = {
+            "ci": str(mapper) if mapper else None,
+            "ci_sources": mapper.get_snapshot_sources() if mapper else {},
+            "defaults": defaults,
+            "env_files": env_files,
+            "variables": variables,
+            "version": SETTINGS_SNAPSHOT_VERSION,
+        }
+        serialized_data = json.dumps(key_data, sort_keys=True, default=str)
+        return sha256(serialized_data.encode("utf-8")).hexdigest()
+
+    def write_snapshot(self, path: Optional[Path] = None) -> Path:
+        """
+        Resolve the settings and write them to a file
+
+        All settings except for the ones in ``SECRET_VARIABLES`` are resolved
+        from their sources and written with the key of the sources, so that
+        later jobs of the pipeline can load them with :meth:`load_snapshot`.
+        Values set on the settings, for instance by :meth:`create_kubeconfig`,
+        are not written.
+
+        Args:
+            path: File to write, by default ``settings.json`` in
+                ``BUILD_ARTIFACT_FOLDER``
+
+        Returns:
+            Path to the written file
+        """
+        path = path or self.get_snapshot_path()
+        if not path:
+            raise ValueError("BUILD_ARTIFACT_FOLDER is not set")
+
+        values = {
+            name: self.resolve(name)
+            for name in _VARIABLE_DEFINITIONS
+            if name not in SECRET_VARIABLES
+        }
+        snapshot = {
+            "key": self._get_snapshot_key(),
+            "settings": values,
+            "version": SETTINGS_SNAPSHOT_VERSION,
+        }
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=path.parent, prefix=".settings-", delete=False
+        ) as f:
+            json.dump(snapshot, f, indent=2, sort_keys=True)
+        os.replace(f.name, path)
+
+        for name, value in values.items():
+            self.__dict__.setdefault(name, value)
+        return path
+
+    def load_snapshot(self, path: Optional[Path] = None) -> bool:
+        """
+        Load settings written by :meth:`write_snapshot`
+
+        The settings are only loaded if the snapshot was written by the same
+        snapshot version and its key shows that none of the sources of the
+        settings have changed since. Settings that are already resolved are
+        kept, the secret ones are resolved as usual.
+
+        Args:
+            path: File to read, by default ``settings.json`` in
+                ``BUILD_ARTIFACT_FOLDER``
+
+        Returns:
+            True if the settings were loaded from the snapshot
+        """
+        path = path or self.get_snapshot_path()
+        if not path:
+            return False
+
+        try:
+            snapshot = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return False
+
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("version") != SETTINGS_SNAPSHOT_VERSION
+        ):
+            return False
+
+        values = snapshot.get("settings")
+        expected_names = _VARIABLE_DEFINITIONS.keys() - SECRET_VARIABLES
+        if not isinstance(values, dict) or values.keys() != expected_names:
+            return False
+        if snapshot.get("key") != self._get_snapshot_key():
+            return False
+
+        for name, value in values.items():
+            self.__dict__.setdefault(name, value)
+        return True
 
     def create_kubeconfig(self, track: str) -> Tuple[str, str]:
         """
@@ -454,6 +723,7 @@ class Settings:
 
         if kubeconfig:
             os.environ["KUBECONFIG"] = kubeconfig
+            invalidate_environment()
             return kubeconfig, key
         else:
             possible_keys = ["KUBECONFIG"]
@@ -469,6 +739,7 @@ class Settings:
 
                 # Set `KUBECONFIG` environment variable for subsequent `kubectl` calls.
                 os.environ["KUBECONFIG"] = kubeconfig
+                invalidate_environment()
 
                 return kubeconfig, key
 
@@ -479,6 +750,15 @@ class BaseCI:
     def initialize(self) -> None:
         pass
 
+    def get_snapshot_sources(self) -> Dict[str, Any]:
+        """
+        Get what the computed values of ``MAPPING`` are read from
+
+        Returns:
+            Values that change whenever one of the computed values changes
+        """
+        return {}
+
 
 class AzurePipelinesMapper(BaseCI):
     MAPPING = {
@@ -594,6 +874,19 @@ class GitHubActionsMapper(BaseCI):
     def VALID_FILE_SECRET_PATH_PREFIXES(self) -> List[str]:
         return ["/builds/"]
 
+    def get_snapshot_sources(self) -> Dict[str, Any]:
+        event_data_path = env.str("GITHUB_EVENT_PATH", "")
+        try:
+            stat = os.stat(event_data_path)
+            event_data = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            event_data = None
+        return {
+            "GITHUB_EVENT_PATH": event_data_path,
+            "GITHUB_REPOSITORY": env.str("GITHUB_REPOSITORY", None),
+            "event_data": event_data,
+        }
+
     def _set_event_data_variables(self) -> None:
         """
         Read event data from filesystem
@@ -611,4 +904,26 @@ class GitHubActionsMapper(BaseCI):
             self._EVENT_DATA = None
 
 
+class _LazySetting:
+    """
+    Resolve a setting on first access
+
+    The resolved value is stored on the instance, where it shadows the
+    descriptor on later accesses and can be overridden like any attribute.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance: Optional[Settings], owner: type) -> Any:
+        if instance is None:
+            return self
+        value = instance.resolve(self.name)
+        instance.__dict__[self.name] = value
+        return value
+
+
+for _name in _VARIABLE_DEFINITIONS:
+    setattr(Settings, _name, _LazySetting(_name))
+
 settings = Settings()
@@ -0,0 +1,261 @@
+import functools
+import re
+import shlex
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Match, Optional, Set, Tuple
+
+DIRECTIVE_REGEX = re.compile(r"^#\s*([a-zA-Z][a-zA-Z0-9]*)\s*=\s*(.+?)\s*$")
+VARIABLE_REGEX = re.compile(
+    r"\$(?:{(?P<braced>\w+)(?::(?P<modifier>[-+])(?P<word>[^}]*))?}|(?P<bare>\w+))"
+)
+
+
+@dataclass
+class DockerfileStage:
+    """
+    A single build stage of a Dockerfile
+
+    Args:
+        index: Position of the stage in the Dockerfile, starting from zero
+        name: Name given with ``AS``, empty for unnamed stages
+        base_image: Image or stage the stage is built ``FROM``, global build
+                    arguments substituted with their default values
+        platform: Value of the ``--platform`` flag of ``FROM``
+        args: Build arguments declared in the stage and their default values
+        references: Images or stages referenced by ``COPY --from`` and
+                    ``RUN --mount=from=``
+        depends_on: Names of the stages of the same Dockerfile that this
+                    stage is built from or references
+    """
+
+    index: int
+    name: str
+    base_image: str
+    platform: Optional[str] = None
+    args: Dict[str, Optional[str]] = field(default_factory=dict)
+    references: Set[str] = field(default_factory=set)
+    depends_on: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class Dockerfile:
+    """
+    Parsed representation of a Dockerfile
+
+    Args:
+        stages: Build stages in the order they appear in
+        args: Global build arguments declared before the first ``FROM``
+    """
+
+    stages: List[DockerfileStage] = field(default_factory=list)
+    args: Dict[str, Optional[str]] = field(default_factory=dict)
+
+    @property
+    def stage_names(self) -> List[str]:
+        return [stage.name for stage in self.stages]
+
+    @property
+    def base_images(self) -> Set[str]:
+        """
+        Images that are not stages of the Dockerfile but are built upon
+        """
+        return {
+            stage.base_image
+            for stage in self.stages
+            if self.get_stage(stage.base_image, before=stage.index) is None
+        }
+
+    def get_stage(
+        self, reference: str, before: Optional[int] = None
+    ) -> Optional[DockerfileStage]:
+        """
+        Find a stage by name or index
+
+        Stage names are case-insensitive. Only stages defined before the
+        ``before`` index are considered, as later stages can not be referred to.
+
+        Args:
+            reference: Name or index of the stage
+            before: Index of the referring stage
+
+        Returns:
+            The matched stage or None if the reference is not a stage
+        """
+        stages = self.stages if before is None else self.stages[:before]
+        if reference.isdigit():
+            index = int(reference)
+            return stages[index] if index < len(stages) else None
+        for stage in stages:
+            if stage.name and stage.name.lower() == reference.lower():
+                return stage
+        return None
+
+    @classmethod
+    def parse(cls, content: str) -> "Dockerfile":
+        dockerfile = cls()
+        current_stage: Optional[DockerfileStage] = None
+
+        for instruction, arguments in _get_instructions(content):
+            if instruction == "FROM":
+                current_stage = dockerfile._parse_from(arguments)
+                if current_stage:
+                    dockerfile.stages.append(current_stage)
+            elif instruction == "ARG":
+                args = _parse_args(arguments)
+                if current_stage is None:
+                    dockerfile.args.update(args)
+                else:
+                    current_stage.args.update(args)
+            elif instruction in ("COPY", "RUN") and current_stage is not None:
+                current_stage.references |= _get_flag_references(arguments)
+
+        for stage in dockerfile.stages:
+            for reference in {stage.base_image, *stage.references}:
+                referred_stage = dockerfile.get_stage(reference, before=stage.index)
+                if referred_stage is not None:
+                    stage.depends_on.add(referred_stage.name)
+
+        return dockerfile
+
+    def _parse_from(self, arguments: str) -> Optional[DockerfileStage]:
+        tokens = arguments.split()
+        flags = [token for token in tokens if token.startswith("--")]
+        tokens = [token for token in tokens if not token.startswith("--")]
+        if not tokens:
+            return None
+
+        name = ""
+        if len(tokens) >= 3 and tokens[1].lower() == "as":
+            name = tokens[2]
+
+        platform = None
+        for flag in flags:
+            if flag.startswith("--platform="):
+                platform = flag[len("--platform=") :]
+
+        return DockerfileStage(
+            index=len(self.stages),
+            name=name,
+            base_image=_substitute_args(tokens[0], self.args),
+            platform=platform,
+        )
+
+
+def _get_instructions(content: str) -> List[Tuple[str, str]]:
+    """
+    Split a Dockerfile into instructions
+
+    Comments are dropped and lines continued with the escape character are
+    joined. The escape character can be changed with the ``escape`` parser
+    directive.
+
+    Returns:
+        A list of instructions (in upper case) and their arguments
+    """
+    escape = "\\"
+    lines = content.splitlines()
+
+    # Parser directives are only allowed at the very top of the file
+    for line in lines:
+        directive = DIRECTIVE_REGEX.match(line.strip())
+        if not directive:
+            break
+        if directive.group(1).lower() == "escape":
+            escape = directive.group(2)
+
+    instructions = []
+    logical_line = ""
+    for line in lines:
+        stripped_line = line.strip()
+        if stripped_line.startswith("#"):
+            continue
+        if not stripped_line:
+            continue
+
+        if stripped_line.endswith(escape):
+            logical_line += stripped_line[: -len(escape)] + " "
+            continue
+
+        logical_line += stripped_line
+        instruction, _, arguments = logical_line.strip().partition(" ")
+        if instruction:
+            instructions.append((instruction.upper(), arguments.strip()))
+        logical_line = ""
+
+    if logical_line.strip():
+        instruction, _, arguments = logical_line.strip().partition(" ")
+        instructions.append((instruction.upper(), arguments.strip()))
+
+    return instructions
+
+
+def _parse_args(arguments: str) -> Dict[str, Optional[str]]:
+    """
+    Parse the ``name[=value]`` declarations of an ``ARG`` instruction
+
+    Like BuildKit, one instruction can declare several arguments. Values
+    may be quoted to contain whitespace.
+    """
+    try:
+        tokens = shlex.split(arguments)
+    except ValueError:
+        # Unbalanced quotes
+        tokens = arguments.split()
+
+    args: Dict[str, Optional[str]] = {}
+    for token in tokens:
+        name, equals, default = token.partition("=")
+        args[name] = default if equals else None
+    return args
+
+
+def _get_flag_references(arguments: str) -> Set[str]:
+    references = set()
+    for token in arguments.split():
+        if not token.startswith("--"):
+            break
+        if token.startswith("--from="):
+            references.add(token[len("--from=") :])
+        elif token.startswith("--mount="):
+            for option in token[len("--mount=") :].split(","):
+                key, _, value = option.partition("=")
+                if key == "from" and value:
+                    references.add(value)
+    return references
+
+
+def _substitute_args(value: str, args: Dict[str, Optional[str]]) -> str:
+    def substitute(match: Match[str]) -> str:
+        arg_value = args.get(match.group("braced") or match.group("bare")) or ""
+        if match.group("modifier") == "-":
+            return arg_value or match.group("word")
+        if match.group("modifier") == "+":
+            return match.group("word") if arg_value else ""
+        return arg_value
+
+    return VARIABLE_REGEX.sub(substitute, value)
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_dockerfile(path: str, mtime_ns: int, size: int) -> Dockerfile:
+    with open(path) as f:
+        return Dockerfile.parse(f.read())
+
+
+def load_dockerfile(path: Path) -> Dockerfile:
+    """
+    Load and parse a Dockerfile
+
+    Parsed Dockerfiles are cached for as long as the modification time and
+    size of the file stay the same. The returned object is shared and
+    should not be modified.
+
+    Args:
+        path: Path to the Dockerfile
+
+    Returns:
+        The parsed Dockerfile
+    """
+    stat = path.stat()
+    return _parse_dockerfile(str(path.absolute()), stat.st_mtime_ns, stat.st_size)
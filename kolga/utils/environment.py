@@ -0,0 +1,90 @@
+import os
+from bisect import bisect_left
+from threading import Lock
+from types import MappingProxyType
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+
+class EnvironmentSnapshot(Mapping[str, str]):
+    """
+    Immutable copy of environment variables indexed by name
+
+    The names are kept sorted so that the variables sharing a prefix are
+    found with a binary search followed by a scan of the matching names
+    only, i.e. in O(log n + k) time instead of going through every variable.
+
+    Args:
+        variables: Variables to take the snapshot of, ``os.environ`` if not set
+    """
+
+    def __init__(self, variables: Optional[Mapping[str, str]] = None) -> None:
+        if variables is None:
+            variables = os.environ
+        self._variables: Mapping[str, str] = MappingProxyType(dict(variables))
+        self._names: Tuple[str, ...] = tuple(sorted(self._variables))
+
+    def __getitem__(self, name: str) -> str:
+        return self._variables[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get_prefixed(self, prefix: str) -> Dict[str, str]:
+        """
+        Get all variables with a prefix
+
+        Args:
+            prefix: Prefix of the variable names
+
+        Returns:
+            The variables whose name starts with the prefix, prefix included
+        """
+        items = {}
+        for index in range(bisect_left(self._names, prefix), len(self._names)):
+            name = self._names[index]
+            if not name.startswith(prefix):
+                break
+            items[name] = self._variables[name]
+        return items
+
+
+_snapshot: Optional[EnvironmentSnapshot] = None
+_snapshot_lock = Lock()
+
+
+def get_environment() -> EnvironmentSnapshot:
+    """
+    Get a snapshot of the environment variables of the process
+
+    The snapshot is taken on the first call and reused until
+    :func:`invalidate_environment` is called. Changes made to ``os.environ``
+    in between are not seen.
+
+    Returns:
+        Snapshot of the environment variables
+    """
+    global _snapshot
+
+    snapshot = _snapshot
+    if snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = EnvironmentSnapshot()
+            snapshot = _snapshot
+    return snapshot
+
+
+def invalidate_environment() -> None:
+    """
+    Drop the environment snapshot
+
+    Has to be called after ``os.environ`` is changed for the change to be
+    seen by :func:`get_environment`.
+    """
+    global _snapshot
+
+    with _snapshot_lock:
+        _snapshot = None
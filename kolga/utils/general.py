@@ -1,18 +1,48 @@
+import asyncio
 import json
 import os
 import re
+import signal
 import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    CancelledError,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
 from datetime import datetime, timezone
 from functools import reduce
 from hashlib import sha256
+from io import StringIO
 from pathlib import Path
 from shlex import quote
-from typing import Any, Dict, List, Mapping, Optional, Union
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    TypeVar,
+    Union,
+)
 
 import environs
 
+from kolga.utils.environment import get_environment
+from kolga.utils.logger import logger
 from kolga.utils.models import SubprocessResult
 
+T = TypeVar("T")
+
 env = environs.Env()
 
 AMQP = "amqp"
@@ -33,6 +63,10 @@ DEPLOY_NAME_MAX_HELM_NAME_LENGTH = 53
 DEPLOY_NAME_MAX_TRACK_LENGTH = 10
 URL_MAX_LENGTH = 63
 
+ABORT_POLL_INTERVAL = 1
+OUTPUT_MAX_LINES = 1000
+TERMINATE_GRACE_PERIOD = 10
+
 
 def get_project_secret_var(project_name: str, value: str = "") -> str:
     from kolga.settings import settings
@@ -165,7 +199,9 @@ def get_environment_vars_by_prefix(prefix: str) -> Dict[str, str]:
     Extract all environment variables with a prefix
 
     Environment variables strting with the `prefix` attribute are
-    extracted and put into a dict with the `prefix` removed.
+    extracted and put into a dict with the `prefix` removed. The variables
+    are read from the environment snapshot, see
+    :func:`kolga.utils.environment.get_environment`.
 
     Args:
         prefix: Prefix to environment key that should be extracted
@@ -174,35 +210,399 @@ def get_environment_vars_by_prefix(prefix: str) -> Dict[str, str]:
         A dict of keys stripped of the prefix and the value as given
         in the environment variable.
     """
-    env_vars = dict(os.environ)
+    env_vars = get_environment().get_prefixed(prefix)
 
     # Remove the setting with name "K8S_SECRET_PREFIX" as the default
     # value for that is K8S_SECRET_ which will in turn add an entry
     # with the key "PREFIX"
     # TODO: Rename K8S_SECRET_PREFIX to something that does not clash
-    if "K8S_SECRET_PREFIX" in env_vars:
-        del env_vars["K8S_SECRET_PREFIX"]
-    if "K8S_FILE_SECRET_PREFIX" in env_vars:
-        del env_vars["K8S_FILE_SECRET_PREFIX"]
+    env_vars.pop("K8S_SECRET_PREFIX", None)
+    env_vars.pop("K8S_FILE_SECRET_PREFIX", None)
     return get_and_strip_prefixed_items(env_vars, prefix)
 
 
-def run_os_command(command_list: List[str], shell: bool = False) -> SubprocessResult:
+def run_os_command(
+    command_list: List[str],
+    shell: bool = False,
+    abort: Optional[threading.Event] = None,
+) -> SubprocessResult:
+    """
+    Run a command and capture its output
+
+    Args:
+        command_list: Command and its arguments
+        shell: Run the command through the shell
+        abort: If given, the command is terminated once the event is set
 
+    Returns:
+        The output and return code of the command
+    """
     command = command_list if not shell else " ".join(map(quote, command_list))
 
-    result = subprocess.run(  # nosec
-        command, encoding="UTF-8", capture_output=True, shell=shell
+    if abort is None:
+        result = subprocess.run(  # nosec
+            command, encoding="UTF-8", capture_output=True, shell=shell
+        )
+
+        return SubprocessResult(
+            out=result.stdout,
+            err=result.stderr,
+            return_code=result.returncode,
+            child=result,
+        )
+
+    return stream_os_command(command_list, shell=shell, abort=abort, max_lines=None)
+
+
+async def run_os_command_async(
+    command_list: List[str], shell: bool = False
+) -> SubprocessResult:
+    """
+    Run a command and capture its output without blocking the event loop
+
+    If the awaiting task is cancelled, the command is killed.
+
+    Args:
+        command_list: Command and its arguments
+        shell: Run the command through the shell
+
+    Returns:
+        The output and return code of the command
+    """
+    if shell:
+        child = await asyncio.create_subprocess_shell(  # nosec
+            " ".join(map(quote, command_list)),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    else:
+        child = await asyncio.create_subprocess_exec(
+            *command_list,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+    try:
+        out, err = await child.communicate()
+    except asyncio.CancelledError:
+        if child.returncode is None:
+            child.kill()
+            await child.wait()
+        raise
+
+    return SubprocessResult(
+        out=out.decode("UTF-8", errors="replace"),
+        err=err.decode("UTF-8", errors="replace"),
+        return_code=child.returncode if child.returncode is not None else -1,
+        child=child,
     )
 
+
+async def run_in_thread(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking function in a worker thread of the event loop
+
+    Output logged by the function is kept together and printed once the
+    function returns, so that it does not interleave with other output.
+
+    Args:
+        func: The function to run
+        *args: Positional arguments of the function
+        **kwargs: Keyword arguments of the function
+
+    Returns:
+        The return value of the function
+    """
+
+    def run_grouped() -> T:
+        with logger.grouped():
+            return func(*args, **kwargs)
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, run_grouped)
+
+
+def stream_os_command(
+    command_list: List[str],
+    shell: bool = False,
+    on_stdout: Optional[Callable[[str], None]] = None,
+    on_stderr: Optional[Callable[[str], None]] = None,
+    timeout: Optional[float] = None,
+    abort: Optional[threading.Event] = None,
+    max_lines: Optional[int] = OUTPUT_MAX_LINES,
+) -> SubprocessResult:
+    """
+    Run a command and process its output line by line while it runs
+
+    Both output streams are read in threads of their own, so a command
+    writing a lot to one of them does not block. Only the last ``max_lines``
+    lines of each stream are kept in the result. Callbacks log into the
+    output group of the calling thread. A callback that raises an exception
+    is logged and not called again, the output is still read.
+
+    The command runs in a process group of its own. When it times out or is
+    aborted, the whole group is terminated, and killed if it does not exit
+    within ``TERMINATE_GRACE_PERIOD`` seconds.
+
+    Args:
+        command_list: Command and its arguments
+        shell: Run the command through the shell
+        on_stdout: Called with every line written to stdout
+        on_stderr: Called with every line written to stderr
+        timeout: Seconds after which the command is terminated
+        abort: If given, the command is terminated once the event is set
+        max_lines: Lines kept of each stream, None for all of them
+
+    Returns:
+        The output and return code of the command
+    """
+    command = command_list if not shell else " ".join(map(quote, command_list))
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    with subprocess.Popen(  # nosec
+        command,
+        encoding="UTF-8",
+        errors="replace",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        shell=shell,
+        start_new_session=True,
+    ) as child:
+        group = logger.current_group()
+        readers = [
+            _OutputReader(child.stdout, on_stdout, max_lines, group),
+            _OutputReader(child.stderr, on_stderr, max_lines, group),
+        ]
+        timed_out = False
+        try:
+            while True:
+                try:
+                    child.wait(timeout=ABORT_POLL_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    timed_out = deadline is not None and time.monotonic() > deadline
+                    if timed_out or (abort is not None and abort.is_set()):
+                        _terminate_process_group(child)
+                        break
+        finally:
+            # Do not leave the command behind, for instance on KeyboardInterrupt
+            if child.poll() is None:
+                _terminate_process_group(child)
+            for reader in readers:
+                reader.join()
+
+    stdout, stderr = readers
     return SubprocessResult(
-        out=result.stdout,
-        err=result.stderr,
-        return_code=result.returncode,
-        child=result,
+        out=stdout.output(),
+        err=stderr.output(),
+        return_code=child.returncode,
+        child=child,
+        omitted_lines=stdout.omitted_lines + stderr.omitted_lines,
+        timed_out=timed_out,
     )
 
 
+class _OutputReader(threading.Thread):
+    def __init__(
+        self,
+        stream: Optional[IO[str]],
+        callback: Optional[Callable[[str], None]],
+        max_lines: Optional[int],
+        group: Optional[StringIO] = None,
+    ) -> None:
+        super().__init__(daemon=True)
+        self._stream = stream
+        self._callback = callback
+        self._group = group
+        self._lines: Deque[str] = deque(maxlen=max_lines)
+        self.omitted_lines = 0
+        self.start()
+
+    def run(self) -> None:
+        if self._stream is None:
+            return
+        with logger.joined_group(self._group):
+            self._read(self._stream)
+
+    def _read(self, stream: IO[str]) -> None:
+        for line in stream:
+            if len(self._lines) == self._lines.maxlen:
+                self.omitted_lines += 1
+            self._lines.append(line)
+            if self._callback:
+                try:
+                    self._callback(line.rstrip("\n"))
+                except Exception as e:
+                    # Keep draining the pipe, a full pipe would block the
+                    # command. The callback is not called again.
+                    self._callback = None
+                    logger.error(
+                        message="Processing command output failed: ",
+                        error=e,
+                        raise_exception=False,
+                    )
+
+    def output(self) -> str:
+        return "".join(self._lines)
+
+
+def _terminate_process_group(child: "subprocess.Popen[str]") -> None:
+    try:
+        os.killpg(child.pid, signal.SIGTERM)
+        try:
+            child.wait(timeout=TERMINATE_GRACE_PERIOD)
+        except subprocess.TimeoutExpired:
+            os.killpg(child.pid, signal.SIGKILL)
+            child.wait()
+    except ProcessLookupError:
+        # The group has already exited
+        pass
+
+
+def run_concurrently(
+    tasks: Mapping[str, Callable[[], T]],
+    max_workers: int = 1,
+    dependencies: Optional[Mapping[str, Iterable[str]]] = None,
+) -> Dict[str, T]:
+    """
+    Run a set of tasks using a bounded pool of worker threads
+
+    The output each task logs is grouped and printed once the task has
+    finished so that output from different tasks does not get mixed up.
+    With ``max_workers`` of one or less the tasks are run one after
+    another in the calling thread, printing output as it is logged.
+
+    A task with ``dependencies`` is started once all of the tasks it
+    depends on have finished, so the tasks are run in the order of a
+    directed acyclic graph with independent tasks run concurrently.
+
+    The first failing task stops all tasks that have not yet been started.
+    Tasks that are already running are allowed to finish, after which every
+    failure is reported and the first exception is re-raised.
+
+    Args:
+        tasks: Mapping of task names to callables taking no arguments
+        max_workers: Maximum number of tasks to run at the same time
+        dependencies: Mapping of task names to the names of the tasks they depend on
+
+    Returns:
+        A dict of task names and the values returned by the tasks
+
+    Raises:
+        ValueError: The dependencies refer to unknown tasks or form a cycle
+    """
+    depends_on = {name: set((dependencies or {}).get(name, ())) for name in tasks}
+    order = get_dependency_order(depends_on)
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        return {name: tasks[name]() for name in order}
+
+    failures: List[BaseException] = []
+    failed = threading.Event()
+
+    def run_task(task: Callable[[], T]) -> T:
+        # Workers pick up queued tasks as soon as they are free, so check
+        # for earlier failures before starting instead of relying on cancel
+        if failed.is_set():
+            raise CancelledError()
+        try:
+            with logger.grouped():
+                return task()
+        except BaseException as e:
+            failures.append(e)
+            failed.set()
+            raise
+
+    results: Dict[str, T] = {}
+    futures: Dict["Future[T]", str] = {}
+    finished: Set[str] = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def submit_ready() -> Set["Future[T]"]:
+            submitted = set(futures.values())
+            ready = [
+                name
+                for name in order
+                if name not in submitted and depends_on[name] <= finished
+            ]
+            for name in ready:
+                futures[executor.submit(run_task, tasks[name])] = name
+            return {future for future, name in futures.items() if name in ready}
+
+        running = submit_ready()
+        while running and not failed.is_set():
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            finished.update(
+                futures[future] for future in done if not future.exception()
+            )
+            if not failed.is_set():
+                running |= submit_ready()
+
+        for future in running:
+            future.cancel()
+        # Wait for the tasks that were already running to finish
+        wait(futures)
+
+    submitted = {name: future for future, name in futures.items()}
+    for name in order:
+        task_future = submitted.get(name)
+        if (
+            not task_future
+            or task_future.cancelled()
+            or isinstance(task_future.exception(), CancelledError)
+        ):
+            logger.warning(message=f"Task '{name}' was cancelled")
+        elif task_future.exception():
+            logger.error(
+                message=f"Task '{name}' failed: ",
+                error=task_future.exception(),  # type: ignore
+                raise_exception=False,
+            )
+        else:
+            results[name] = task_future.result()
+
+    if failures:
+        raise failures[0]
+
+    return results
+
+
+def get_dependency_order(dependencies: Mapping[str, Set[str]]) -> List[str]:
+    """
+    Sort names so that every name comes after the names it depends on
+
+    Names without an order between them keep the order of ``dependencies``.
+
+    Args:
+        dependencies: Mapping of names to the names they depend on
+
+    Returns:
+        The names in dependency order
+
+    Raises:
+        ValueError: The dependencies refer to unknown names or form a cycle
+    """
+    for name, names in dependencies.items():
+        unknown = names - dependencies.keys()
+        if unknown:
+            raise ValueError(
+                f"'{name}' depends on unknown {', '.join(sorted(unknown))}"
+            )
+
+    order: List[str] = []
+    while len(order) < len(dependencies):
+        ready = [
+            name
+            for name, names in dependencies.items()
+            if name not in order and names <= set(order)
+        ]
+        if not ready:
+            cycle = sorted(name for name in dependencies if name not in order)
+            raise ValueError(f"Dependency cycle between {', '.join(cycle)}")
+        order += ready
+    return order
+
+
 def limit_url_length(url: str) -> str:
     """
     Ensure that url is not longer than URL_MAX_LENGTH
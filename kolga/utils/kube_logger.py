@@ -1,82 +1,158 @@
-from pathlib import Path
-from subprocess import Popen, TimeoutExpired
-from tempfile import NamedTemporaryFile
-from threading import Event, Thread
-from typing import IO, Dict, Optional, Tuple
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from kubernetes import client as k8s_client
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from urllib3.exceptions import HTTPError
+
+_ContainerKey = Tuple[str, str, int]
 
 
 class KubeLoggerThread(Thread):
-    _cmd: Tuple[str, ...]
-    _log: IO[bytes]
+    """
+    Collect the logs of all pods matching a set of labels
+
+    New pods are picked up from a watch on the pods of the namespace and
+    the logs of every container are streamed from the Kubernetes API in
+    threads of their own. Only the last ``max_lines`` lines of each
+    container are kept in memory.
+    """
+
+    _followed: Set[_ContainerKey]
+    _buffers: Dict[str, Deque[str]]
+    _responses: List[Any]
     _stop_event: Event
-    log_path: Path
-    keep_logs: bool
 
     TIMEOUT = 5
+    MAX_LINES = 1000
 
     def __init__(
         self,
+        client: k8s_client.ApiClient,
         namespace: str,
         labels: Optional[Dict[str, str]] = None,
-        keep_logs: bool = False,
+        max_lines: int = MAX_LINES,
     ):
-        super().__init__()
-
-        self._cmd = (
-            "kubectl",
-            "logs",
-            "--all-containers=true",
-            "--follow=true",
-            "--ignore-errors=true",
-            f"--namespace={namespace}",
-            "--prefix",
-            "--timestamps=true",
-            "--selector",
-            ",".join(f"{k}={v}" for k, v in (labels if labels else {}).items()),
+        super().__init__(daemon=True)
+
+        self._v1 = k8s_client.CoreV1Api(client)
+        self._namespace = namespace
+        self._label_selector = ",".join(
+            f"{k}={v}" for k, v in (labels if labels else {}).items()
         )
-        self._log = NamedTemporaryFile(delete=False, mode="wb")
+        self._lock = Lock()
+        self._followed = set()
+        self._buffers = {}
+        self._responses = []
         self._stop_event = Event()
-        self.keep_logs = keep_logs
-        self.log_path = Path(self._log.name)
-
-    def __del__(self) -> None:
-        if not self.keep_logs:
-            # Don't leave garbage lying around.
-            self.log_path.unlink()
+        self.max_lines = max_lines
 
     def run(self) -> None:
-        running = True
-        subprocess = None
-
-        while running:
-            if subprocess:
-                try:
-                    # TODO: Check return value
-                    _ = subprocess.wait(0)
-                except TimeoutExpired:
-                    # Still running. Good.
-                    pass
-                else:
-                    # Child dead.
-                    subprocess = None
-
-            if subprocess is None:
-                # (Re-)start the subprocess
-                subprocess = Popen(self._cmd, shell=False, stdout=self._log)  # nosec
-
-            # Wait on stop event
-            running = not self._stop_event.wait(self.TIMEOUT)
-
-        if subprocess:
-            subprocess.kill()
-            subprocess.wait()
+        while not self._stop_event.is_set():
+            pod_watch = watch.Watch()
+            try:
+                for event in pod_watch.stream(
+                    self._v1.list_namespaced_pod,
+                    namespace=self._namespace,
+                    label_selector=self._label_selector,
+                    timeout_seconds=self.TIMEOUT,
+                ):
+                    if self._stop_event.is_set():
+                        pod_watch.stop()
+                        break
+                    self._follow_pod(event["object"])
+            except (ApiException, HTTPError):
+                # Logs are best effort, try again after a while
+                self._stop_event.wait(self.TIMEOUT)
+
+    def _follow_pod(self, pod: k8s_client.V1Pod) -> None:
+        if not pod.status:
+            return
+
+        statuses = (pod.status.init_container_statuses or []) + (
+            pod.status.container_statuses or []
+        )
+        for status in statuses:
+            # Logs are available once a container has been started
+            if not status.state or not (
+                status.state.running or status.state.terminated
+            ):
+                continue
+
+            key = (pod.metadata.name, status.name, status.restart_count or 0)
+            with self._lock:
+                if key in self._followed or self._stop_event.is_set():
+                    continue
+                self._followed.add(key)
+
+            Thread(target=self._stream_logs, args=(key,), daemon=True).start()
+
+    def _stream_logs(self, key: _ContainerKey) -> None:
+        pod_name, container, _ = key
+        buffer = self._get_buffer(f"{pod_name}/{container}")
+        prefix = f"[pod/{pod_name}/{container}]"
+
+        try:
+            response = self._v1.read_namespaced_pod_log(
+                name=pod_name,
+                namespace=self._namespace,
+                container=container,
+                follow=True,
+                timestamps=True,
+                _preload_content=False,
+            )
+        except (ApiException, HTTPError):
+            # Try again on the next event of the pod
+            with self._lock:
+                self._followed.discard(key)
+            return
+
+        with self._lock:
+            # stop() may already have closed the responses it knew about
+            stopped = self._stop_event.is_set()
+            if not stopped:
+                self._responses.append(response)
+        if stopped:
+            response.close()
+            response.release_conn()
+            return
+
+        try:
+            for line in response:
+                buffer.append(f"{prefix} {line.decode('UTF-8', errors='replace')}")
+        except (HTTPError, OSError, ValueError):
+            # The connection is closed when the collector is stopped
+            pass
+        finally:
+            response.release_conn()
+
+    def _get_buffer(self, name: str) -> Deque[str]:
+        with self._lock:
+            return self._buffers.setdefault(name, deque(maxlen=self.max_lines))
+
+    def lines(self) -> List[str]:
+        """
+        Get the collected log lines
+
+        Returns:
+            The last ``max_lines`` lines of each container, grouped by container
+        """
+        with self._lock:
+            buffers = list(self._buffers.values())
+        return [line for buffer in buffers for line in list(buffer)]
 
     def stop(self) -> None:
-        # Signal the poller thread
+        # Signal the watcher thread
         self._stop_event.set()
 
-        # Wait for the thread
-        self.join()
+        # Unblock the log streams
+        with self._lock:
+            responses = list(self._responses)
+        for response in responses:
+            response.close()
 
-        # Close the log fd
-        self._log.close()
+        # Wait for the watcher, it returns at the latest when the watch times out
+        if self.is_alive():
+            self.join(self.TIMEOUT + 1)
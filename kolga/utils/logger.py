@@ -1,4 +1,8 @@
-from typing import Optional
+import sys
+import threading
+from contextlib import contextmanager
+from io import StringIO
+from typing import Iterator, Optional
 
 import colorful as cf
 
@@ -10,6 +14,64 @@ class Logger:
     Class for logging of events in the DevOps pipeline
     """
 
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._output_lock = threading.Lock()
+
+    def _print(self, message: str, end: str = "\n") -> None:
+        buffer: Optional[StringIO] = getattr(self._local, "buffer", None)
+        if buffer is not None:
+            buffer.write(f"{message}{end}")
+        else:
+            print(message, end=end, flush=True)  # noqa: T001
+
+    @contextmanager
+    def grouped(self) -> Iterator[None]:
+        """
+        Group all output of the current thread and print it in one go
+
+        Output logged inside the context is buffered and only written to
+        stdout once the context exits. This keeps the output of tasks
+        running in parallel threads from being interleaved.
+        """
+        if getattr(self._local, "buffer", None) is not None:
+            # Already grouped by an outer context
+            yield
+            return
+
+        self._local.buffer = StringIO()
+        try:
+            yield
+        finally:
+            output = self._local.buffer.getvalue()
+            self._local.buffer = None
+            with self._output_lock:
+                sys.stdout.write(output)
+                sys.stdout.flush()
+
+    def current_group(self) -> Optional[StringIO]:
+        """
+        Get the output group of the current thread, if any
+        """
+        return getattr(self._local, "buffer", None)
+
+    @contextmanager
+    def joined_group(self, group: Optional[StringIO]) -> Iterator[None]:
+        """
+        Add output of the current thread to the output group of another thread
+
+        Helper threads use this to keep their output together with the output
+        of the thread that started them. The group is printed by its owner.
+
+        Args:
+            group: Output group from :func:`~Logger.current_group`
+        """
+        self._local.buffer = group
+        try:
+            yield
+        finally:
+            self._local.buffer = None
+
     def _create_message(self, message: str, icon: Optional[str] = None) -> str:
         icon_string = f"{icon} " if icon else ""
         return f"{icon_string}{message}"
@@ -36,7 +98,7 @@ class Logger:
         if error and not raise_exception:
             _message += f"{error}"
 
-        print(f"{cf.red}{_message}{cf.reset}")  # noqa: T001
+        self._print(f"{cf.red}{_message}{cf.reset}")
         if raise_exception:
             error = error or Exception(message_string)
             raise error
@@ -50,7 +112,7 @@ class Logger:
             icon: Icon to place as before the output
         """
         _message = self._create_message(message, icon)
-        print(f"{cf.yellow}{_message}{cf.reset}")  # noqa: T001
+        self._print(f"{cf.yellow}{_message}{cf.reset}")
 
     def success(self, message: str = "", icon: Optional[str] = None) -> None:
         """
@@ -62,7 +124,7 @@ class Logger:
         """
         message_string = message if message else "Done"
         _message = self._create_message(message_string, icon)
-        print(f"{cf.green}{_message}{cf.reset}")  # noqa: T001
+        self._print(f"{cf.green}{_message}{cf.reset}")
 
     def info(
         self,
@@ -84,7 +146,7 @@ class Logger:
             f"{cf.bold}{title}{cf.reset}{message}" if title else f"{message}"
         )
         _message = self._create_message(message_string, icon)
-        print(f"{_message}", end=end, flush=True)  # noqa: T001
+        self._print(f"{_message}", end=end)
 
     def std(
         self,
@@ -103,11 +165,17 @@ class Logger:
         if log_error:
             logger.error(message=std.err, raise_exception=False)
         output_string = f"\n{cf.green}stdout:\n{cf.reset}{std.out}\n{cf.red}stderr:\n{cf.reset}{std.err}"
+        if std.omitted_lines:
+            output_string = (
+                f"\n({std.omitted_lines} earlier lines omitted){output_string}"
+            )
+        if std.timed_out:
+            output_string = f"\nThe command timed out{output_string}"
 
         if raise_exception:
             raise Exception(output_string)
         else:
-            print(output_string)  # noqa: T001
+            self._print(output_string)
 
 
 logger = Logger()
@@ -1,6 +1,7 @@
 import re
 from dataclasses import dataclass, field
-from typing import Any, List, Optional, TypedDict
+from datetime import datetime
+from typing import Any, List, Optional, Set, TypedDict
 
 
 @dataclass
@@ -9,6 +10,8 @@ class ImageStage:
     final: bool = False
     build: bool = False
     development: bool = False
+    base_image: str = ""
+    depends_on: Set[str] = field(default_factory=set)
 
 
 @dataclass
@@ -53,6 +56,8 @@ class SubprocessResult:
     err: str
     return_code: int
     child: Any
+    omitted_lines: int = 0
+    timed_out: bool = False
 
 
 @dataclass
@@ -77,3 +82,11 @@ class BasicAuthUser:
     def from_colon_string(cls, colon_string: str) -> "BasicAuthUser":
         username, password = colon_string.split(":")
         return cls(username=username, password=password)
+
+
+@dataclass
+class EnvironmentActivity:
+    namespace: str
+    project_id: str
+    last_activity: datetime
+    terminating: bool = False
@@ -0,0 +1,181 @@
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from kubernetes import client as k8s_client
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from urllib3.exceptions import HTTPError
+
+from kolga.utils.logger import logger
+
+# Container waiting reasons that do not resolve without a new deployment
+TERMINAL_WAITING_REASONS = {
+    "CreateContainerConfigError",
+    "CreateContainerError",
+    "ErrImageNeverPull",
+    "ImagePullBackOff",
+    "InvalidImageName",
+}
+
+# Event reasons that do not resolve without a new deployment
+TERMINAL_EVENT_REASONS = {
+    "FailedCreate",
+}
+
+
+class RolloutWatcher:
+    """
+    Watch the rollout of a release and abort it on terminal failures
+
+    Pods, ReplicaSets and Events of the release are followed with watch
+    streams. Readiness of the ReplicaSets is reported as it changes. When
+    the rollout can not succeed any more, for instance because of an image
+    that can not be pulled or a container that keeps crashing, the reason
+    is stored in ``failure`` and the ``abort`` event is set.
+    """
+
+    failure: Optional[str]
+
+    ICON = "🚦"
+    TIMEOUT = 5
+    MAX_RESTARTS = 3
+
+    def __init__(
+        self,
+        client: k8s_client.ApiClient,
+        namespace: str,
+        labels: Optional[Dict[str, str]] = None,
+        abort: Optional[Event] = None,
+        max_restarts: int = MAX_RESTARTS,
+    ):
+        self._core_v1 = k8s_client.CoreV1Api(client)
+        self._apps_v1 = k8s_client.AppsV1Api(client)
+        self._namespace = namespace
+        self._label_selector = ",".join(
+            f"{k}={v}" for k, v in (labels if labels else {}).items()
+        )
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._threads: List[Thread] = []
+        self._objects: Set[Tuple[str, str]] = set()
+        self._seen_events: Set[str] = set()
+        self._progress: Dict[str, Tuple[int, int]] = {}
+        self.abort = abort or Event()
+        self.max_restarts = max_restarts
+        self.failure = None
+
+    def start(self) -> None:
+        watches: List[Tuple[Callable[..., Any], Callable[[Any], None], bool]] = [
+            (self._core_v1.list_namespaced_pod, self._handle_pod, True),
+            (self._apps_v1.list_namespaced_replica_set, self._handle_replica_set, True),
+            (self._core_v1.list_namespaced_event, self._handle_event, False),
+        ]
+        # Keep progress reports together with the output of the deployment
+        group = logger.current_group()
+        for list_func, handler, use_labels in watches:
+            thread = Thread(
+                target=self._watch,
+                args=(list_func, handler, use_labels, group),
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(self.TIMEOUT + 1)
+
+    def _watch(
+        self,
+        list_func: Callable[..., Any],
+        handler: Callable[[Any], None],
+        use_labels: bool,
+        group: Any,
+    ) -> None:
+        kwargs = {"label_selector": self._label_selector} if use_labels else {}
+        with logger.joined_group(group):
+            while not self._stop_event.is_set():
+                stream = watch.Watch()
+                try:
+                    for event in stream.stream(
+                        list_func,
+                        namespace=self._namespace,
+                        timeout_seconds=self.TIMEOUT,
+                        **kwargs,
+                    ):
+                        if self._stop_event.is_set():
+                            stream.stop()
+                            break
+                        handler(event["object"])
+                except (ApiException, HTTPError):
+                    # Watching is best effort, try again after a while
+                    self._stop_event.wait(self.TIMEOUT)
+
+    def _fail(self, reason: str) -> None:
+        with self._lock:
+            if self.failure:
+                return
+            self.failure = reason
+
+        logger.error(
+            icon=f"{self.ICON} ❌",
+            message=f"\t{reason}, aborting the deployment",
+            raise_exception=False,
+        )
+        self.abort.set()
+
+    def _handle_pod(self, pod: k8s_client.V1Pod) -> None:
+        pod_name = pod.metadata.name
+        with self._lock:
+            self._objects.add(("Pod", pod_name))
+
+        if not pod.status:
+            return
+
+        statuses = (pod.status.init_container_statuses or []) + (
+            pod.status.container_statuses or []
+        )
+        for status in statuses:
+            waiting = status.state.waiting if status.state else None
+            if not waiting:
+                continue
+
+            if waiting.reason in TERMINAL_WAITING_REASONS or (
+                waiting.reason == "CrashLoopBackOff"
+                and (status.restart_count or 0) >= self.max_restarts
+            ):
+                message = f" ({waiting.message})" if waiting.message else ""
+                self._fail(
+                    f"Container '{status.name}' of pod '{pod_name}' is in "
+                    f"{waiting.reason}{message}"
+                )
+
+    def _handle_replica_set(self, replica_set: k8s_client.V1ReplicaSet) -> None:
+        name = replica_set.metadata.name
+        desired = (replica_set.spec.replicas or 0) if replica_set.spec else 0
+        ready = (replica_set.status.ready_replicas or 0) if replica_set.status else 0
+
+        with self._lock:
+            self._objects.add(("ReplicaSet", name))
+            if self._progress.get(name) == (ready, desired):
+                return
+            self._progress[name] = (ready, desired)
+
+        logger.info(icon=f"{self.ICON} ⏳", message=f"\t{name}: {ready}/{desired} ready")
+
+    def _handle_event(self, event: k8s_client.V1Event) -> None:
+        involved = event.involved_object
+        key = (involved.kind, involved.name) if involved else None
+        with self._lock:
+            if key not in self._objects or event.metadata.uid in self._seen_events:
+                return
+            self._seen_events.add(event.metadata.uid)
+
+        if event.reason in TERMINAL_EVENT_REASONS:
+            self._fail(f"{involved.kind} '{involved.name}': {event.message}")
+        elif event.type == "Warning":
+            logger.warning(
+                icon=f"{self.ICON} ⚠️ ",
+                message=f"\t{involved.kind} '{involved.name}': {event.message}",
+            )
@@ -0,0 +1,136 @@
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+import pytest
+
+from kolga.settings import _VARIABLE_DEFINITIONS, Settings
+from kolga.utils.environment import EnvironmentSnapshot
+from kolga.utils.general import get_and_strip_prefixed_items
+
+VARIABLE_COUNT = 10_000
+PREFIXES = [f"PROJECT_{i}_K8S_SECRET_" for i in range(0, 1000, 20)]
+
+
+def _synthetic_environment() -> Dict[str, str]:
+    variables = {f"CI_VARIABLE_{i}": str(i) for i in range(VARIABLE_COUNT // 2)}
+    for i in range(VARIABLE_COUNT // 2):
+        variables[f"PROJECT_{i % 1000}_K8S_SECRET_{i}"] = str(i)
+    return variables
+
+
+def _best_of(function: Callable[[], object], rounds: int = 3) -> float:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@pytest.mark.benchmark
+def test_environment_prefix_lookup() -> None:
+    variables = _synthetic_environment()
+    assert len(variables) == VARIABLE_COUNT
+
+    def scan() -> List[Dict[str, str]]:
+        # The variables were copied and scanned on every lookup before
+        return [
+            get_and_strip_prefixed_items(dict(variables), prefix) for prefix in PREFIXES
+        ]
+
+    def snapshot() -> List[Dict[str, str]]:
+        environment = EnvironmentSnapshot(variables)
+        return [
+            get_and_strip_prefixed_items(environment.get_prefixed(prefix), prefix)
+            for prefix in PREFIXES
+        ]
+
+    assert scan() == snapshot()
+
+    scan_time = _best_of(scan)
+    snapshot_time = _best_of(snapshot)
+    print(
+        f"\n{len(PREFIXES)} prefix lookups in {VARIABLE_COUNT} variables: "
+        f"scan {scan_time * 1000:.1f} ms, "
+        f"snapshot {snapshot_time * 1000:.1f} ms (including building it)"
+    )
+
+
+@pytest.mark.benchmark
+def test_settings_startup() -> None:
+    def lazy() -> None:
+        # What a command reading a single setting pays
+        Settings().DEFAULT_TRACK
+
+    def eager() -> None:
+        # Every setting was resolved when the settings were created before
+        settings = Settings()
+        for name in _VARIABLE_DEFINITIONS:
+            getattr(settings, name)
+
+    lazy_time = _best_of(lazy, rounds=10)
+    eager_time = _best_of(eager, rounds=10)
+
+    # Import the settings in a fresh interpreter to see the import cost
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "from kolga.settings import settings; print(len(vars(settings)))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    match = re.search(r"(\d+) \|\s+(\d+) \| kolga.settings$", result.stderr, re.M)
+    assert match
+    print(
+        f"\nSettings startup: {lazy_time * 1000:.2f} ms for one setting, "
+        f"{eager_time * 1000:.2f} ms for all {len(_VARIABLE_DEFINITIONS)}; "
+        f"kolga.settings import {int(match.group(1)) / 1000:.1f} ms self, "
+        f"{int(match.group(2)) / 1000:.1f} ms cumulative"
+    )
+    # Importing does not resolve any setting
+    assert int(result.stdout) < len(_VARIABLE_DEFINITIONS)
+
+
+@pytest.mark.benchmark
+def test_plugin_startup() -> None:
+    environment = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith(("SENTRY_", "SLACK_"))
+    }
+    script = (
+        "import sys\n"
+        "from kolga.settings import settings\n"
+        "settings.load_plugins()\n"
+        "print(sorted({m.split('.')[0] for m in sys.modules} & {'sentry_sdk', 'slack_sdk'}))"
+    )
+
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            capture_output=True,
+            check=True,
+            env=environment,
+            text=True,
+        )
+        timings.append(time.perf_counter() - start)
+
+    match = re.search(r"\| +(\d+) \| +kolga.plugins$", result.stderr, re.M)
+    assert match
+    print(
+        f"\nStartup without configured plugins: {min(timings) * 1000:.0f} ms, "
+        f"kolga.plugins import {int(match.group(1)) / 1000:.1f} ms cumulative"
+    )
+    # The SDKs of plugins that are not configured are never imported
+    assert result.stdout.strip() == "[]"
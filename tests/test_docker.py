@@ -1,11 +1,17 @@
 import tempfile
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Set
+from unittest import mock
+from urllib.error import URLError
 
 import pytest
 
 from kolga.libs.docker import Docker
+from kolga.libs.registry import Registry
 from kolga.settings import settings
+from kolga.utils.models import ImageStage, SubprocessResult
+
+from .testcase import override_settings
 
 
 def test_incorrect_dockerfile_path() -> None:
@@ -65,6 +71,183 @@ def test_get_stages_names(value: str, expected: List[str]) -> None:
         assert stage_names == expected
 
 
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("FROM python:3.9 AS base", {"base": set()}),
+        (
+            "FROM python:3.9 AS base\nFROM base AS development\nFROM base AS final",
+            {"base": set(), "development": {"base"}, "final": {"base"}},
+        ),
+        (
+            "FROM node AS assets\nFROM python AS base\n"
+            "FROM base\nCOPY --from=assets /app /app\nCOPY --from=nginx:1 /a /a",
+            {"assets": set(), "base": set(), "": {"assets", "base"}},
+        ),
+        (
+            "FROM --platform=linux/amd64 python AS base\nFROM base AS final",
+            {"base": set(), "final": {"base"}},
+        ),
+    ],
+)
+def test_get_stage_dependencies(value: str, expected: Dict[str, Set[str]]) -> None:
+    d = Docker()
+
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(str.encode(value, encoding="UTF-8"))
+        f.seek(0)
+        d.dockerfile = Path(f.name)
+        assert d.get_stage_dependencies() == expected
+
+
+def test_get_bake_definition() -> None:
+    d = Docker()
+    stages = [
+        ImageStage(name="development", build=True, development=True),
+        ImageStage(name="webserver", build=True, final=True),
+    ]
+
+    definition = d.get_bake_definition(stages, disable_cache=False)
+
+    assert definition["group"]["default"]["targets"] == ["development", "webserver"]
+    development = definition["target"]["development"]
+    assert development["target"] == "development"
+    assert development["tags"] == [
+        f"{d.image_repo}:{tag}" for tag in d.get_image_tags("development")
+    ]
+    assert development["cache-to"] == [
+        f"type=registry,ref={d.create_cache_tag('development')},mode=max"
+    ]
+    assert definition["target"]["webserver"]["tags"] == [
+        f"{d.image_repo}:{tag}"
+        for tag in d.get_image_tags("webserver", final_image=True)
+    ]
+    assert (
+        "cache-to"
+        not in d.get_bake_definition(stages, disable_cache=True)["target"]["webserver"]
+    )
+
+
+@mock.patch(
+    "kolga.libs.docker.stream_os_command",
+    return_value=SubprocessResult(out="", err="", return_code=0, child=None),
+)
+def test_bake_stages(mock_run: mock.MagicMock) -> None:
+    d = Docker()
+    stages = d.get_stages()
+    stages[0].build = True
+
+    images = d.bake_stages(stages, push_images=True)
+
+    mock_run.assert_called_once()
+    assert mock_run.call_args[0][0][:3] == ["docker", "buildx", "bake"]
+    assert "--push" in mock_run.call_args[0][0]
+    assert [image.tags for image in images] == [
+        d.get_image_tags("staticbuilder"),
+        d.get_image_tags("webserver", final_image=True),
+    ]
+
+
+@mock.patch(
+    "kolga.libs.docker.stream_os_command",
+    return_value=SubprocessResult(
+        out="step 1\n", err="failure\n", return_code=1, child=None
+    ),
+)
+def test_bake_stages_failure(mock_run: mock.MagicMock) -> None:
+    d = Docker()
+    stages = d.get_stages()
+
+    with pytest.raises(Exception) as exc_info:
+        d.bake_stages(stages, push_images=True)
+
+    # The output has been logged as it was read
+    assert str(exc_info.value) == "Baking the stages failed with exit status 1"
+
+
+def test_get_existing_images() -> None:
+    d = Docker()
+    stages = [ImageStage(name="webserver", final=True, build=True)]
+    tags = d.get_image_tags("webserver", final_image=True)
+    digests = {tag: "sha256:new" for tag in tags}
+    # The branch tags still point at the image of the previous commit
+    digests["testbranch"] = "sha256:old"
+    del digests["testbranch-webserver"]
+
+    registry = mock.MagicMock(spec=Registry)
+    registry.get_manifest_digest.side_effect = lambda _, tag: digests.get(tag)
+
+    images = d.get_existing_images(stages, registry=registry)
+
+    assert images is not None
+    assert [image.tags for image in images] == [tags]
+    registry.copy_manifest.assert_has_calls(
+        [
+            mock.call("test/testing", "sha256:new", "testbranch"),
+            mock.call("test/testing", "sha256:new", "testbranch-webserver"),
+        ],
+        any_order=True,
+    )
+    assert registry.copy_manifest.call_count == 2
+
+
+def test_get_existing_images_missing() -> None:
+    d = Docker()
+    stages = [ImageStage(name="webserver", final=True, build=True)]
+    registry = mock.MagicMock(spec=Registry)
+    # Only an image of another commit is found
+    registry.get_manifest_digest.side_effect = lambda _, tag: (
+        "sha256:old" if tag.startswith("testbranch") else None
+    )
+
+    assert d.get_existing_images(stages, registry=registry) is None
+    registry.copy_manifest.assert_not_called()
+
+
+def test_get_existing_images_registry_error() -> None:
+    d = Docker()
+    stages = [ImageStage(name="webserver", final=True, build=True)]
+    registry = mock.MagicMock(spec=Registry)
+    registry.get_manifest_digest.side_effect = URLError("connection refused")
+
+    assert d.get_existing_images(stages, registry=registry) is None
+
+
+@override_settings(GIT_COMMIT_SHA="")
+def test_get_existing_images_without_commit() -> None:
+    d = Docker()
+    stages = [ImageStage(name="webserver", final=True, build=True)]
+    registry = mock.MagicMock(spec=Registry)
+    registry.get_manifest_digest.return_value = "sha256:abc"
+
+    assert d.get_existing_images(stages, registry=registry) is None
+    registry.get_manifest_digest.assert_not_called()
+
+
+def test_promote_image() -> None:
+    d = Docker()
+    registry = mock.MagicMock(spec=Registry)
+
+    image = d.promote_image(
+        tags=["v1.0.0"],
+        target_repo="docker-registry:5000/production/testing",
+        registry=registry,
+    )
+
+    registry.copy_image.assert_called_once_with(
+        "test/testing", settings.GIT_COMMIT_SHA, "production/testing", ["v1.0.0"]
+    )
+    assert image.repository == "docker-registry:5000/production/testing"
+    assert image.tags == ["v1.0.0"]
+
+
+def test_promote_image_other_registry() -> None:
+    d = Docker()
+
+    with pytest.raises(ValueError):
+        d.promote_image(tags=["v1.0.0"], target_repo="registry.example.com/testing")
+
+
 @pytest.mark.parametrize(
     "value, expected",
     [
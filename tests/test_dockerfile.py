@@ -0,0 +1,133 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+import pytest
+
+from kolga.utils.dockerfile import Dockerfile, load_dockerfile
+
+DOCKERFILE = """\
+# syntax=docker/dockerfile:1
+ARG PYTHON_VERSION=3.9
+ARG NODE_IMAGE
+
+# Frontend assets
+FROM --platform=linux/amd64 node:14 AS Assets
+RUN npm ci \\
+    # Comments are allowed inside continued lines
+    && npm run build
+
+FROM python:${PYTHON_VERSION}-slim as base
+ARG APP_HOME="/app"
+RUN --mount=type=cache,target=/root/.cache \\
+    --mount=type=bind,from=assets,source=/dist,target=/dist pip install .
+
+FROM base AS development
+
+FROM base
+COPY --from=0 /dist /app/static
+COPY --from=nginx:1 /etc/nginx /etc/nginx
+"""
+
+
+def test_parse_stages() -> None:
+    dockerfile = Dockerfile.parse(DOCKERFILE)
+
+    assert dockerfile.stage_names == ["Assets", "base", "development", ""]
+    assert [stage.index for stage in dockerfile.stages] == [0, 1, 2, 3]
+    assert dockerfile.stages[0].platform == "linux/amd64"
+    assert dockerfile.stages[1].platform is None
+
+
+def test_parse_args() -> None:
+    dockerfile = Dockerfile.parse(DOCKERFILE)
+
+    assert dockerfile.args == {"PYTHON_VERSION": "3.9", "NODE_IMAGE": None}
+    assert dockerfile.stages[1].args == {"APP_HOME": "/app"}
+    assert dockerfile.stages[1].base_image == "python:3.9-slim"
+
+
+def test_parse_references() -> None:
+    dockerfile = Dockerfile.parse(DOCKERFILE)
+
+    assert dockerfile.stages[1].references == {"assets"}
+    assert dockerfile.stages[3].references == {"0", "nginx:1"}
+    assert dockerfile.base_images == {"node:14", "python:3.9-slim"}
+    assert [stage.depends_on for stage in dockerfile.stages] == [
+        set(),
+        {"Assets"},
+        {"base"},
+        {"Assets", "base"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "reference, before, expected",
+    [
+        ("assets", None, "Assets"),
+        ("ASSETS", None, "Assets"),
+        ("1", None, "base"),
+        ("3", None, ""),
+        ("4", None, None),
+        ("base", 1, None),
+        ("python:3.9-slim", None, None),
+    ],
+)
+def test_get_stage(reference: str, before: Optional[int], expected: str) -> None:
+    dockerfile = Dockerfile.parse(DOCKERFILE)
+
+    stage = dockerfile.get_stage(reference, before=before)
+
+    assert (stage.name if stage else None) == expected
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("# escape=`\nFROM python `\n  AS base", {"base": "python"}),
+        ("FROM python \\\n\n  AS base", {"base": "python"}),
+        ("FROM ${MISSING:-python}", {"": "python"}),
+        ("ARG TAG=3\nFROM python${TAG:+:}${TAG}", {"": "python:3"}),
+        ("ARG IMAGE=python\nFROM $IMAGE AS base", {"base": "python"}),
+        ("FROM python\\", {"": "python"}),
+    ],
+)
+def test_parse_base_image(value: str, expected: Dict[str, str]) -> None:
+    dockerfile = Dockerfile.parse(value)
+
+    assert {stage.name: stage.base_image for stage in dockerfile.stages} == expected
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("ARG A", {"A": None}),
+        ("ARG A=1", {"A": "1"}),
+        ("ARG A=1 B=2", {"A": "1", "B": "2"}),
+        ("ARG A B=2 C", {"A": None, "B": "2", "C": None}),
+        ("ARG A=\"x y\" B='z'", {"A": "x y", "B": "z"}),
+        ("ARG A= B", {"A": "", "B": None}),
+        ("ARG A=1 \\\n    B=2", {"A": "1", "B": "2"}),
+    ],
+)
+def test_parse_arg_declarations(value: str, expected: Dict[str, Optional[str]]) -> None:
+    dockerfile = Dockerfile.parse(f"{value}\nFROM python AS base\n{value}")
+
+    assert dockerfile.args == expected
+    assert dockerfile.stages[0].args == expected
+
+
+def test_load_dockerfile_cached() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "Dockerfile"
+        path.write_text("FROM python AS base\n")
+
+        dockerfile = load_dockerfile(path)
+        assert load_dockerfile(path) is dockerfile
+
+        path.write_text("FROM python AS base\nFROM base AS final\n")
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        assert load_dockerfile(path).stage_names == ["base", "final"]
@@ -1,8 +1,20 @@
+import json
 import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from unittest import mock
 
 import pytest
+import yaml
 
-from kolga.libs.helm import Helm
+from kolga.libs.helm import DEFAULT_REPOS, ChartCache, Helm, HelmRepositoryState
+from kolga.utils.models import SubprocessResult
+
+from .testcase import override_settings
+
+HELM_PATH = Path(__file__).parent.parent / "helm"
+CHARTS_PATH = Path(__file__).parent / "charts"
 
 
 @pytest.mark.parametrize(
@@ -48,6 +60,289 @@ def test_get_chart_params() -> None:
     assert Helm.get_chart_params("--set", values) == expected
 
 
+def _helm_output(
+    release: Optional[Dict[str, Any]], values: Optional[Dict[str, Any]]
+) -> Any:
+    def run_os_command(command: List[str], **kwargs: Any) -> SubprocessResult:
+        output: Any = [release] if release else []
+        if command[1:3] == ["get", "values"]:
+            output = values
+        return_code = 0 if output is not None else 1
+        return SubprocessResult(
+            out=json.dumps(output), err="", return_code=return_code, child=None
+        )
+
+    return run_os_command
+
+
+RELEASE = {"name": "testing", "status": "deployed", "chart": "anders-deploy-app-0.0.1"}
+
+
+@pytest.mark.parametrize(
+    "release, release_values, expected",
+    [
+        (RELEASE, {"image": "lizard", "replicaCount": 1}, True),
+        (RELEASE, {"image": "lizard", "replicaCount": 2}, False),
+        (
+            {**RELEASE, "status": "failed"},
+            {"image": "lizard", "replicaCount": 1},
+            False,
+        ),
+        (
+            {**RELEASE, "chart": "anders-deploy-app-0.0.0"},
+            {"image": "lizard", "replicaCount": 1},
+            False,
+        ),
+        (None, None, False),
+    ],
+)
+def test_is_release_up_to_date(
+    release: Optional[Dict[str, Any]],
+    release_values: Optional[Dict[str, Any]],
+    expected: bool,
+) -> None:
+    values = {"image": "lizard", "replicaCount": 1}
+    with mock.patch(
+        "kolga.libs.helm.run_os_command", _helm_output(release, release_values)
+    ):
+        assert (
+            Helm().is_release_up_to_date(
+                name="testing",
+                namespace="testing",
+                values=values,  # type: ignore
+                chart_path=HELM_PATH,
+            )
+            is expected
+        )
+
+
+def test_get_release_values_without_user_values() -> None:
+    # Helm prints null when a release was installed without values
+    result = SubprocessResult(out="null\n", err="", return_code=0, child=None)
+    with mock.patch("kolga.libs.helm.run_os_command", return_value=result):
+        assert Helm().get_release_values(name="testing", namespace="testing") == {}
+
+
+def _seed_repositories(
+    path: Path, index_age: float = 0, charts: Optional[Dict[str, List[str]]] = None
+) -> HelmRepositoryState:
+    config_path = path / "repositories.yaml"
+    cache_path = path / "repository"
+    cache_path.mkdir()
+    config_path.write_text(
+        yaml.dump(
+            {
+                "repositories": [
+                    {"name": name, "url": url} for name, url in DEFAULT_REPOS.items()
+                ]
+            }
+        )
+    )
+    for repo_name in DEFAULT_REPOS:
+        entries = {
+            chart_name: [{"name": chart_name, "version": v} for v in versions]
+            for chart_name, versions in (charts or {}).items()
+        }
+        index_path = cache_path / f"{repo_name}-index.yaml"
+        index_path.write_text(yaml.dump({"apiVersion": "v1", "entries": entries}))
+        mtime = time.time() - index_age
+        os.utime(index_path, (mtime, mtime))
+    return HelmRepositoryState(config_path=config_path, cache_path=cache_path)
+
+
+def test_repository_state(tmp_path: Path) -> None:
+    state = _seed_repositories(tmp_path, index_age=60, charts={"postgresql": ["7.7.2"]})
+
+    assert state.get_url("bitnami") == DEFAULT_REPOS["bitnami"]
+    assert state.get_url("lizard") is None
+    index_age = state.index_age("bitnami")
+    assert index_age is not None and 59 < index_age < 120
+    assert state.index_age("lizard") is None
+    assert state.has_chart_version("bitnami/postgresql", "7.7.2")
+    assert not state.has_chart_version("bitnami/postgresql", "7.7.3")
+    assert not state.has_chart_version("lizard/postgresql", "7.7.2")
+
+
+def test_repository_state_from_environment(tmp_path: Path) -> None:
+    with mock.patch.dict(
+        os.environ,
+        {"HELM_REPOSITORY_CACHE": str(tmp_path), "XDG_CONFIG_HOME": "/config"},
+    ):
+        state = HelmRepositoryState.from_environment()
+
+    assert state.cache_path == tmp_path
+    assert state.config_path == Path("/config/helm/repositories.yaml")
+
+
+@pytest.mark.parametrize(
+    "index_age, ttl, charts, expected",
+    [
+        (60, 0, None, True),
+        (60, 3600, None, False),
+        (7200, 3600, None, True),
+        (7200, 0, {"bitnami/postgresql": "7.7.2"}, False),
+        (60, 3600, {"bitnami/postgresql": "7.7.3"}, True),
+        # Local charts and charts without a pinned version do not matter
+        (60, 3600, {"testing": "1.0.0", "bitnami/postgresql": None}, False),
+    ],
+)
+def test_repos_need_update(
+    tmp_path: Path,
+    index_age: float,
+    ttl: int,
+    charts: Optional[Dict[str, Optional[str]]],
+    expected: bool,
+) -> None:
+    helm = Helm()
+    helm.repositories = _seed_repositories(
+        tmp_path, index_age=index_age, charts={"postgresql": ["7.7.2"]}
+    )
+
+    with override_settings(HELM_REPO_CACHE_TTL=ttl):
+        assert helm.repos_need_update(charts) is expected
+
+
+def test_repos_need_update_missing_index(tmp_path: Path) -> None:
+    helm = Helm()
+    helm.repositories = HelmRepositoryState(
+        config_path=tmp_path / "repositories.yaml", cache_path=tmp_path
+    )
+
+    with override_settings(HELM_REPO_CACHE_TTL=3600):
+        assert helm.repos_need_update()
+
+
+@override_settings(HELM_OFFLINE=True)
+def test_repos_need_update_offline(tmp_path: Path) -> None:
+    helm = Helm()
+    helm.repositories = _seed_repositories(
+        tmp_path, index_age=7200, charts={"postgresql": ["7.7.2"]}
+    )
+
+    assert not helm.repos_need_update({"bitnami/postgresql": "7.7.2"})
+    with pytest.raises(ValueError):
+        helm.repos_need_update({"bitnami/postgresql": "7.7.3"})
+
+
+@mock.patch("kolga.libs.helm.run_os_command")
+def test_setup_helm_configured(mock_run: mock.MagicMock, tmp_path: Path) -> None:
+    helm = Helm()
+    helm.repositories = _seed_repositories(tmp_path, index_age=60)
+
+    with override_settings(HELM_REPO_CACHE_TTL=3600):
+        helm.setup_helm()
+
+    mock_run.assert_not_called()
+
+
+@override_settings(HELM_OFFLINE=True)
+def test_add_repo_offline(tmp_path: Path) -> None:
+    helm = Helm()
+    helm.repositories = _seed_repositories(tmp_path)
+
+    with pytest.raises(ValueError):
+        helm.add_repo("lizard", "https://charts.example.com")
+
+
+def test_chart_cache(tmp_path: Path) -> None:
+    cache = ChartCache(path=tmp_path, max_size=1024 * 1024)
+    archive = CHARTS_PATH / "postgresql-9.3.3.tgz"
+    repo_url = DEFAULT_REPOS["bitnami"]
+
+    assert cache.get(repo_url, "postgresql", "9.3.3") is None
+    cached_archive = cache.put(repo_url, "postgresql", "9.3.3", archive)
+
+    assert cached_archive.read_bytes() == archive.read_bytes()
+    assert cached_archive.stem == ChartCache.get_digest(archive)
+    assert cache.get(repo_url, "postgresql", "9.3.3") == cached_archive
+    # The same chart from another repository is another entry
+    assert cache.get("https://charts.example.com", "postgresql", "9.3.3") is None
+
+
+def test_chart_cache_corrupted_archive(tmp_path: Path) -> None:
+    cache = ChartCache(path=tmp_path, max_size=1024 * 1024)
+    repo_url = DEFAULT_REPOS["bitnami"]
+    cached_archive = cache.put(
+        repo_url, "mysql", "1.6.6", CHARTS_PATH / "mysql-1.6.6.tgz"
+    )
+    cached_archive.write_bytes(b"lizard")
+
+    assert cache.get(repo_url, "mysql", "1.6.6") is None
+    assert not cached_archive.exists()
+
+
+def test_chart_cache_eviction(tmp_path: Path) -> None:
+    mysql = CHARTS_PATH / "mysql-1.6.6.tgz"
+    postgresql = CHARTS_PATH / "postgresql-9.3.3.tgz"
+    # Room for both of the archives but not for a third one
+    cache = ChartCache(
+        path=tmp_path, max_size=postgresql.stat().st_size + mysql.stat().st_size
+    )
+    repo_url = DEFAULT_REPOS["stable"]
+
+    cache.put(repo_url, "mysql", "1.6.6", mysql)
+    cache.put(repo_url, "postgresql", "9.3.3", postgresql)
+    mtime = time.time() - 60
+    os.utime(cache.archive_path(ChartCache.get_digest(postgresql)), (mtime, mtime))
+    # Using an archive makes it the most recently used one
+    assert cache.get(repo_url, "mysql", "1.6.6")
+
+    with mock.patch.object(ChartCache, "get_digest", return_value="other"):
+        cache.put(repo_url, "other", "1.0.0", mysql)
+
+    assert cache.get(repo_url, "postgresql", "9.3.3") is None
+    assert cache.get(repo_url, "mysql", "1.6.6")
+    assert sorted(path.stem for path in (tmp_path / "blobs").iterdir()) == sorted(
+        [ChartCache.get_digest(mysql), "other"]
+    )
+
+
+def _fake_helm_pull(command: List[str], **kwargs: Any) -> SubprocessResult:
+    chart_name = command[2].split("/")[-1]
+    version = command[command.index("--version") + 1]
+    destination = Path(command[command.index("--destination") + 1])
+    archive_name = f"{chart_name}-{version}.tgz"
+    (destination / archive_name).write_bytes((CHARTS_PATH / archive_name).read_bytes())
+    return SubprocessResult(out="", err="", return_code=0, child=None)
+
+
+@mock.patch("kolga.libs.helm.run_os_command", side_effect=_fake_helm_pull)
+def test_get_cached_chart(mock_run: mock.MagicMock, tmp_path: Path) -> None:
+    with override_settings(HELM_CHART_CACHE_DIR=str(tmp_path / "charts")):
+        helm = Helm()
+    helm.repositories = _seed_repositories(tmp_path)
+
+    archive = helm.get_cached_chart("bitnami/postgresql", "9.3.3")
+    assert archive is not None
+    assert archive.read_bytes() == (CHARTS_PATH / "postgresql-9.3.3.tgz").read_bytes()
+    # The second lookup is served from the cache
+    assert helm.get_cached_chart("bitnami/postgresql", "9.3.3") == archive
+    mock_run.assert_called_once()
+
+    assert helm.get_cached_chart("bitnami/postgresql", None) is None
+    assert helm.get_cached_chart("lizard/postgresql", "9.3.3") is None
+    assert helm.get_cached_chart("postgresql", "9.3.3") is None
+
+
+@mock.patch(
+    "kolga.libs.helm.run_os_command",
+    return_value=SubprocessResult(out="", err="not found", return_code=1, child=None),
+)
+def test_get_cached_chart_pull_failed(mock_run: mock.MagicMock, tmp_path: Path) -> None:
+    with override_settings(HELM_CHART_CACHE_DIR=str(tmp_path / "charts")):
+        helm = Helm()
+    helm.repositories = _seed_repositories(tmp_path)
+
+    assert helm.get_cached_chart("bitnami/postgresql", "1.0.0") is None
+
+
+def test_get_cached_chart_disabled() -> None:
+    helm = Helm()
+
+    assert helm.chart_cache is None
+    assert helm.get_cached_chart("bitnami/postgresql", "9.3.3") is None
+
+
 class TestHelmRegistryFunctions:
     helm_repo_name = "localhelm"
     helm_repo_url = os.environ.get("TEST_HELM_REGISTRY", "http://localhost:8080")
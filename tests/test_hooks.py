@@ -1,11 +1,16 @@
-from typing import Optional
+from threading import Event
+from typing import Any, Generator, Optional
+from unittest import mock
 
+import pluggy
 from environs import Env
 
 from kolga.hooks import hookimpl
+from kolga.hooks.dispatcher import HookDispatcher
 from kolga.hooks.plugins import PluginBase
 from kolga.libs.project import Project
 from kolga.settings import settings
+from kolga.utils.logger import logger
 from tests.testcase import load_plugin
 
 
@@ -34,3 +39,91 @@ def test_create_deployment() -> None:
     )
 
     assert len(results) and results[0] is True
+
+
+class _FailingPlugin(PluginBase):
+    name = "failing_plugin"
+    verbose_name = "Kolga Failing Plugin"
+    version = 0.1
+
+    def __init__(self, env: Env) -> None:
+        self.configure(env)
+
+    @hookimpl
+    def project_deployment_complete(self, project: Project) -> Optional[bool]:
+        raise ValueError("Plugin failed")
+
+
+@load_plugin(_TestPlugin, _FailingPlugin)
+def test_dispatch_hook() -> None:
+    dispatcher = HookDispatcher(settings.plugin_manager)
+
+    future = dispatcher.dispatch(
+        "project_deployment_complete",
+        {
+            "project": Project(track="testing", url="test.example.com"),
+            "track": "testing",
+            "namespace": "testing",
+        },
+    )
+
+    # A failing hook is logged instead of being raised
+    with mock.patch.object(logger, "error") as mock_error:
+        assert dispatcher.flush(timeout=5)
+    mock_error.assert_called_once()
+    assert isinstance(future.exception(), ValueError)
+    assert not dispatcher.pending
+
+
+class _WrapperPlugin(PluginBase):
+    name = "wrapper_plugin"
+    verbose_name = "Kolga Wrapper Plugin"
+    version = 0.1
+
+    def __init__(self, env: Env) -> None:
+        self.configure(env)
+
+    @pluggy.HookimplMarker("kolga")(hookwrapper=True)
+    def project_deployment_complete(
+        self, project: Project
+    ) -> Generator[None, Any, None]:
+        outcome = yield
+        outcome.force_result([*outcome.get_result(), "wrapped"])
+
+
+@load_plugin(_TestPlugin, _WrapperPlugin)
+def test_dispatch_hook_wrapper() -> None:
+    dispatcher = HookDispatcher(settings.plugin_manager)
+
+    future = dispatcher.dispatch("project_deployment_complete", {"project": None})
+
+    assert dispatcher.flush(timeout=5)
+    assert future.result() == [True, "wrapped"]
+
+
+@load_plugin(_TestPlugin)
+def test_dispatch_hook_cancelled() -> None:
+    dispatcher = HookDispatcher(settings.plugin_manager, max_workers=1)
+    started = Event()
+    release = Event()
+
+    def slow_hook(project: Project) -> bool:
+        started.set()
+        return release.wait(timeout=5)
+
+    hookimpl = settings.plugin_manager.hook.project_deployment_complete.get_hookimpls()
+    with mock.patch.object(hookimpl[0], "function", side_effect=slow_hook):
+        running = dispatcher.dispatch(
+            "project_deployment_complete", {"project": None}, timeout=0.1
+        )
+        assert started.wait(timeout=5)
+        queued = dispatcher.dispatch("project_deployment_complete", {"project": None})
+
+        with mock.patch.object(logger, "warning") as mock_warning:
+            assert not dispatcher.flush(timeout=0.2)
+        release.set()
+
+    assert mock_warning.call_count == 2
+    assert running.result(timeout=5) == [True]
+    # The hook that never got a worker is not run at all
+    assert queued.cancelled()
@@ -0,0 +1,131 @@
+from threading import Event, Thread
+from typing import Any, Iterator, List
+from unittest import mock
+
+from kubernetes import client as k8s_client
+
+from kolga.utils.kube_logger import KubeLoggerThread
+
+
+class FakeLogResponse:
+    def __init__(self, lines: List[bytes]) -> None:
+        self._lines = lines
+        self.closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self._lines)
+
+    def close(self) -> None:
+        self.closed = True
+
+    def release_conn(self) -> None:
+        pass
+
+
+def _pod(name: str, running: bool = True, restart_count: int = 0) -> Any:
+    state = (
+        k8s_client.V1ContainerState(running=k8s_client.V1ContainerStateRunning())
+        if running
+        else k8s_client.V1ContainerState(
+            waiting=k8s_client.V1ContainerStateWaiting(reason="ContainerCreating")
+        )
+    )
+    status = k8s_client.V1ContainerStatus(
+        name="app",
+        image="app",
+        image_id="",
+        ready=running,
+        restart_count=restart_count,
+        state=state,
+    )
+    return k8s_client.V1Pod(
+        metadata=k8s_client.V1ObjectMeta(name=name),
+        status=k8s_client.V1PodStatus(container_statuses=[status]),
+    )
+
+
+def _collector(max_lines: int = 3) -> KubeLoggerThread:
+    return KubeLoggerThread(
+        client=mock.MagicMock(),
+        namespace="testing",
+        labels={"release": "testing"},
+        max_lines=max_lines,
+    )
+
+
+def test_label_selector() -> None:
+    collector = KubeLoggerThread(
+        client=mock.MagicMock(),
+        namespace="testing",
+        labels={"release": "testing", "track": "stable"},
+    )
+    assert collector._label_selector == "release=testing,track=stable"
+
+
+@mock.patch.object(k8s_client.CoreV1Api, "read_namespaced_pod_log")
+def test_ring_buffer(mock_read_log: Any) -> None:
+    mock_read_log.return_value = FakeLogResponse(
+        [f"line {i}\n".encode() for i in range(10)]
+    )
+    collector = _collector(max_lines=3)
+
+    collector._stream_logs(("pod-1", "app", 0))
+
+    assert collector.lines() == [
+        "[pod/pod-1/app] line 7\n",
+        "[pod/pod-1/app] line 8\n",
+        "[pod/pod-1/app] line 9\n",
+    ]
+
+
+@mock.patch("kolga.utils.kube_logger.Thread")
+def test_follow_pod_once_per_container(mock_thread: Any) -> None:
+    collector = _collector()
+
+    collector._follow_pod(_pod("pod-1", running=False))
+    mock_thread.assert_not_called()
+
+    collector._follow_pod(_pod("pod-1"))
+    collector._follow_pod(_pod("pod-1"))
+    assert mock_thread.call_count == 1
+
+    # A restarted container is followed again
+    collector._follow_pod(_pod("pod-1", restart_count=1))
+    assert mock_thread.call_count == 2
+
+
+@mock.patch.object(k8s_client.CoreV1Api, "read_namespaced_pod_log")
+def test_stop_closes_streams(mock_read_log: Any) -> None:
+    response = FakeLogResponse([b"line\n"])
+    mock_read_log.return_value = response
+    collector = _collector()
+
+    collector._stream_logs(("pod-1", "app", 0))
+    collector.stop()
+
+    assert response.closed
+
+
+@mock.patch.object(k8s_client.CoreV1Api, "read_namespaced_pod_log")
+def test_stop_while_requesting_logs(mock_read_log: Any) -> None:
+    response = FakeLogResponse([b"line\n"])
+    requested = Event()
+    stopped = Event()
+
+    def read_log(**kwargs: Any) -> FakeLogResponse:
+        requested.set()
+        stopped.wait(5)
+        return response
+
+    mock_read_log.side_effect = read_log
+    collector = _collector()
+
+    stream = Thread(target=collector._stream_logs, args=(("pod-1", "app", 0),))
+    stream.start()
+    requested.wait(5)
+    collector.stop()
+    stopped.set()
+    stream.join(5)
+
+    assert response.closed
+    assert collector.lines() == []
@@ -1,15 +1,36 @@
+import asyncio
 import base64
+import json
 import os
 import tempfile
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from threading import Event, Thread
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest import mock
+from urllib.error import URLError
 
 import pytest
+from kubernetes import client as k8s_client
 from kubernetes.client.rest import ApiException
 
-from kolga.libs.kubernetes import Kubernetes
+from kolga.libs.docker import Docker
+from kolga.libs.kubernetes import (
+    CLEANUP_RESOURCES,
+    HIBERNATED_REPLICAS_ANNOTATION,
+    SECRET_DIGEST_ANNOTATION,
+    ApplicationDeploymentValues,
+    Kubernetes,
+)
 from kolga.libs.project import Project
+from kolga.libs.registry import Registry
+from kolga.libs.service import Service
+from kolga.settings import settings
 from kolga.utils.general import get_deploy_name
-from kolga.utils.models import BasicAuthUser
+from kolga.utils.models import BasicAuthUser, SubprocessResult
+
+from .testcase import override_settings
 
 DEFAULT_TRACK = os.environ.get("DEFAULT_TRACK", "stable")
 K8S_NAMESPACE = os.environ.get("K8S_NAMESPACE", "testing")
@@ -62,6 +83,745 @@ def test__b64_encode_file() -> None:
         assert Kubernetes._b64_encode_file(path=path) == expected
 
 
+def test__secret_digest() -> None:
+    digest = Kubernetes._secret_digest({"a": "MQ==", "b": "Mg=="})
+
+    assert digest == Kubernetes._secret_digest({"b": "Mg==", "a": "MQ=="})
+    assert digest != Kubernetes._secret_digest({"a": "MQ==", "b": "Mw=="})
+
+
+def _existing_secret(
+    data: Dict[str, str], digest: Optional[str] = None
+) -> k8s_client.V1Secret:
+    annotations = {SECRET_DIGEST_ANNOTATION: digest} if digest else None
+    return k8s_client.V1Secret(
+        data=data, metadata=k8s_client.V1ObjectMeta(annotations=annotations)
+    )
+
+
+@mock.patch.object(Kubernetes, "create_client")
+@mock.patch.object(k8s_client.CoreV1Api, "create_namespaced_secret")
+@mock.patch.object(k8s_client.CoreV1Api, "patch_namespaced_secret")
+@mock.patch.object(k8s_client.CoreV1Api, "read_namespaced_secret")
+def test_create_secret_new(
+    mock_read: Any, mock_patch: Any, mock_create: Any, mock_client: Any
+) -> None:
+    mock_read.side_effect = ApiException(status=404)
+    project = Project(track=DEFAULT_TRACK)
+
+    Kubernetes().create_secret(
+        data={"test": "test"},
+        namespace=K8S_NAMESPACE,
+        track=DEFAULT_TRACK,
+        project=project,
+        secret_name=project.secret_name,
+    )
+
+    body = mock_create.call_args[1]["body"]
+    assert body.data == {"test": "dGVzdA=="}
+    assert body.metadata.annotations == {
+        SECRET_DIGEST_ANNOTATION: Kubernetes._secret_digest({"test": "dGVzdA=="})
+    }
+    mock_patch.assert_not_called()
+
+
+@mock.patch.object(Kubernetes, "create_client")
+@mock.patch.object(k8s_client.CoreV1Api, "create_namespaced_secret")
+@mock.patch.object(k8s_client.CoreV1Api, "patch_namespaced_secret")
+@mock.patch.object(k8s_client.CoreV1Api, "read_namespaced_secret")
+def test_create_secret_unchanged(
+    mock_read: Any, mock_patch: Any, mock_create: Any, mock_client: Any
+) -> None:
+    data = {"test": "dGVzdA=="}
+    mock_read.return_value = _existing_secret(data, Kubernetes._secret_digest(data))
+    project = Project(track=DEFAULT_TRACK)
+
+    Kubernetes().create_secret(
+        data={"test": "test"},
+        namespace=K8S_NAMESPACE,
+        track=DEFAULT_TRACK,
+        project=project,
+        secret_name=project.secret_name,
+    )
+
+    mock_create.assert_not_called()
+    mock_patch.assert_not_called()
+
+
+@mock.patch.object(Kubernetes, "create_client")
+@mock.patch.object(k8s_client.CoreV1Api, "create_namespaced_secret")
+@mock.patch.object(k8s_client.CoreV1Api, "patch_namespaced_secret")
+@mock.patch.object(k8s_client.CoreV1Api, "read_namespaced_secret")
+def test_create_secret_changed(
+    mock_read: Any, mock_patch: Any, mock_create: Any, mock_client: Any
+) -> None:
+    mock_read.return_value = _existing_secret({"test": "b2xk", "removed": "b2xk"})
+    project = Project(track=DEFAULT_TRACK)
+
+    Kubernetes().create_secret(
+        data={"test": "test"},
+        namespace=K8S_NAMESPACE,
+        track=DEFAULT_TRACK,
+        project=project,
+        secret_name=project.secret_name,
+    )
+
+    mock_create.assert_not_called()
+    patch = mock_patch.call_args[1]["body"]
+    assert patch["data"] == {"test": "dGVzdA==", "removed": None}
+    assert patch["metadata"]["annotations"] == {
+        SECRET_DIGEST_ANNOTATION: Kubernetes._secret_digest({"test": "dGVzdA=="})
+    }
+
+
+@mock.patch.object(Kubernetes, "create_client")
+@mock.patch.object(Kubernetes, "get_certification_issuer", return_value=None)
+@mock.patch.object(Registry, "get_manifest_digest", return_value="sha256:aaa")
+def test_deployment_fingerprint(
+    mock_digest: Any, mock_issuer: Any, mock_client: Any
+) -> None:
+    k = Kubernetes()
+    project = Project(track=DEFAULT_TRACK)
+
+    def get_label() -> str:
+        with override_settings(K8S_DEPLOYMENT_FINGERPRINT=True):
+            values = k.get_application_deployment_values(
+                namespace=K8S_NAMESPACE, project=project, track=DEFAULT_TRACK
+            )
+        return values["deployment"]["timestamp"]
+
+    fingerprint = get_label()
+    assert fingerprint == get_label()
+    assert len(fingerprint) <= 63
+
+    k.secret_digests[project.secret_name] = "changed"
+    changed_secret = get_label()
+    assert fingerprint != changed_secret
+
+    # The same tag pushed again points at another manifest
+    mock_digest.return_value = "sha256:bbb"
+    assert changed_secret != get_label()
+
+    # A deployment without a known digest is never the same as an earlier one
+    mock_digest.return_value = None
+    assert get_label() != get_label()
+
+
+@mock.patch.object(Kubernetes, "create_client")
+@mock.patch.object(Kubernetes, "get_certification_issuer", return_value=None)
+def test_deployment_fingerprint_values(mock_issuer: Any, mock_client: Any) -> None:
+    k = Kubernetes()
+    project = Project(track=DEFAULT_TRACK)
+    values = k.get_application_deployment_values(
+        namespace=K8S_NAMESPACE, project=project, track=DEFAULT_TRACK
+    )
+    fingerprint = k.get_deployment_fingerprint(
+        values=values, project=project, image_digest="sha256:aaa"
+    )
+
+    values["deployment"]["timestamp"] = "ignored"
+    assert fingerprint == k.get_deployment_fingerprint(
+        values=values, project=project, image_digest="sha256:aaa"
+    )
+
+    values["replicaCount"] = 5
+    assert fingerprint != k.get_deployment_fingerprint(
+        values=values, project=project, image_digest="sha256:aaa"
+    )
+
+
+@pytest.mark.parametrize(
+    "image, expected_call",
+    [
+        ("registry:5000/group/app:abc123", ("registry:5000", "group/app", "abc123")),
+        ("registry:5000/group/app", ("registry:5000", "group/app", "latest")),
+        ("group/app:v1", ("registry-1.docker.io", "group/app", "v1")),
+        ("registry:5000/group/app@sha256:aaa", None),
+    ],
+)
+@mock.patch.object(Kubernetes, "create_client")
+def test_get_image_digest(
+    mock_client: Any, image: str, expected_call: Optional[Tuple[str, str, str]]
+) -> None:
+    k = Kubernetes()
+    with mock.patch("kolga.libs.kubernetes.Registry") as mock_registry:
+        mock_registry.split_image_repo.side_effect = Registry.split_image_repo
+        registry = mock_registry.return_value
+        registry.get_manifest_digest.return_value = "sha256:aaa"
+
+        assert k.get_image_digest(image) == "sha256:aaa"
+
+    if expected_call:
+        host, repository, tag = expected_call
+        mock_registry.assert_called_once_with(registry=host)
+        registry.get_manifest_digest.assert_called_once_with(repository, tag)
+    else:
+        mock_registry.assert_not_called()
+
+
+@mock.patch.object(Kubernetes, "create_client")
+@mock.patch.object(
+    Registry, "get_manifest_digest", side_effect=URLError("connection refused")
+)
+def test_get_image_digest_unavailable(mock_digest: Any, mock_client: Any) -> None:
+    assert Kubernetes().get_image_digest("registry:5000/group/app:v1") is None
+
+
+def _workload(
+    name: str, replicas: int, ready: int = 0, hibernated: Optional[int] = None
+) -> Any:
+    annotations = {}
+    if hibernated is not None:
+        annotations[HIBERNATED_REPLICAS_ANNOTATION] = str(hibernated)
+    return SimpleNamespace(
+        metadata=SimpleNamespace(name=name, annotations=annotations),
+        spec=SimpleNamespace(replicas=replicas),
+        status=SimpleNamespace(ready_replicas=ready),
+    )
+
+
+@override_settings(K8S_DEPLOYMENT_FINGERPRINT=True)
+@mock.patch.object(Kubernetes, "get_image_digest", return_value="sha256:aaa")
+@mock.patch.object(Kubernetes, "create_client")
+@mock.patch.object(Kubernetes, "get_certification_issuer", return_value=None)
+def test_create_application_deployment_up_to_date(
+    mock_issuer: Any, mock_client: Any, mock_digest: Any
+) -> None:
+    k = Kubernetes()
+    project = Project(track=DEFAULT_TRACK)
+
+    with mock.patch.object(
+        k.helm, "is_release_up_to_date", return_value=True
+    ), mock.patch.object(k.helm, "upgrade_chart") as mock_upgrade, mock.patch.object(
+        k, "_get_workloads", return_value=[(None, _workload("app", 2, ready=2))]
+    ), mock.patch.object(
+        settings.hook_dispatcher, "dispatch"
+    ) as mock_dispatch:
+        assert not k.create_application_deployment(
+            namespace=K8S_NAMESPACE, project=project, track=DEFAULT_TRACK
+        )
+
+    mock_upgrade.assert_not_called()
+    mock_dispatch.assert_not_called()
+
+
+class _FakeWorkloads:
+    """
+    Deployments of a namespace that are changed by patching them
+    """
+
+    def __init__(self, *workloads: Any) -> None:
+        self.workloads = {workload.metadata.name: workload for workload in workloads}
+
+    def list(self, namespace: str, label_selector: Optional[str] = None) -> Any:
+        return SimpleNamespace(items=list(self.workloads.values()))
+
+    def patch(self, name: str, namespace: str, body: Dict[str, Any]) -> None:
+        workload = self.workloads[name]
+        for key, value in body["metadata"]["annotations"].items():
+            if value is None:
+                workload.metadata.annotations.pop(key, None)
+            else:
+                workload.metadata.annotations[key] = value
+        workload.spec.replicas = body["spec"]["replicas"]
+        workload.status.ready_replicas = body["spec"]["replicas"]
+
+
+@override_settings(K8S_DEPLOYMENT_FINGERPRINT=True)
+@mock.patch.object(Kubernetes, "get_image_digest", return_value="sha256:aaa")
+@mock.patch("kolga.libs.kubernetes.k8s_client.AppsV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+@mock.patch.object(Kubernetes, "get_certification_issuer", return_value=None)
+def test_create_application_deployment_hibernated(
+    mock_issuer: Any, mock_client: Any, mock_apps_v1: Any, mock_digest: Any
+) -> None:
+    deployments = _FakeWorkloads(_workload("app", replicas=2, ready=2))
+    apps_v1 = mock_apps_v1.return_value
+    apps_v1.list_namespaced_deployment.side_effect = deployments.list
+    apps_v1.patch_namespaced_deployment.side_effect = deployments.patch
+    apps_v1.list_namespaced_stateful_set.return_value.items = []
+    k = Kubernetes()
+    project = Project(track=DEFAULT_TRACK)
+
+    k.hibernate(K8S_NAMESPACE, labels={"release": project.deploy_name})
+
+    # The values have not changed, but the hibernated release is deployed again
+    with mock.patch.object(
+        k.helm, "is_release_up_to_date", return_value=True
+    ), mock.patch.object(
+        k.helm, "upgrade_chart", return_value=SubprocessResult("", "", 0, None)
+    ) as mock_upgrade, mock.patch(
+        "kolga.libs.kubernetes.KubeLoggerThread"
+    ), mock.patch(
+        "kolga.libs.kubernetes.RolloutWatcher"
+    ), mock.patch.object(
+        settings.hook_dispatcher, "dispatch"
+    ):
+        assert k.create_application_deployment(
+            namespace=K8S_NAMESPACE, project=project, track=DEFAULT_TRACK
+        )
+
+    mock_upgrade.assert_called_once()
+    app = deployments.workloads["app"]
+    assert app.spec.replicas == 2
+    assert HIBERNATED_REPLICAS_ANNOTATION not in app.metadata.annotations
+
+
+@pytest.mark.parametrize(
+    "workloads, jobs_only, expected",
+    [
+        ([_workload("app", replicas=2, ready=2)], False, True),
+        ([_workload("app", replicas=2, ready=1)], False, False),
+        ([_workload("app", replicas=0)], False, False),
+        ([], False, False),
+        ([], True, True),
+    ],
+)
+def test_are_workloads_ready(
+    workloads: List[Any], jobs_only: bool, expected: bool
+) -> None:
+    values = ApplicationDeploymentValues(jobsOnly=jobs_only)
+    assert Kubernetes._are_workloads_ready(workloads, values) is expected
+
+
+@pytest.mark.parametrize("cached_chart", [None, Path("/cache/blobs/abc.tgz")])
+@mock.patch.object(Kubernetes, "create_client")
+def test_deploy_service_cached_chart(
+    mock_client: Any, cached_chart: Optional[Path]
+) -> None:
+    k = Kubernetes()
+    service = Service(
+        name="postgresql",
+        track=DEFAULT_TRACK,
+        chart="bitnami/postgresql",
+        chart_version="9.3.3",
+    )
+
+    with mock.patch.object(
+        k.helm, "get_cached_chart", return_value=cached_chart
+    ), mock.patch.object(k.helm, "upgrade_chart") as mock_upgrade:
+        k.deploy_service(service=service, namespace=K8S_NAMESPACE, track=DEFAULT_TRACK)
+
+    kwargs = mock_upgrade.call_args[1]
+    assert kwargs["chart_path"] == cached_chart
+    assert kwargs["version"] == (None if cached_chart else "9.3.3")
+
+
+def _not_found(body: Optional[Dict[str, Any]] = None) -> ApiException:
+    error = ApiException(status=404, reason="Not Found")
+    error.body = json.dumps(body) if body else "404 page not found"
+    return error
+
+
+@mock.patch.dict("kolga.libs.kubernetes._cluster_issuers", clear=True)
+@mock.patch("kolga.libs.kubernetes.k8s_client.CustomObjectsApi")
+@mock.patch.object(Kubernetes, "create_client")
+def test_cluster_issuer_exists(mock_client: Any, mock_custom_objects: Any) -> None:
+    custom_objects = mock_custom_objects.return_value
+    k = Kubernetes()
+    k.client.configuration.host = "https://cluster-a:6443"
+
+    assert k.get_certification_issuer(track="qa") == "certificate-letsencrypt-qa"
+    # Other projects and instances for the same cluster use the same answer
+    assert Kubernetes().cluster_issuer_exists("certificate-letsencrypt-qa")
+    custom_objects.get_cluster_custom_object.assert_called_once_with(
+        "cert-manager.io", "v1", "clusterissuers", "certificate-letsencrypt-qa"
+    )
+
+    other_cluster = Kubernetes()
+    other_cluster.client = mock.MagicMock()
+    other_cluster.client.configuration.host = "https://cluster-b:6443"
+    other_cluster.cluster_issuer_exists("certificate-letsencrypt-qa")
+    assert custom_objects.get_cluster_custom_object.call_count == 2
+
+
+@mock.patch.dict("kolga.libs.kubernetes._cluster_issuers", clear=True)
+@mock.patch("kolga.libs.kubernetes.k8s_client.CustomObjectsApi")
+@mock.patch.object(Kubernetes, "create_client")
+def test_cluster_issuer_missing(mock_client: Any, mock_custom_objects: Any) -> None:
+    custom_objects = mock_custom_objects.return_value
+    custom_objects.get_cluster_custom_object.side_effect = [
+        # The cluster only serves an older version of the API
+        _not_found(),
+        _not_found({"kind": "Status", "details": {"name": "lizard"}}),
+    ]
+    k = Kubernetes()
+
+    assert k.get_certification_issuer(track="lizard") is None
+    assert not k.cluster_issuer_exists("certificate-letsencrypt-lizard")
+    assert [
+        call[0][1] for call in custom_objects.get_cluster_custom_object.call_args_list
+    ] == ["v1", "v1beta1"]
+
+    with override_settings(K8S_CLUSTER_ISSUER="certificate-letsencrypt-lizard"):
+        with pytest.raises(Exception):
+            k.get_certification_issuer(track="lizard")
+
+
+@mock.patch.dict("kolga.libs.kubernetes._cluster_issuers", clear=True)
+@mock.patch("kolga.libs.kubernetes.k8s_client.CustomObjectsApi")
+@mock.patch.object(Kubernetes, "create_client")
+def test_cluster_issuer_error(mock_client: Any, mock_custom_objects: Any) -> None:
+    custom_objects = mock_custom_objects.return_value
+    custom_objects.get_cluster_custom_object.side_effect = ApiException(status=403)
+    k = Kubernetes()
+
+    assert not k.cluster_issuer_exists("certificate-letsencrypt-qa")
+    # Errors are not remembered
+    assert not k.cluster_issuer_exists("certificate-letsencrypt-qa")
+    assert custom_objects.get_cluster_custom_object.call_count == 2
+
+
+@mock.patch.dict("kolga.libs.kubernetes._cluster_issuers", clear=True)
+@mock.patch("kolga.libs.kubernetes.k8s_client.CustomObjectsApi")
+@mock.patch.object(Kubernetes, "create_client")
+def test_cluster_issuer_concurrent(mock_client: Any, mock_custom_objects: Any) -> None:
+    requested = Event()
+    release = Event()
+
+    def get_issuer(group: str, version: str, plural: str, name: str) -> None:
+        if name == "slow":
+            requested.set()
+            release.wait(5)
+
+    custom_objects = mock_custom_objects.return_value
+    custom_objects.get_cluster_custom_object.side_effect = get_issuer
+    k = Kubernetes()
+
+    slow = Thread(target=k.cluster_issuer_exists, args=("slow",))
+    slow.start()
+    requested.wait(5)
+    # A lookup in flight does not hold up the lookups of other issuers
+    assert k.cluster_issuer_exists("fast")
+    assert slow.is_alive()
+    release.set()
+    slow.join(5)
+
+    assert k.cluster_issuer_exists("slow")
+    assert custom_objects.get_cluster_custom_object.call_count == 2
+
+
+def _fake_call_api(
+    calls: List[Tuple[str, str, Dict[str, str]]]
+) -> Callable[..., Dict[str, Any]]:
+    def call_api(path: str, method: str, **kwargs: Any) -> Dict[str, Any]:
+        query_params = dict(kwargs["query_params"])
+        calls.append((method, path, query_params))
+        if "/networking.k8s.io/v1/" in path:
+            raise ApiException(status=404, reason="Not Found")
+        if path.endswith("/services") and method == "DELETE":
+            raise ApiException(status=405, reason="Method Not Allowed")
+        if path.endswith("/services") or path.endswith("/pods"):
+            return {"items": [{"metadata": {"name": "a"}}, {"metadata": {"name": "b"}}]}
+        return {"items": []}
+
+    return call_api
+
+
+@mock.patch.object(Kubernetes, "create_client")
+def test_delete_all_concurrently(mock_client: Any) -> None:
+    calls: List[Tuple[str, str, Dict[str, str]]] = []
+    k = Kubernetes()
+    k.client.call_api.side_effect = _fake_call_api(calls)
+
+    deleted = k.delete_all(labels={"release": "testing"}, namespace="review")
+
+    assert deleted["pods"] == 2
+    assert deleted["services"] == 2
+    assert sum(deleted.values()) == 4
+    assert len(deleted) == len(CLEANUP_RESOURCES)
+    assert (
+        "DELETE",
+        "/api/v1/namespaces/review/pods",
+        {"propagationPolicy": "Background", "labelSelector": "release=testing"},
+    ) in calls
+    # Ingresses are deleted through the first API version the cluster serves
+    assert [path for _, path, _ in calls if path.endswith("ingresses")] == [
+        "/apis/networking.k8s.io/v1/namespaces/review/ingresses",
+        "/apis/networking.k8s.io/v1beta1/namespaces/review/ingresses",
+    ]
+    # Services are deleted one by one when they can not be deleted at once
+    assert [(method, path) for method, path, _ in calls if "/services" in path] == [
+        ("DELETE", "/api/v1/namespaces/review/services"),
+        ("GET", "/api/v1/namespaces/review/services"),
+        ("DELETE", "/api/v1/namespaces/review/services/a"),
+        ("DELETE", "/api/v1/namespaces/review/services/b"),
+    ]
+
+
+@mock.patch.object(Kubernetes, "create_client")
+def test_delete_all_without_labels(mock_client: Any) -> None:
+    calls: List[Tuple[str, str, Dict[str, str]]] = []
+    k = Kubernetes()
+    k.client.call_api.side_effect = _fake_call_api(calls)
+
+    with pytest.raises(ValueError):
+        k.delete_all(namespace="review")
+    assert not calls
+
+    deleted = k.delete_all(namespace="review", all_resources=True)
+
+    # Resources outside of the namespace are never deleted without labels
+    assert "persistentvolumes" not in deleted
+    assert all("/namespaces/review/" in path for _, path, _ in calls)
+    assert all("labelSelector" not in params for _, _, params in calls)
+
+
+@mock.patch("kolga.libs.kubernetes.watch.Watch")
+@mock.patch("kolga.libs.kubernetes.k8s_client.CoreV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+def test_delete_namespace_background(
+    mock_client: Any, mock_core_v1: Any, mock_watch: Any
+) -> None:
+    k = Kubernetes()
+    v1 = mock_core_v1.return_value
+
+    k.delete_namespace(namespace="review")
+
+    v1.delete_namespace.assert_called_once_with(
+        name="review", propagation_policy="Background"
+    )
+    v1.list_namespace.assert_not_called()
+
+    v1.list_namespace.return_value.items = [mock.Mock()]
+    mock_watch.return_value.stream.return_value = iter(
+        [{"type": "MODIFIED"}, {"type": "DELETED"}]
+    )
+    k.delete_namespace(namespace="review", wait=True)
+
+    mock_watch.return_value.stop.assert_called_once()
+    assert mock_watch.return_value.stream.call_args[1]["field_selector"] == (
+        "metadata.name=review"
+    )
+
+
+@mock.patch("kolga.libs.kubernetes.watch.Watch")
+@mock.patch("kolga.libs.kubernetes.k8s_client.CoreV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+def test_wait_for_namespace_deletion_gone(
+    mock_client: Any, mock_core_v1: Any, mock_watch: Any
+) -> None:
+    k = Kubernetes()
+    v1 = mock_core_v1.return_value
+    v1.list_namespace.side_effect = [
+        mock.Mock(items=[mock.Mock()], metadata=mock.Mock(resource_version="1")),
+        mock.Mock(items=[mock.Mock()], metadata=mock.Mock(resource_version="2")),
+        mock.Mock(items=[mock.Mock()], metadata=mock.Mock(resource_version="3")),
+    ]
+    mock_watch.return_value.stream.side_effect = [
+        iter([{"type": "ERROR", "raw_object": {"code": 410}}]),
+        ApiException(status=410, reason="Gone"),
+        iter([{"type": "DELETED"}]),
+    ]
+
+    k.wait_for_namespace_deletion(namespace="review")
+
+    # The watch is restarted from a fresh resource version
+    assert [
+        call[1]["resource_version"]
+        for call in mock_watch.return_value.stream.call_args_list
+    ] == ["1", "2", "3"]
+
+
+@mock.patch("kolga.libs.kubernetes.k8s_client.CoreV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+def test_delete_namespace_missing(mock_client: Any, mock_core_v1: Any) -> None:
+    k = Kubernetes()
+    v1 = mock_core_v1.return_value
+    v1.delete_namespace.side_effect = ApiException(status=404, reason="Not Found")
+
+    k.delete_namespace(namespace="review", wait=True)
+
+    v1.list_namespace.assert_not_called()
+
+
+def _namespace(name: str, age: timedelta, project_id: str = "1") -> Any:
+    return k8s_client.V1Namespace(
+        metadata=k8s_client.V1ObjectMeta(
+            name=name,
+            labels={"kolga.io/project_id": project_id},
+            creation_timestamp=datetime.now(timezone.utc) - age,
+        ),
+        status=k8s_client.V1NamespaceStatus(phase="Active"),
+    )
+
+
+def _release(age: timedelta) -> Any:
+    return k8s_client.V1Secret(
+        metadata=k8s_client.V1ObjectMeta(
+            creation_timestamp=datetime.now(timezone.utc) - age
+        )
+    )
+
+
+@mock.patch("kolga.libs.kubernetes.k8s_client.CoreV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+def test_gc_environments(mock_client: Any, mock_core_v1: Any) -> None:
+    v1 = mock_core_v1.return_value
+    v1.list_namespace.return_value.items = [
+        # Old namespace with a recent release
+        _namespace("review-active", timedelta(days=30)),
+        # Old release and no releases at all
+        _namespace("review-idle", timedelta(days=30)),
+        _namespace("review-empty", timedelta(days=10)),
+        _namespace("review-new", timedelta(hours=1)),
+        _namespace("production", timedelta(days=100)),
+    ]
+    releases = {
+        "review-active": [_release(timedelta(days=20)), _release(timedelta(hours=2))],
+        "review-idle": [_release(timedelta(days=9))],
+    }
+    v1.list_namespaced_secret.side_effect = lambda namespace, **kwargs: mock.Mock(
+        items=releases.get(namespace, [])
+    )
+    k = Kubernetes()
+
+    with mock.patch.object(k, "delete_namespace") as mock_delete:
+        assert (
+            k.gc_environments(
+                ttl=timedelta(days=7), protected=["prod*"], max_workers=2, dry_run=True
+            )
+            == []
+        )
+        mock_delete.assert_not_called()
+
+        deleted = k.gc_environments(
+            ttl=timedelta(days=7), protected=["prod*"], max_workers=2
+        )
+
+    assert sorted(deleted) == ["review-empty", "review-idle"]
+    assert sorted(call[0][0] for call in mock_delete.call_args_list) == deleted
+    v1.list_namespace.assert_called_with(label_selector="kolga.io/project_id")
+    v1.list_namespaced_secret.assert_called_with(mock.ANY, label_selector="owner=helm")
+
+
+@mock.patch("kolga.libs.kubernetes.k8s_client.CoreV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+def test_get_environments_of_project(mock_client: Any, mock_core_v1: Any) -> None:
+    v1 = mock_core_v1.return_value
+    v1.list_namespace.return_value.items = [_namespace("review", timedelta(days=1))]
+    v1.list_namespaced_secret.return_value.items = []
+    k = Kubernetes()
+
+    environments = k.get_environments(project_id="1")
+
+    v1.list_namespace.assert_called_once_with(label_selector="kolga.io/project_id=1")
+    assert [environment.namespace for environment in environments] == ["review"]
+    assert environments[0].project_id == "1"
+
+
+@mock.patch("kolga.libs.kubernetes.k8s_client.AppsV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+def test_hibernate(mock_client: Any, mock_apps_v1: Any) -> None:
+    apps_v1 = mock_apps_v1.return_value
+    apps_v1.list_namespaced_deployment.return_value.items = [
+        _workload("app", replicas=2),
+        _workload("worker", replicas=0),
+    ]
+    apps_v1.list_namespaced_stateful_set.return_value.items = [
+        _workload("postgresql", replicas=1)
+    ]
+    k = Kubernetes()
+
+    assert k.hibernate("review", labels={"release": "review-app"}) == [
+        "app",
+        "postgresql",
+    ]
+
+    apps_v1.list_namespaced_deployment.assert_called_once_with(
+        "review", label_selector="release=review-app"
+    )
+    apps_v1.patch_namespaced_deployment.assert_called_once_with(
+        "app",
+        "review",
+        {
+            "metadata": {"annotations": {HIBERNATED_REPLICAS_ANNOTATION: "2"}},
+            "spec": {"replicas": 0},
+        },
+    )
+    apps_v1.patch_namespaced_stateful_set.assert_called_once()
+
+
+@mock.patch("kolga.libs.kubernetes.k8s_client.AppsV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+def test_wake(mock_client: Any, mock_apps_v1: Any) -> None:
+    apps_v1 = mock_apps_v1.return_value
+    apps_v1.list_namespaced_deployment.side_effect = [
+        mock.Mock(
+            items=[_workload("app", replicas=0, hibernated=2), _workload("new", 1)]
+        ),
+        mock.Mock(items=[_workload("app", replicas=2, ready=1)]),
+        mock.Mock(items=[_workload("app", replicas=2, ready=2)]),
+    ]
+    apps_v1.list_namespaced_stateful_set.return_value.items = []
+    k = Kubernetes()
+
+    with mock.patch.object(Kubernetes, "WAKE_POLL_INTERVAL", 0):
+        assert k.wake("review") == ["app"]
+
+    apps_v1.patch_namespaced_deployment.assert_called_once_with(
+        "app",
+        "review",
+        {
+            "metadata": {"annotations": {HIBERNATED_REPLICAS_ANNOTATION: None}},
+            "spec": {"replicas": 2},
+        },
+    )
+    # The workloads are listed until all of them are ready
+    assert apps_v1.list_namespaced_deployment.call_count == 3
+
+
+@mock.patch("kolga.libs.kubernetes.k8s_client.AppsV1Api")
+@mock.patch.object(Kubernetes, "create_client")
+def test_wake_timeout(mock_client: Any, mock_apps_v1: Any) -> None:
+    apps_v1 = mock_apps_v1.return_value
+    apps_v1.list_namespaced_deployment.return_value.items = [
+        _workload("app", replicas=0, hibernated=2)
+    ]
+    apps_v1.list_namespaced_stateful_set.return_value.items = []
+    k = Kubernetes()
+
+    with pytest.raises(TimeoutError):
+        k.wake("review", timeout=0)
+
+
+@mock.patch.object(Kubernetes, "cluster_issuer_exists", return_value=True)
+@mock.patch.object(Kubernetes, "create_client")
+def test_async_commands_overlap(
+    mock_client: Any, mock_issuer: Any, fake_binaries: Any
+) -> None:
+    log_file = fake_binaries(["kubectl", "helm", "docker"])
+    k = Kubernetes()
+    d = Docker()
+
+    async def run_all() -> List[Any]:
+        return list(
+            await asyncio.gather(
+                k.get_async(resource="pods", namespace=K8S_NAMESPACE),
+                k.delete_async(resource="pods", namespace=K8S_NAMESPACE),
+                k.get_certification_issuer_async(track=DEFAULT_TRACK),
+                k.helm.add_repo_async("stable", "https://charts.helm.sh/stable"),
+                d.pull_image_async("python:3.9"),
+            )
+        )
+
+    results = asyncio.run(run_all())
+
+    assert results[2] == f"certificate-letsencrypt-{DEFAULT_TRACK}"
+    assert k.certification_issuers == {DEFAULT_TRACK: results[2]}
+    assert results[4] is True
+
+    calls = [line.split() for line in log_file.read_text().splitlines()]
+    starts = [float(call[1]) for call in calls if call[0] == "start"]
+    ends = [float(call[1]) for call in calls if call[0] == "end"]
+    # Four commands and the update of the repos after adding one, the
+    # issuer is looked up from the API
+    assert len(starts) == 5
+    # Every command is started before the first one of them finishes, except
+    # for updating the repos, which waits for the repo to be added
+    assert sorted(starts)[3] < min(ends)
+
+
 @pytest.mark.k8s
 def test__create_basic_auth_data(kubernetes: Kubernetes) -> None:
     basic_auth_users = [
@@ -160,6 +920,25 @@ def test_delete_all(kubernetes: Kubernetes, test_namespace: str) -> None:
         kubernetes.get(resource="secret", name=test_namespace)
 
 
+@pytest.mark.k8s
+def test_gc_environments_cluster(kubernetes: Kubernetes) -> None:
+    with override_settings(PROJECT_ID="gc-test"):
+        namespace = kubernetes.create_namespace(namespace="gc-test")
+
+    try:
+        environments = kubernetes.get_environments(project_id="gc-test")
+        assert [environment.namespace for environment in environments] == [namespace]
+
+        assert not kubernetes.gc_environments(
+            ttl=timedelta(0), project_id="gc-test", dry_run=True
+        )
+        assert kubernetes.gc_environments(ttl=timedelta(0), project_id="gc-test") == [
+            namespace
+        ]
+    finally:
+        kubernetes.delete_namespace(namespace, wait=True)
+
+
 @pytest.mark.k8s
 def test_create_default_networkpolicy(
     kubernetes: Kubernetes, test_namespace: str
@@ -0,0 +1,250 @@
+import io
+import json
+from email.message import Message
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import Request
+
+import pytest
+
+from kolga.libs.registry import Registry
+
+
+class FakeResponse(io.BytesIO):
+    def __init__(self, body: bytes = b"", headers: Optional[Dict[str, str]] = None):
+        super().__init__(body)
+        self.headers = Message()
+        for key, value in (headers or {}).items():
+            self.headers[key] = value
+
+
+def http_error(request: Request, code: int, headers: Dict[str, str]) -> HTTPError:
+    message = Message()
+    for key, value in headers.items():
+        message[key] = value
+    return HTTPError(request.full_url, code, "", message, None)
+
+
+@pytest.mark.parametrize(
+    "image_repo, expected",
+    [
+        ("docker-registry:5000/test/testing", ("docker-registry:5000", "test/testing")),
+        ("registry.gitlab.com/group/app", ("registry.gitlab.com", "group/app")),
+        ("localhost/app", ("localhost", "app")),
+        ("group/app", ("registry-1.docker.io", "group/app")),
+        ("python", ("registry-1.docker.io", "library/python")),
+    ],
+)
+def test_split_image_repo(image_repo: str, expected: Tuple[str, str]) -> None:
+    assert Registry.split_image_repo(image_repo) == expected
+
+
+@mock.patch("kolga.libs.registry.urlopen")
+def test_get_manifest_digest_basic_auth(mock_urlopen: mock.MagicMock) -> None:
+    def urlopen(request: Request, **kwargs: object) -> FakeResponse:
+        if not request.has_header("Authorization"):
+            raise http_error(request, 401, {"WWW-Authenticate": 'Basic realm="x"'})
+        assert request.get_method() == "HEAD"
+        return FakeResponse(headers={"Docker-Content-Digest": "sha256:abc"})
+
+    mock_urlopen.side_effect = urlopen
+    registry = Registry(registry="registry:5000", username="user", password="pass")
+
+    assert registry.get_manifest_digest("test/app", "latest") == "sha256:abc"
+    # The credentials are reused without a new challenge
+    assert registry.get_manifest_digest("test/app", "latest") == "sha256:abc"
+    assert mock_urlopen.call_count == 3
+    request = mock_urlopen.call_args[0][0]
+    assert request.full_url == "https://registry:5000/v2/test/app/manifests/latest"
+    assert request.get_header("Authorization") == "Basic dXNlcjpwYXNz"
+
+
+@mock.patch("kolga.libs.registry.urlopen")
+def test_get_manifest_digest_bearer_token(mock_urlopen: mock.MagicMock) -> None:
+    challenge = 'Bearer realm="https://auth.example.com/token",service="registry"'
+
+    def urlopen(request: Request, **kwargs: object) -> FakeResponse:
+        if request.full_url.startswith("https://auth.example.com/token"):
+            assert "scope=repository%3Atest%2Fapp%3Apull" in request.full_url
+            assert "service=registry" in request.full_url
+            return FakeResponse(json.dumps({"token": "t0k3n"}).encode())
+        if request.get_header("Authorization") != "Bearer t0k3n":
+            raise http_error(request, 401, {"WWW-Authenticate": challenge})
+        raise http_error(request, 404, {})
+
+    mock_urlopen.side_effect = urlopen
+    registry = Registry(registry="registry.example.com", username="u", password="p")
+
+    assert registry.get_manifest_digest("test/app", "missing") is None
+    assert mock_urlopen.call_count == 3
+
+
+@mock.patch("kolga.libs.registry.urlopen")
+def test_copy_manifest(mock_urlopen: mock.MagicMock) -> None:
+    manifest = b'{"schemaVersion": 2}'
+    media_type = "application/vnd.oci.image.manifest.v1+json"
+    mock_urlopen.side_effect = [
+        FakeResponse(manifest, headers={"Content-Type": media_type}),
+        FakeResponse(headers={"Docker-Content-Digest": "sha256:abc"}),
+    ]
+    registry = Registry(registry="registry:5000")
+
+    assert registry.copy_manifest("test/app", "sha256:abc", "new-tag") == "sha256:abc"
+
+    put_request = mock_urlopen.call_args[0][0]
+    assert put_request.get_method() == "PUT"
+    assert put_request.full_url.endswith("/v2/test/app/manifests/new-tag")
+    assert put_request.data == manifest
+    assert put_request.get_header("Content-type") == media_type
+
+
+INDEX: Dict[str, Any] = {
+    "mediaType": "application/vnd.oci.image.index.v1+json",
+    "manifests": [{"digest": "sha256:amd64"}],
+}
+AMD64_MANIFEST: Dict[str, Any] = {
+    "mediaType": "application/vnd.oci.image.manifest.v1+json",
+    "config": {"digest": "sha256:config"},
+    "layers": [{"digest": "sha256:layer1"}, {"digest": "sha256:layer2"}],
+}
+
+
+def fake_registry(
+    requests: List[Tuple[str, str]], unmountable: Set[str]
+) -> Callable[..., FakeResponse]:
+    manifests = {
+        "/v2/test/app/manifests/abc123": INDEX,
+        "/v2/test/app/manifests/sha256:amd64": AMD64_MANIFEST,
+    }
+
+    def urlopen(request: Request, **kwargs: object) -> FakeResponse:
+        path = request.full_url.replace("https://registry:5000", "")
+        requests.append((request.get_method(), path))
+        if request.get_method() == "GET":
+            manifest = manifests[path]
+            return FakeResponse(
+                json.dumps(manifest).encode(),
+                headers={"Content-Type": manifest["mediaType"]},
+            )
+        if request.get_method() == "POST" and any(
+            digest.replace(":", "%3A") in path for digest in unmountable
+        ):
+            # The registry starts an upload when it can not mount the blob
+            return FakeResponse(
+                headers={"Docker-Upload-UUID": "1", "Location": "/v2/uploads/1"}
+            )
+        return FakeResponse(headers={"Docker-Content-Digest": "sha256:index"})
+
+    return urlopen
+
+
+@mock.patch("kolga.libs.registry.urlopen")
+def test_copy_image_to_repository(mock_urlopen: mock.MagicMock) -> None:
+    requests: List[Tuple[str, str]] = []
+    mock_urlopen.side_effect = fake_registry(requests, unmountable=set())
+    registry = Registry(registry="registry:5000")
+
+    digest = registry.copy_image("test/app", "abc123", "prod/app", ["v1.0.0"])
+
+    assert digest == "sha256:index"
+    mount_path = "/v2/prod/app/blobs/uploads/?mount=sha256%3A{}&from=test%2Fapp"
+    assert requests == [
+        ("GET", "/v2/test/app/manifests/abc123"),
+        ("GET", "/v2/test/app/manifests/sha256:amd64"),
+        ("POST", mount_path.format("config")),
+        ("POST", mount_path.format("layer1")),
+        ("POST", mount_path.format("layer2")),
+        ("PUT", "/v2/prod/app/manifests/sha256:amd64"),
+        ("PUT", "/v2/prod/app/manifests/v1.0.0"),
+    ]
+
+
+@mock.patch("kolga.libs.registry.urlopen")
+def test_copy_image_mount_refused(mock_urlopen: mock.MagicMock) -> None:
+    requests: List[Tuple[str, str]] = []
+    mock_urlopen.side_effect = fake_registry(requests, unmountable={"sha256:layer2"})
+    registry = Registry(registry="registry:5000")
+
+    with pytest.raises(ValueError, match="sha256:layer2"):
+        registry.copy_image("test/app", "abc123", "prod/app", ["v1.0.0"])
+
+    # The upload started by the registry is cancelled and nothing is tagged
+    assert requests[-2:] == [
+        (
+            "POST",
+            "/v2/prod/app/blobs/uploads/?mount=sha256%3Alayer2&from=test%2Fapp",
+        ),
+        ("DELETE", "/v2/uploads/1"),
+    ]
+
+
+@mock.patch("kolga.libs.registry.urlopen")
+def test_copy_image_same_repository(mock_urlopen: mock.MagicMock) -> None:
+    requests: List[Tuple[str, str]] = []
+    mock_urlopen.side_effect = fake_registry(requests, unmountable=set())
+    registry = Registry(registry="registry:5000")
+
+    digest = registry.copy_image("test/app", "abc123", "test/app", ["v1", "stable"])
+
+    assert digest == "sha256:index"
+    # Blobs are not mounted within the same repository
+    assert requests == [
+        ("GET", "/v2/test/app/manifests/abc123"),
+        ("PUT", "/v2/test/app/manifests/v1"),
+        ("PUT", "/v2/test/app/manifests/stable"),
+    ]
+
+
+@mock.patch("kolga.libs.registry.urlopen")
+def test_bearer_token_for_several_scopes(mock_urlopen: mock.MagicMock) -> None:
+    challenge = 'Bearer realm="https://auth.example.com/token",service="registry"'
+    token_urls = []
+
+    def urlopen(request: Request, **kwargs: object) -> FakeResponse:
+        if request.full_url.startswith("https://auth.example.com/token"):
+            token_urls.append(request.full_url)
+            return FakeResponse(json.dumps({"access_token": "t0k3n"}).encode())
+        if request.get_header("Authorization") != "Bearer t0k3n":
+            raise http_error(request, 401, {"WWW-Authenticate": challenge})
+        return FakeResponse(headers={"Docker-Content-Digest": "sha256:layer"})
+
+    mock_urlopen.side_effect = urlopen
+    registry = Registry(registry="registry.example.com")
+
+    assert registry.mount_blob("prod/app", "sha256:layer", "test/app")
+    assert token_urls == [
+        "https://auth.example.com/token?scope=repository%3Aprod%2Fapp%3Apull%2Cpush"
+        "&scope=repository%3Atest%2Fapp%3Apull&service=registry"
+    ]
+
+
+# =====================================================
+# DOCKER REGISTRY REQUIRED FROM THIS POINT FORWARD
+# =====================================================
+
+
+@pytest.mark.docker
+def test_get_manifest_digest_missing() -> None:
+    registry = Registry()
+    assert registry.get_manifest_digest("test/testing", "does-not-exist") is None
+
+
+@mock.patch("ssl.SSLContext.load_verify_locations")
+@mock.patch("ssl.SSLContext.load_default_certs")
+def test_registry_ca_file(
+    mock_load_default_certs: mock.MagicMock,
+    mock_load_verify_locations: mock.MagicMock,
+    tmp_path: Path,
+) -> None:
+    ca_file = tmp_path / "registry.example.com" / "ca.crt"
+    ca_file.parent.mkdir()
+    ca_file.touch()
+
+    with mock.patch("kolga.libs.registry.DOCKER_CERTS_PATH", tmp_path):
+        Registry(registry="registry.example.com")
+
+    # The registry CA is trusted on top of the system certificates
+    mock_load_default_certs.assert_called_once()
+    mock_load_verify_locations.assert_called_once_with(cafile=str(ca_file))
@@ -0,0 +1,93 @@
+from typing import Any, Optional
+from unittest import mock
+
+import pytest
+from kubernetes import client as k8s_client
+
+from kolga.utils.rollout_watcher import RolloutWatcher
+
+
+def _watcher() -> RolloutWatcher:
+    return RolloutWatcher(
+        client=mock.MagicMock(), namespace="testing", labels={"release": "testing"}
+    )
+
+
+def _pod(reason: Optional[str], restart_count: int = 0) -> k8s_client.V1Pod:
+    waiting = k8s_client.V1ContainerStateWaiting(reason=reason) if reason else None
+    status = k8s_client.V1ContainerStatus(
+        name="app",
+        image="app",
+        image_id="",
+        ready=False,
+        restart_count=restart_count,
+        state=k8s_client.V1ContainerState(waiting=waiting),
+    )
+    return k8s_client.V1Pod(
+        metadata=k8s_client.V1ObjectMeta(name="testing-pod"),
+        status=k8s_client.V1PodStatus(container_statuses=[status]),
+    )
+
+
+@pytest.mark.parametrize(
+    "reason, restart_count, aborted",
+    [
+        (None, 0, False),
+        ("ContainerCreating", 0, False),
+        ("ErrImagePull", 0, False),
+        ("ImagePullBackOff", 0, True),
+        ("CreateContainerConfigError", 0, True),
+        ("CrashLoopBackOff", 1, False),
+        ("CrashLoopBackOff", RolloutWatcher.MAX_RESTARTS, True),
+    ],
+)
+def test_handle_pod(reason: Optional[str], restart_count: int, aborted: bool) -> None:
+    watcher = _watcher()
+    watcher._handle_pod(_pod(reason, restart_count))
+
+    assert watcher.abort.is_set() == aborted
+    assert bool(watcher.failure) == aborted
+    if aborted:
+        assert str(reason) in str(watcher.failure)
+
+
+def test_handle_replica_set_progress(capsys: Any) -> None:
+    watcher = _watcher()
+
+    def replica_set(ready: int) -> k8s_client.V1ReplicaSet:
+        return k8s_client.V1ReplicaSet(
+            metadata=k8s_client.V1ObjectMeta(name="testing-rs"),
+            spec=k8s_client.V1ReplicaSetSpec(
+                replicas=2, selector=k8s_client.V1LabelSelector()
+            ),
+            status=k8s_client.V1ReplicaSetStatus(replicas=2, ready_replicas=ready),
+        )
+
+    for ready in (0, 0, 1, 2):
+        watcher._handle_replica_set(replica_set(ready))
+
+    out = capsys.readouterr().out
+    assert out.count("testing-rs") == 3
+    assert "2/2 ready" in out
+
+
+def _event(name: str, reason: str, uid: str = "1") -> k8s_client.V1Event:
+    return k8s_client.V1Event(
+        metadata=k8s_client.V1ObjectMeta(uid=uid),
+        involved_object=k8s_client.V1ObjectReference(kind="ReplicaSet", name=name),
+        reason=reason,
+        message="exceeded quota",
+        type="Warning",
+    )
+
+
+def test_handle_event_failed_create() -> None:
+    watcher = _watcher()
+    watcher._objects.add(("ReplicaSet", "testing-rs"))
+
+    watcher._handle_event(_event("other-rs", "FailedCreate"))
+    assert not watcher.abort.is_set()
+
+    watcher._handle_event(_event("testing-rs", "FailedCreate"))
+    assert watcher.abort.is_set()
+    assert "exceeded quota" in str(watcher.failure)
@@ -10,7 +10,8 @@ from unittest import mock
 import pytest
 
 import kolga
-from kolga.hooks.plugins import PluginBase
+from kolga.hooks.plugins import PluginBase, PluginSpec, discover_plugins
+from kolga.plugins.slack import PLUGIN as SLACK_PLUGIN
 from kolga.settings import GitHubActionsMapper, Settings, settings
 
 
@@ -95,19 +96,122 @@ def test_set_variables(
             "kolga.settings._VARIABLE_DEFINITIONS", {attr_name: [parser, default_value]}
         ):
             settings = Settings()
+            value = getattr(settings, attr_name)
 
         # Get values
         if expected_key is None:
             expected_value = default_value
         else:
             expected_value = os.environ[expected_key]
-        value = getattr(settings, attr_name)
 
     assert (
         value == expected_value
     ), f"settings.{attr_name} != os.environ[{expected_key}]."
 
 
+@mock.patch("kolga.settings.read_env_files")
+def test_settings_resolved_lazily(mock_read_env_files: mock.MagicMock) -> None:
+    parser = mock.MagicMock(return_value="abc123")
+
+    with mock.patch.dict(
+        "kolga.settings._VARIABLE_DEFINITIONS", {"GIT_COMMIT_SHA": [parser, ""]}
+    ):
+        settings = Settings()
+        mock_read_env_files.assert_not_called()
+
+        assert settings.GIT_COMMIT_SHA == "abc123"
+        assert settings.GIT_COMMIT_SHA == "abc123"
+        assert settings.DEFAULT_TRACK
+
+    mock_read_env_files.assert_called_once()
+    parser.assert_called_once_with("GIT_COMMIT_SHA", None)
+    assert "DOCKER_HOST" not in vars(settings)
+
+
+def test_settings_resolved_value_overridden() -> None:
+    settings = Settings()
+    settings.DEFAULT_TRACK = "review"
+
+    assert settings.DEFAULT_TRACK == "review"
+
+
+def test_settings_snapshot(tmp_path: Path) -> None:
+    snapshot_path = tmp_path / "settings.json"
+    with mock.patch.dict("os.environ", {"DOCKER_BUILD_BAKE": "1"}):
+        written_path = Settings().write_snapshot(snapshot_path)
+
+        parser = mock.MagicMock(return_value="parsed")
+        with mock.patch.dict(
+            "kolga.settings._VARIABLE_DEFINITIONS",
+            {"DEFAULT_TRACK": [parser, "stable"]},
+        ):
+            settings = Settings()
+            assert settings.load_snapshot(snapshot_path)
+            assert settings.DEFAULT_TRACK == "stable"
+        parser.assert_not_called()
+
+    snapshot = json.loads(written_path.read_text())
+    assert snapshot["version"] == kolga.settings.SETTINGS_SNAPSHOT_VERSION
+    assert snapshot["settings"]["DOCKER_BUILD_BAKE"] is True
+    assert settings.DOCKER_BUILD_BAKE is True
+    # Secrets are not written and are resolved from the environment
+    assert "CONTAINER_REGISTRY_PASSWORD" not in snapshot["settings"]
+    assert "testpassword" not in written_path.read_text()
+    assert settings.CONTAINER_REGISTRY_PASSWORD == "testpassword"
+
+
+def test_settings_snapshot_unrelated_variable(tmp_path: Path) -> None:
+    snapshot_path = Settings().write_snapshot(tmp_path / "settings.json")
+
+    # Variables no setting is read from, like the ID of the job, do not matter
+    with mock.patch.dict("os.environ", {"CI_JOB_ID": "1234"}):
+        assert Settings().load_snapshot(snapshot_path)
+
+
+@pytest.mark.parametrize(
+    "variable", ["DEFAULT_TRACK", "TESTING_DEFAULT_TRACK", "CI_ENVIRONMENT_SLUG"]
+)
+def test_settings_snapshot_variable_changed(tmp_path: Path, variable: str) -> None:
+    with mock.patch.dict("os.environ", {"GITLAB_CI": "true"}):
+        snapshot_path = Settings().write_snapshot(tmp_path / "settings.json")
+
+        with mock.patch.dict("os.environ", {variable: "review"}):
+            assert not Settings().load_snapshot(snapshot_path)
+
+
+def test_settings_snapshot_env_file_changed(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    env_file = tmp_path / "artifacts" / "docker_build.env"
+    env_file.parent.mkdir()
+    env_file.write_text("UNRELATED=1\n")
+
+    with mock.patch.dict("os.environ", {"BUILD_ARTIFACT_FOLDER": "artifacts"}):
+        snapshot_path = Settings().write_snapshot()
+        assert Settings().load_snapshot(snapshot_path)
+
+        env_file.write_text("UNRELATED=22\n")
+        assert not Settings().load_snapshot(snapshot_path)
+
+
+@pytest.mark.parametrize(
+    "key, value",
+    [("version", 0), ("key", "abc"), ("settings", {"DEFAULT_TRACK": "stable"})],
+)
+def test_settings_snapshot_invalid(tmp_path: Path, key: str, value: Any) -> None:
+    snapshot_path = Settings().write_snapshot(tmp_path / "settings.json")
+    snapshot = json.loads(snapshot_path.read_text())
+    snapshot[key] = value
+    snapshot_path.write_text(json.dumps(snapshot))
+
+    assert not Settings().load_snapshot(snapshot_path)
+
+
+def test_settings_snapshot_missing(tmp_path: Path) -> None:
+    assert not Settings().load_snapshot(tmp_path / "settings.json")
+
+
 @pytest.mark.parametrize(
     "track, is_track_present, expected_variable",
     [
@@ -175,6 +279,47 @@ def test_load_unload_plugins(test_plugin: Type[PluginBase]) -> None:
     assert settings._unload_plugin(plugin=test_plugin)
 
 
+@mock.patch.dict("os.environ", {"SLACK_TOKEN": "test_token", "SLACK_CHANNEL": ""})
+@mock.patch.object(PluginSpec, "load")
+def test_load_plugins_not_configured(mock_load: mock.MagicMock) -> None:
+    os.environ.pop("SENTRY_DSN", None)
+
+    settings.load_plugins()
+
+    mock_load.assert_not_called()
+
+
+@mock.patch.dict("os.environ", {"SLACK_TOKEN": "test_token", "SLACK_CHANNEL": "a"})
+def test_load_plugins_configured() -> None:
+    os.environ.pop("SENTRY_DSN", None)
+    settings.load_plugins()
+    try:
+        assert settings.plugin_manager.has_plugin("slack")
+        assert not settings.plugin_manager.has_plugin("sentry")
+    finally:
+        settings._unload_plugin(SLACK_PLUGIN.load())
+
+
+def test_discover_plugins() -> None:
+    custom_plugin = PluginSpec(name="custom", plugin="custom.plugin:CustomPlugin")
+    entry_points = [mock.MagicMock(), mock.MagicMock(), mock.MagicMock()]
+    entry_points[0].name = "slack"
+    entry_points[1].name = "custom"
+    entry_points[1].load.return_value = custom_plugin
+    entry_points[2].name = "broken"
+    entry_points[2].load.side_effect = ImportError("No module named 'broken'")
+
+    with mock.patch(
+        "kolga.hooks.plugins._get_entry_points", return_value=entry_points
+    ) as mock_entry_points:
+        plugins = discover_plugins([SLACK_PLUGIN])
+
+    mock_entry_points.assert_called_once_with("kolga.plugins")
+    # A core plugin is not replaced by an installed one
+    entry_points[0].load.assert_not_called()
+    assert plugins == [SLACK_PLUGIN, custom_plugin]
+
+
 def test_gh_event_data_set() -> None:
     # The test data is a subset of the full specification example:
     # https://docs.github.com/en/developers/webhooks-and-events/webhook-events-and-payloads#pull_request
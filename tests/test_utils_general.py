@@ -1,20 +1,31 @@
+import asyncio
 import os
 import re
-from typing import Any, Dict, Optional
+import threading
+import time
+from typing import Any, Dict, List, Optional
 from unittest import mock
 from uuid import uuid4
 
 import pytest
 
 from kolga.settings import settings
+from kolga.utils.environment import EnvironmentSnapshot, invalidate_environment
 from kolga.utils.general import (
     DEPLOY_NAME_MAX_HELM_NAME_LENGTH,
     camel_case_split,
     deep_get,
+    get_dependency_order,
     get_deploy_name,
     get_environment_vars_by_prefix,
     get_secret_name,
+    run_concurrently,
+    run_in_thread,
+    run_os_command,
+    run_os_command_async,
+    stream_os_command,
 )
+from kolga.utils.logger import logger
 
 DEFAULT_TRACK = os.environ.get("DEFAULT_TRACK", "stable")
 
@@ -96,12 +107,43 @@ def test_get_environment_vars_by_prefix() -> None:
     env_vars = {f"{prefix}PASSWORD": "pass", f"{prefix}LIZARD": "-1"}
     secrets = {"PASSWORD": "pass", "LIZARD": "-1"}
 
+    assert get_environment_vars_by_prefix(prefix) == {}
     for key, secret in env_vars.items():
         os.environ[key] = secret
+    # The environment snapshot has to be invalidated to see the new variables
+    assert get_environment_vars_by_prefix(prefix) == {}
+    invalidate_environment()
 
     assert get_environment_vars_by_prefix(prefix) == secrets
 
 
+@pytest.mark.parametrize(
+    "prefix, expected",
+    [
+        ("K8S_SECRET_", {"K8S_SECRET_A": "1", "K8S_SECRET_B": "2"}),
+        ("K8S_SECRET_A", {"K8S_SECRET_A": "1"}),
+        ("K8S_", {"K8S_": "0", "K8S_SECRET_A": "1", "K8S_SECRET_B": "2"}),
+        ("", {"K8S_": "0", "K8S_SECRET_A": "1", "K8S_SECRET_B": "2", "PATH": "/"}),
+        ("K8S_SECRET_C", {}),
+        ("Z", {}),
+    ],
+)
+def test_environment_snapshot_get_prefixed(
+    prefix: str, expected: Dict[str, str]
+) -> None:
+    variables = {
+        "PATH": "/",
+        "K8S_SECRET_B": "2",
+        "K8S_": "0",
+        "K8S_SECRET_A": "1",
+    }
+    snapshot = EnvironmentSnapshot(variables)
+    variables["K8S_SECRET_C"] = "3"
+
+    assert snapshot.get_prefixed(prefix) == expected
+    assert list(snapshot) == sorted(snapshot)
+
+
 @pytest.mark.parametrize(
     "dictionary, keys, expected_value",
     [
@@ -118,3 +160,246 @@ def test_deep_get(
     dictionary: Dict[Any, Any], keys: str, expected_value: Optional[bool]
 ) -> None:
     assert deep_get(dictionary, keys) == expected_value
+
+
+def test_run_concurrently_results() -> None:
+    tasks = {str(i): (lambda i=i: i * 2) for i in range(5)}
+    assert run_concurrently(tasks, max_workers=3) == {str(i): i * 2 for i in range(5)}
+
+
+def test_run_concurrently_max_workers() -> None:
+    lock = threading.Lock()
+    running: List[int] = []
+    peak: List[int] = [0]
+
+    def task() -> None:
+        with lock:
+            running.append(1)
+            peak[0] = max(peak[0], len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    run_concurrently({str(i): task for i in range(6)}, max_workers=2)
+    assert peak[0] == 2
+
+
+def test_run_concurrently_first_failure() -> None:
+    started: List[str] = []
+
+    def failing() -> None:
+        started.append("failing")
+        raise ValueError("lizard")
+
+    def slow() -> None:
+        started.append("slow")
+        time.sleep(0.1)
+
+    def pending() -> None:
+        started.append("pending")
+
+    tasks = {"failing": failing, "slow": slow, "pending": pending}
+    with pytest.raises(ValueError):
+        run_concurrently(tasks, max_workers=2)
+
+    assert "pending" not in started
+
+
+def test_run_concurrently_grouped_output(capsys: Any) -> None:
+    def task(name: str) -> None:
+        for i in range(3):
+            logger.info(message=f"{name}-{i}")
+            time.sleep(0.01)
+
+    tasks = {name: (lambda name=name: task(name)) for name in ("a", "b")}
+    run_concurrently(tasks, max_workers=2)
+
+    lines = capsys.readouterr().out.split()
+    assert lines in (
+        ["a-0", "a-1", "a-2", "b-0", "b-1", "b-2"],
+        ["b-0", "b-1", "b-2", "a-0", "a-1", "a-2"],
+    )
+
+
+def test_run_concurrently_dependencies() -> None:
+    lock = threading.Lock()
+    events: List[str] = []
+
+    def task(name: str) -> str:
+        with lock:
+            events.append(f"start {name}")
+        time.sleep(0.05)
+        with lock:
+            events.append(f"end {name}")
+        return name
+
+    tasks = {
+        name: (lambda name=name: task(name))
+        for name in ("rabbitmq", "postgresql", "mysql")
+    }
+    results = run_concurrently(
+        tasks, max_workers=3, dependencies={"rabbitmq": ["postgresql"]}
+    )
+
+    assert results == {name: name for name in tasks}
+    # The independent services are deployed at the same time, the dependent
+    # one only after its dependency is done
+    assert set(events[:2]) == {"start postgresql", "start mysql"}
+    assert events.index("start rabbitmq") > events.index("end postgresql")
+
+
+def test_run_concurrently_failed_dependency() -> None:
+    started: List[str] = []
+
+    def failing() -> None:
+        started.append("failing")
+        raise ValueError("lizard")
+
+    def dependent() -> None:
+        started.append("dependent")
+
+    tasks = {"failing": failing, "dependent": dependent}
+    for max_workers in (1, 2):
+        with pytest.raises(ValueError):
+            run_concurrently(
+                tasks, max_workers=max_workers, dependencies={"dependent": ["failing"]}
+            )
+
+    assert started == ["failing", "failing"]
+
+
+@pytest.mark.parametrize(
+    "dependencies, expected",
+    [
+        ({"a": set(), "b": set()}, ["a", "b"]),
+        ({"a": {"b"}, "b": set(), "c": set()}, ["b", "c", "a"]),
+        ({"a": {"c"}, "b": {"a"}, "c": set()}, ["c", "a", "b"]),
+    ],
+)
+def test_get_dependency_order(
+    dependencies: Dict[str, Any], expected: List[str]
+) -> None:
+    assert get_dependency_order(dependencies) == expected
+
+
+@pytest.mark.parametrize(
+    "dependencies", [{"a": {"b"}, "b": {"a"}}, {"a": {"a"}}, {"a": {"lizard"}}]
+)
+def test_get_dependency_order_invalid(dependencies: Dict[str, Any]) -> None:
+    with pytest.raises(ValueError):
+        get_dependency_order(dependencies)
+
+
+def test_run_os_command_abort() -> None:
+    abort = threading.Event()
+    threading.Timer(0.1, abort.set).start()
+
+    start = time.monotonic()
+    result = run_os_command(["sleep", "10"], abort=abort)
+
+    assert result.return_code != 0
+    assert time.monotonic() - start < 5
+
+
+def test_run_os_command_without_abort() -> None:
+    result = run_os_command(["echo", "lizard"], abort=threading.Event())
+
+    assert result.return_code == 0
+    assert result.out == "lizard\n"
+
+
+def test_stream_os_command_callbacks() -> None:
+    stdout: List[str] = []
+    stderr: List[str] = []
+
+    result = stream_os_command(
+        ["sh", "-c", "echo out1; echo err1 >&2; echo out2"],
+        on_stdout=stdout.append,
+        on_stderr=stderr.append,
+    )
+
+    assert result.return_code == 0
+    assert stdout == ["out1", "out2"]
+    assert stderr == ["err1"]
+    assert result.out == "out1\nout2\n"
+    assert result.err == "err1\n"
+
+
+def test_stream_os_command_grouped_output(capsys: Any) -> None:
+    def log(line: str) -> None:
+        logger.info(message=line)
+
+    with logger.grouped():
+        stream_os_command(["echo", "out"], on_stdout=log)
+        logger.info(message="done")
+        # Nothing is printed before the group is complete
+        assert capsys.readouterr().out == ""
+
+    assert capsys.readouterr().out.split() == ["out", "done"]
+
+
+def test_stream_os_command_failing_callback() -> None:
+    def fail(line: str) -> None:
+        raise ValueError(line)
+
+    # More output than fits in a pipe buffer
+    result = stream_os_command(["seq", "1", "100000"], on_stdout=fail, timeout=10)
+
+    assert not result.timed_out
+    assert result.return_code == 0
+    assert result.out.endswith("100000\n")
+
+
+def test_stream_os_command_bounded_output() -> None:
+    result = stream_os_command(["seq", "1", "100"], max_lines=3)
+
+    assert result.out == "98\n99\n100\n"
+    assert result.omitted_lines == 97
+
+
+def test_stream_os_command_timeout() -> None:
+    start = time.monotonic()
+    # The background process belongs to the same process group
+    result = stream_os_command(["sh", "-c", "sleep 10 & sleep 10"], timeout=0.5)
+
+    assert result.timed_out
+    assert result.return_code != 0
+    assert time.monotonic() - start < 5
+
+
+def test_run_os_command_async() -> None:
+    result = asyncio.run(run_os_command_async(["sh", "-c", "echo out; echo err >&2"]))
+
+    assert result.return_code == 0
+    assert result.out == "out\n"
+    assert result.err == "err\n"
+
+
+def test_run_os_command_async_cancelled() -> None:
+    async def cancel() -> None:
+        task = asyncio.ensure_future(run_os_command_async(["sleep", "10"]))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.monotonic()
+    asyncio.run(cancel())
+    assert time.monotonic() - start < 5
+
+
+def test_run_in_thread_grouped_output(capsys: Any) -> None:
+    def task(name: str) -> str:
+        logger.info(message=f"{name}-1")
+        time.sleep(0.1)
+        logger.info(message=f"{name}-2")
+        return name
+
+    async def run_all() -> List[str]:
+        return list(
+            await asyncio.gather(run_in_thread(task, "a"), run_in_thread(task, "b"))
+        )
+
+    assert asyncio.run(run_all()) == ["a", "b"]
+    lines = capsys.readouterr().out.split()
+    assert lines in (["a-1", "a-2", "b-1", "b-2"], ["b-1", "b-2", "a-1", "a-2"])
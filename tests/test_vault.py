@@ -0,0 +1,65 @@
+from typing import Any, Generator
+from unittest import mock
+
+import pytest
+
+from kolga.libs.vault import Vault
+
+from .testcase import override_settings
+
+SECRETS = {"data": {"PASSWORD": "lizard"}}
+
+
+@pytest.fixture()
+def vault() -> Generator[Vault, None, None]:
+    Vault.clear_cache()
+    yield Vault(track="review", vault_addr="http://vault:8200")
+    Vault.clear_cache()
+
+
+def test_get_secrets_not_initialized() -> None:
+    assert Vault(track="review", vault_addr="").get_secrets() == {}
+
+
+@mock.patch("hvac.api.secrets_engines.kv_v1.KvV1.read_secret", return_value=SECRETS)
+def test_get_secrets_cached(mock_read: Any, vault: Vault) -> None:
+    assert vault.get_secrets() == SECRETS["data"]
+    assert Vault(track="review", vault_addr="http://vault:8200").get_secrets() == (
+        SECRETS["data"]
+    )
+
+    mock_read.assert_called_once_with(path="testing-review", mount_point="secrets")
+    assert Vault.cache_info() == (1, 1, 1)
+
+
+@mock.patch("hvac.api.secrets_engines.kv_v1.KvV1.read_secret", return_value=SECRETS)
+def test_get_secrets_returns_copy(mock_read: Any, vault: Vault) -> None:
+    vault.get_secrets()["PASSWORD"] = "odin"
+    assert vault.get_secrets() == SECRETS["data"]
+
+
+@mock.patch("hvac.api.secrets_engines.kv_v1.KvV1.read_secret", return_value=SECRETS)
+def test_get_secrets_ttl(mock_read: Any, vault: Vault) -> None:
+    vault.cache_ttl = 0
+    vault.get_secrets()
+    vault.get_secrets()
+
+    assert mock_read.call_count == 2
+    assert Vault.cache_info().misses == 2
+
+
+@mock.patch("hvac.api.secrets_engines.kv_v1.KvV1.read_secret", return_value=SECRETS)
+def test_get_secrets_cache_key(mock_read: Any, vault: Vault) -> None:
+    vault.get_secrets()
+    with override_settings(VAULT_KV_SECRET_MOUNT_POINT="other"):
+        vault.get_secrets()
+
+    assert mock_read.call_count == 2
+
+
+@mock.patch("hvac.api.secrets_engines.kv_v1.KvV1.read_secret", return_value=SECRETS)
+def test_get_secrets_for_paths(mock_read: Any, vault: Vault) -> None:
+    secrets = vault.get_secrets_for_paths(["odin", "thor", "odin"])
+
+    assert secrets == {"odin": SECRETS["data"], "thor": SECRETS["data"]}
+    assert mock_read.call_count == 2